@@ -0,0 +1,179 @@
+"""
+helpers shared by the benchmark scripts of the repository: scales, synthetic
+Zipf words, latency percentiles, peak RSS and json reports, common command line
+"""
+import math
+import random
+import sys
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, ArgumentTypeError
+from itertools import accumulate
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_SCALES = ("10k",)
+DEFAULT_SEED = 42
+DEFAULT_QUERIES = 1000
+DEFAULT_TOP_K = 10
+ZIPF_EXPONENT = 1.1
+SCALE_SUFFIXES = {"k": 10 ** 3, "m": 10 ** 6}
+WORD_ALPHABET = "abcdefghijklmnopqrstuvwxyz"
+LATENCY_PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def parse_scale(value: str) -> int:
+    """
+    number of items of benchmark with optional k or M suffix
+    :param value: string like 10000, 10k or 10M
+    :return: number of items, documents or posts
+    """
+    multiplier = SCALE_SUFFIXES.get(value[-1:].lower(), 1)
+    number = value[:-1] if multiplier > 1 else value
+    try:
+        scale = int(number) * multiplier
+    except ValueError:
+        raise ArgumentTypeError(f"{value!r} is not a number") from None
+    if scale <= 0:
+        raise ArgumentTypeError(f"{value!r} is not a positive number")
+    return scale
+
+
+def synthetic_word(rank: int) -> str:
+    """
+    word of synthetic vocabulary, words of close ranks share prefixes
+    :param rank: rank of word by frequency
+    :return: word of at least three letters
+    """
+    letters = []
+    rank += len(WORD_ALPHABET) ** 2
+    while rank:
+        rank, letter = divmod(rank, len(WORD_ALPHABET))
+        letters.append(WORD_ALPHABET[letter])
+    return "".join(reversed(letters))
+
+
+class ZipfSampler:
+    """
+    seeded sampler of synthetic words with frequencies following Zipf's law
+    """
+    def __init__(self, vocabulary_size: int, seed: int, exponent: float = ZIPF_EXPONENT):
+        self.words = [synthetic_word(rank) for rank in range(vocabulary_size)]
+        self._cum_weights = list(accumulate(1 / (rank + 1) ** exponent for rank in range(vocabulary_size)))
+        self.random = random.Random(seed)
+
+    def sample(self, count: int) -> list:
+        return self.random.choices(self.words, cum_weights=self._cum_weights, k=count)
+
+
+def peak_rss_kb():
+    """
+    peak resident set size of benchmark process and of its finished children
+    :return: pair of sizes in kilobytes, None where resource module is absent
+    """
+    if resource is None:
+        return None, None
+    divider = 1024 if sys.platform == "darwin" else 1
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // divider,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // divider,
+    )
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    """
+    nearest-rank percentile
+    :param sorted_values: sorted list of values
+    :param fraction: percentile in [0, 1]
+    :return: value, 0.0 for empty list
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def latency_stats(latencies: list) -> dict:
+    """
+    throughput and nearest-rank percentiles of latencies
+    :param latencies: latencies of single operations in seconds
+    :return: dict with operations per second and percentiles in milliseconds
+    """
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    stats = {
+        "operations": len(latencies),
+        "seconds": total,
+        "operations_per_second": len(latencies) / total if total else 0.0,
+    }
+    for fraction in LATENCY_PERCENTILES:
+        stats[f"p{round(fraction * 100)}_ms"] = percentile(latencies, fraction) * 1000
+    stats["max_ms"] = latencies[-1] * 1000 if latencies else 0.0
+    return stats
+
+
+class BenchmarkReport:
+    """
+    collects stages of benchmark as flat json records with common fields and
+    peak RSS so far, every record is written at once so long runs report progress
+    """
+    def __init__(self, name: str, writer = None, **common):
+        self.name = name
+        self.writer = writer
+        self.common = common
+        self.records = []
+
+    def add(self, stage: str, **fields) -> dict:
+        rss, children_rss = peak_rss_kb()
+        record = {"benchmark": self.name, "stage": stage, **self.common, **fields,
+                  "peak_rss_kb": rss, "children_peak_rss_kb": children_rss}
+        self.records.append(record)
+        if self.writer is not None:
+            self.writer.write(record)
+            self.writer.flush()
+        return record
+
+
+def time_queries(run_query, queries) -> dict:
+    """
+    latencies of queries answered one by one
+    :param run_query: function of one query returning list of answers
+    :param queries: queries to pass to run_query
+    :return: dict of latency_stats with total number of answers
+    """
+    latencies = []
+    answers = 0
+    for query in queries:
+        start = time.perf_counter()
+        answers += len(run_query(query))
+        latencies.append(time.perf_counter() - start)
+    return dict(latency_stats(latencies), answers=answers)
+
+
+def benchmark_argument_parser(prog: str, description: str, items: str, default_vocabulary_size: int,
+                              default_length: int) -> ArgumentParser:
+    """
+    parser of flags common to every benchmark, scripts add their own flags to it
+    :param prog: name of benchmark program
+    :param description: description of benchmark
+    :param items: what scales count, documents or posts
+    :param default_vocabulary_size: default number of distinct words
+    :param default_length: default average number of words in item
+    :return: class ArgumentParser
+    """
+    parser = ArgumentParser(prog=prog, description=description, formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "-n", "--scales", nargs="+", type=parse_scale, default=[parse_scale(scale) for scale in DEFAULT_SCALES],
+        help=f"numbers of {items} to benchmark, k and M suffixes are allowed",
+    )
+    parser.add_argument("--vocabulary-size", type=int, default=default_vocabulary_size, help="number of distinct words")
+    parser.add_argument("-l", "--length", type=int, default=default_length, help=f"average words in one of {items}")
+    parser.add_argument("-q", "--queries", type=int, default=DEFAULT_QUERIES, help="number of queries of every kind")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="seed of generated data and queries")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="processes of parallel build, 1 skips it")
+    parser.add_argument("-k", "--top-k", type=int, default=DEFAULT_TOP_K, help="size of top answers")
+    parser.add_argument("--workdir", default=None, help="directory for temporary files")
+    parser.add_argument("-o", "--output", default=None, help="path to write json lines to instead of stdout")
+    return parser
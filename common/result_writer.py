@@ -0,0 +1,83 @@
+"""
+buffered output of answers shared by the command line tools of the repository
+"""
+import json
+import struct
+import sys
+from collections.abc import Sequence
+
+OUTPUT_FORMATS = ("text", "ndjson", "binary")
+DEFAULT_OUTPUT_FORMAT = "text"
+DEFAULT_WRITE_BUFFER_SIZE = 1 << 20
+RESULT_RECORD_HEADER_FORMAT = ">I"
+
+
+def encode_payload(answer) -> bytes:
+    """
+    text form of answer: comma separated items of a list answer, json of any other answer
+    :param answer: list of ids or json serializable answer
+    :return: utf-8 payload
+    """
+    if isinstance(answer, Sequence) and not isinstance(answer, str):
+        return ",".join(map(str, answer)).encode('utf-8')
+    return json.dumps(answer, ensure_ascii=False).encode('utf-8')
+
+
+class ResultWriter:
+    """
+    buffered writer of answers to stdout or file: text lines of encode_payload,
+    json lines or binary records of encode_payload prefixed by its utf-8 length;
+    answers are written by large blocks
+    """
+    def __init__(self, path: str = None, output_format: str = DEFAULT_OUTPUT_FORMAT,
+                 buffer_size: int = DEFAULT_WRITE_BUFFER_SIZE):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"unknown output format {output_format}")
+        self.output_format = output_format
+        self.buffer_size = buffer_size
+        if path is None:
+            sys.stdout.flush()
+            self._stream = sys.stdout.buffer
+        else:
+            self._stream = open(path, "wb")
+        self._owns_stream = path is not None
+        self._chunks = []
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _format(self, answer) -> bytes:
+        if self.output_format == "ndjson":
+            return json.dumps(answer, ensure_ascii=False).encode('utf-8') + b"\n"
+        payload = encode_payload(answer)
+        if self.output_format == "binary":
+            return struct.pack(RESULT_RECORD_HEADER_FORMAT, len(payload)) + payload
+        return payload + b"\n"
+
+    def write(self, answer):
+        """
+        add answer to buffer, buffer is written when it is full
+        :param answer: list of ids or json serializable answer
+        :return: nothing
+        """
+        chunk = self._format(answer)
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._chunks:
+            self._stream.write(b"".join(self._chunks))
+            self._chunks = []
+            self._size = 0
+        self._stream.flush()
+
+    def close(self):
+        self.flush()
+        if self._owns_stream:
+            self._stream.close()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+import os
+import platform
+import random
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+from task_Voloskov_Ivan_inverted_index import InvertedIndex, StoragePolicy, MmapStoragePolicy, ResultWriter,\
+    build_inverted_index, build_inverted_index_parallel, iter_documents, LEGACY_MAX_DOC_ID,\
+    DEFAULT_WRITE_BUFFER_SIZE
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from benchmark_tools import ZipfSampler, BenchmarkReport, parse_scale, time_queries, benchmark_argument_parser,\
+    DEFAULT_SEED, DEFAULT_QUERIES, DEFAULT_TOP_K
+
+BENCHMARK_NAME = "inverted_index"
+DEFAULT_VOCABULARY_SIZE = 50000
+DEFAULT_DOC_LENGTH = 100
+
+
+def generate_corpus(filepath: str, docs: int, vocabulary_size: int = DEFAULT_VOCABULARY_SIZE,
+                    doc_length: int = DEFAULT_DOC_LENGTH, seed: int = DEFAULT_SEED) -> int:
+    """
+    write reproducible corpus in dataset format: doc id, tab and text on every line
+    :param filepath: path to write corpus to
+    :param docs: number of documents
+    :param vocabulary_size: number of distinct words
+    :param doc_length: average number of words in document
+    :param seed: seed of random generator, the same seed gives the same corpus
+    :return: size of corpus in bytes
+    """
+    sampler = ZipfSampler(vocabulary_size, seed)
+    length_random = random.Random(seed + 1)
+    with open(filepath, "w", encoding="utf-8", buffering=DEFAULT_WRITE_BUFFER_SIZE) as fout:
+        for doc_id in range(docs):
+            length = length_random.randint(doc_length // 2 + 1, doc_length * 3 // 2 + 1)
+            fout.write(f"{doc_id}\t{' '.join(sampler.sample(length))}\n")
+    return os.path.getsize(filepath)
+
+
+def generate_queries(count: int, vocabulary_size: int = DEFAULT_VOCABULARY_SIZE, seed: int = DEFAULT_SEED) -> list:
+    """
+    reproducible queries of one to three words drawn by the same law as corpus
+    :param count: number of queries
+    :param vocabulary_size: number of distinct words of corpus
+    :param seed: seed of random generator
+    :return: list of queries, each of them is list of words
+    """
+    sampler = ZipfSampler(vocabulary_size, seed + 2)
+    return [sampler.sample(sampler.random.randint(1, 3)) for _ in range(count)]
+
+
+def run_queries(report: BenchmarkReport, index_name: str, inverted_index, queries, top_k: int):
+    report.add("query", index=index_name, **time_queries(inverted_index.query, queries))
+    report.add(
+        "query_ranked", index=index_name, top_k=top_k,
+        **time_queries(lambda words: inverted_index.query_ranked(words, top_k), queries),
+    )
+    prefixes = [[words[0][:3] + "*"] for words in queries]
+    report.add("query_wildcard", index=index_name, **time_queries(inverted_index.query, prefixes))
+
+
+def benchmark_scale(report: BenchmarkReport, workdir: str, docs: int, vocabulary_size: int,
+                    doc_length: int, queries_count: int, seed: int, workers: int, top_k: int):
+    """
+    run every stage of benchmark for corpus of one scale
+    :param report: class BenchmarkReport to add records to
+    :param workdir: directory for corpus and dumped indexes
+    :param docs: number of documents
+    :param vocabulary_size: number of distinct words
+    :param doc_length: average number of words in document
+    :param queries_count: number of queries of every kind
+    :param seed: seed of corpus and queries
+    :param workers: number of processes of parallel build, 1 skips it
+    :param top_k: number of documents of ranked queries
+    :return: nothing
+    """
+    report.common.update(docs=docs)
+    corpus_path = os.path.join(workdir, f"corpus{docs}.txt")
+    start = time.perf_counter()
+    corpus_size = generate_corpus(corpus_path, docs, vocabulary_size, doc_length, seed)
+    seconds = time.perf_counter() - start
+    report.add("generate", seconds=seconds, bytes=corpus_size, docs_per_second=docs / seconds)
+
+    start = time.perf_counter()
+    inverted_index = build_inverted_index(iter_documents(corpus_path))
+    seconds = time.perf_counter() - start
+    report.add(
+        "build", seconds=seconds, docs_per_second=docs / seconds,
+        megabytes_per_second=corpus_size / seconds / 2 ** 20, terms=len(inverted_index.index),
+    )
+    if workers > 1:
+        start = time.perf_counter()
+        build_inverted_index_parallel(corpus_path, os.path.join(workdir, f"parallel{docs}.index"), workers)
+        seconds = time.perf_counter() - start
+        report.add("build_parallel", workers=workers, seconds=seconds, docs_per_second=docs / seconds)
+
+    queries = generate_queries(queries_count, vocabulary_size, seed)
+    run_queries(report, "memory", inverted_index, queries, top_k)
+
+    policies = [("mmap", MmapStoragePolicy)]
+    if docs <= LEGACY_MAX_DOC_ID:
+        policies.append(("legacy", StoragePolicy))
+    else:
+        report.add("dump", index="legacy", skipped=f"doc ids above {LEGACY_MAX_DOC_ID} do not fit StoragePolicy")
+    for index_name, storage_policy in policies:
+        index_path = os.path.join(workdir, f"{index_name}{docs}.index")
+        start = time.perf_counter()
+        inverted_index.dump(index_path, storage_policy)
+        seconds = time.perf_counter() - start
+        index_size = os.path.getsize(index_path)
+        report.add(
+            "dump", index=index_name, seconds=seconds, bytes=index_size,
+            megabytes_per_second=index_size / seconds / 2 ** 20,
+        )
+        start = time.perf_counter()
+        loaded_index = InvertedIndex.load(index_path, storage_policy)
+        report.add("load", index=index_name, seconds=time.perf_counter() - start)
+        run_queries(report, index_name, loaded_index, queries, top_k)
+        loaded_index.close()
+
+
+def run_benchmark(scales, vocabulary_size: int = DEFAULT_VOCABULARY_SIZE, doc_length: int = DEFAULT_DOC_LENGTH,
+                  queries_count: int = DEFAULT_QUERIES, seed: int = DEFAULT_SEED, workers: int = 1,
+                  top_k: int = DEFAULT_TOP_K, workdir: str = None, writer = None) -> list:
+    """
+    benchmark build, dump, load and queries of inverted index on synthetic corpora
+    :param scales: numbers of documents of corpora
+    :param vocabulary_size: number of distinct words
+    :param doc_length: average number of words in document
+    :param queries_count: number of queries of every kind
+    :param seed: seed of corpora and queries
+    :param workers: number of processes of parallel build, 1 skips it
+    :param top_k: number of documents of ranked queries
+    :param workdir: directory for corpora and indexes, temporary directory by default
+    :param writer: class ResultWriter to write records as soon as they are ready
+    :return: list of records of stages
+    """
+    report = BenchmarkReport(
+        BENCHMARK_NAME, writer, seed=seed, vocabulary_size=vocabulary_size, doc_length=doc_length,
+        python=platform.python_version(), platform=platform.platform(),
+    )
+    with TemporaryDirectory(dir=workdir) as tmpdir:
+        for docs in scales:
+            benchmark_scale(report, tmpdir, docs, vocabulary_size, doc_length, queries_count, seed, workers, top_k)
+    return report.records
+
+
+def main():
+    """
+    benchmark of inverted index, writes json line for every stage
+    :return:
+    """
+    parser = benchmark_argument_parser(
+        "inverted-index-benchmark", "reproducible benchmark of inverted index on synthetic corpora",
+        "documents", DEFAULT_VOCABULARY_SIZE, DEFAULT_DOC_LENGTH,
+    )
+    arguments = parser.parse_args()
+    with ResultWriter(arguments.output, "ndjson") as writer:
+        run_benchmark(
+            arguments.scales, arguments.vocabulary_size, arguments.length, arguments.queries,
+            arguments.seed, arguments.workers, arguments.top_k, arguments.workdir, writer,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+import socket
+import sys
+import threading
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+DEFAULT_SERVER_HOST = "127.0.0.1"
+DEFAULT_SERVER_PORT = 9876
+STATS_REQUEST = "!stats"
+
+
+def _send_queries(connection, queries):
+    connection.sendall("".join(f"{query}\n" for query in queries).encode('utf-8'))
+    connection.shutdown(socket.SHUT_WR)
+
+
+def query_server(queries, host: str = DEFAULT_SERVER_HOST, port: int = DEFAULT_SERVER_PORT) -> list:
+    """
+    send all queries to inverted index server at once and read answers
+    :param queries: list of query lines, words are separated by spaces
+    :param host: host of server
+    :param port: port of server
+    :return: list of answer lines in the same order
+    """
+    with socket.create_connection((host, port)) as connection:
+        # requests are pipelined from another thread, so a long batch can not
+        # deadlock on full socket buffers while answers are read here
+        sender = threading.Thread(target=_send_queries, args=(connection, queries))
+        sender.start()
+        with connection.makefile("r", encoding="utf-8", newline="\n") as fin:
+            answers = [fin.readline().rstrip("\n") for _ in queries]
+        sender.join()
+    return answers
+
+
+def main():
+    """
+    lightweight client of inverted-index serve command
+    :return:
+    """
+    parser = ArgumentParser(
+        description="client to query inverted index server",
+        prog="inverted-index-client",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--host", default=DEFAULT_SERVER_HOST, help="host of inverted index server")
+    parser.add_argument("--port", type=int, default=DEFAULT_SERVER_PORT, help="port of inverted index server")
+    parser.add_argument(
+        "-q", "--query", nargs="+", action='append',
+        help="query words, queries are read from stdin if not provided",
+    )
+    parser.add_argument("--stats", action="store_true", help="print latency and cache stats of server")
+    arguments = parser.parse_args()
+    if arguments.stats:
+        queries = [STATS_REQUEST]
+    elif arguments.query:
+        queries = [" ".join(query) for query in arguments.query]
+    else:
+        queries = [line.strip() for line in sys.stdin]
+    for answer in query_server(queries, arguments.host, arguments.port):
+        print(answer)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,67 @@
 #!/usr/bin/env python3
+import asyncio
+import glob
+import heapq
+import json
+import math
+import mmap
+import os
+import re
 import struct
 import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict, deque, namedtuple
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate, chain, groupby, islice, takewhile
+from operator import itemgetter
+from tempfile import TemporaryDirectory
 from io import TextIOWrapper
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, FileType, ArgumentTypeError
 import logging
 import yaml
 import logging.config
 
+from inverted_index_client import DEFAULT_SERVER_HOST, DEFAULT_SERVER_PORT, STATS_REQUEST
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from result_writer import ResultWriter, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT, DEFAULT_WRITE_BUFFER_SIZE
+from benchmark_tools import percentile
+
 APPLICATION_NAME = "inverted_index"
 DEFAULT_DATASET_PATH="small_wikipedia.sample"
 DEFAULT_INVERTED_INDEX_STORE_PATH = "inverted.index"
 DEFAULT_LOGGING_CONFIG_FILEPATH = "logging.conf.yml"
+DEFAULT_BUILD_WORKERS = 1
+DEFAULT_BUILD_CHUNK_SIZE = 50000
+DEFAULT_READ_BUFFER_SIZE = 1 << 20
+DEFAULT_MAX_SEGMENTS = 8
+SEGMENT_SUFFIX = ".seg"
+DEFAULT_TOP_K = 10
+DEFAULT_QUERY_CACHE_SIZE = 0
+DEFAULT_REFRESH_INTERVAL = 5.0
+LATENCY_WINDOW_SIZE = 100000
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+MMAP_INDEX_MAGIC = b"INVX"
+MMAP_INDEX_VERSION = 1
+MMAP_DOC_OFFSET_FORMAT = ">Q"
+MAX_DOC_ID = 0xFFFFFFFF
+LEGACY_MAX_DOC_ID = 0xFFFF
+MMAP_HEADER_FORMAT = ">4sHH"
+MMAP_FLAG_POSITIONAL = 1
+MMAP_FOOTER_FORMAT = ">QI4s"
+MMAP_SECTION_FORMAT = ">4sQQ"
+MMAP_TERMS_COUNT_FORMAT = ">Q"
+MMAP_TERM_BLOCK_OFFSET_FORMAT = ">QQ"
+TERM_FIELDS_COUNT = 3
+POSITIONAL_TERM_FIELDS_COUNT = 5
+TERM_BLOCK_SIZE = 16
+WILDCARD = "*"
+MMAP_DOC_LENGTHS_HEADER_FORMAT = ">Q"
 
 logger = logging.getLogger(APPLICATION_NAME)
 
@@ -29,122 +80,1780 @@ class EncodedFileType(FileType):
                 msg = 'argument "-" with mode %r' % self._mode
                 raise ValueError(msg)
 
-        try:
-            return open(string, self._mode, self._bufsize, self._encoding, self._errors)
-        except OSError as e:
-            message = "can't open '%s': %s"
-            raise ArgumentTypeError(message % (message, e)) from e
+        try:
+            return open(string, self._mode, self._bufsize, self._encoding, self._errors)
+        except OSError as e:
+            message = "can't open '%s': %s"
+            raise ArgumentTypeError(message % (message, e)) from e
+
+def is_utf8(s):
+    """
+    check for string in utf-8
+    """
+    if s and max(s) > "\u0100":
+        return 0
+    return 1
+
+
+TOKEN_PATTERN = re.compile(r"\w+")
+STEM_VOWELS_PATTERN = re.compile(r"[aeiouy]")
+STEM_SUFFIXES = ("ingly", "edly", "ing", "ed", "ly")
+
+
+def light_stem(term: str) -> str:
+    """
+    light english suffix stripping: plurals first, then -ing, -ed and -ly
+    endings when the rest of the word still has a vowel
+    :param term: lowercase term
+    :return: stemmed term
+    """
+    if len(term) > 4 and term.endswith("ies"):
+        term = term[:-3] + "y"
+    elif term.endswith("sses"):
+        term = term[:-2]
+    elif len(term) > 3 and term.endswith("s") and not term.endswith(("ss", "us", "is")):
+        term = term[:-1]
+    for suffix in STEM_SUFFIXES:
+        if term.endswith(suffix) and len(term) - len(suffix) >= 3 \
+                and STEM_VOWELS_PATTERN.search(term, 0, len(term) - len(suffix)):
+            term = term[:-len(suffix)]
+            if term[-1] == term[-2] and term[-1] not in "lsz":
+                term = term[:-1]
+            break
+    return term
+
+
+class Analyzer:
+    """
+    analysis pipeline shared by documents and queries: lowercasing,
+    punctuation stripping, stop words and stemming; default analyzer
+    only splits text by whitespaces, normalized terms are memoized and interned
+    """
+    def __init__(self, lowercase: bool = False, strip_punctuation: bool = False,
+                 stop_words = (), stem: bool = False):
+        self.lowercase = lowercase
+        self.strip_punctuation = strip_punctuation
+        self.stop_words = frozenset(stop_words)
+        self.stem = stem
+        self.is_default = not (lowercase or strip_punctuation or self.stop_words or stem)
+        self._terms = {}
+
+    def config(self) -> dict:
+        return {
+            "lowercase": self.lowercase,
+            "strip_punctuation": self.strip_punctuation,
+            "stop_words": sorted(self.stop_words),
+            "stem": self.stem,
+        }
+
+    @classmethod
+    def from_config(cls, config):
+        if not config:
+            return DEFAULT_ANALYZER
+        return cls(**config)
+
+    def __eq__(self, other):
+        return isinstance(other, Analyzer) and self.config() == other.config()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_terms"] = {}
+        return state
+
+    def _normalize(self, token: str):
+        if token in self.stop_words:
+            return None
+        if self.stem:
+            token = light_stem(token)
+        return sys.intern(token)
+
+    def analyze(self, text: str) -> list:
+        """
+        split text into normalized terms
+        :param text: document or query text
+        :return: list of terms in text order
+        """
+        if self.is_default:
+            return text.split()
+        if self.lowercase:
+            text = text.lower()
+        tokens = TOKEN_PATTERN.findall(text) if self.strip_punctuation else text.split()
+        terms = self._terms
+        answer = []
+        for token in tokens:
+            try:
+                term = terms[token]
+            except KeyError:
+                term = terms[token] = self._normalize(token)
+            if term is not None:
+                answer.append(term)
+        return answer
+
+    def analyze_query(self, query):
+        """
+        apply pipeline to parsed query, stop words are dropped
+        :param query: list of words, list of Phrase and Near clauses or boolean tree
+        :return: query of the same kind, None for boolean query without terms
+        """
+        if self.is_default:
+            return query
+        if isinstance(query, BOOLEAN_NODES):
+            return self._analyze_tree(query)
+        if is_positional(query):
+            clauses = []
+            for clause in query:
+                if isinstance(clause, Near):
+                    left, right = self._analyze_phrase(clause.left), self._analyze_phrase(clause.right)
+                    if left.words and right.words:
+                        clauses.append(Near(left, right, clause.distance))
+                    else:
+                        clauses.extend(phrase for phrase in (left, right) if phrase.words)
+                else:
+                    phrase = self._analyze_phrase(clause)
+                    if phrase.words:
+                        clauses.append(phrase)
+            return clauses
+        return self.analyze(" ".join(query))
+
+    def _analyze_phrase(self, phrase):
+        return Phrase(self.analyze(" ".join(phrase.words)))
+
+    def _analyze_tree(self, node):
+        if isinstance(node, Wildcard):
+            # patterns are only lowercased, stemming would break their prefixes
+            return Wildcard(node.pattern.lower()) if self.lowercase else node
+        if isinstance(node, Term):
+            terms = self.analyze(node.word)
+            if len(terms) > 1:
+                return And([Term(term) for term in terms])
+            return Term(terms[0]) if terms else None
+        if isinstance(node, Not):
+            child = self._analyze_tree(node.child)
+            return Not(child) if child is not None else None
+        children = [child for child in map(self._analyze_tree, node.children) if child is not None]
+        if not children:
+            return None
+        return type(node)(children) if len(children) > 1 else children[0]
+
+
+DEFAULT_ANALYZER = Analyzer()
+
+
+def load_stop_words(filepath: str) -> list:
+    """
+    read stop words separated by whitespaces
+    :param filepath: path to utf-8 file
+    :return: list of stop words
+    """
+    with open(filepath, encoding="utf-8") as stop_words_file:
+        return stop_words_file.read().split()
+
+class StoragePolicy:
+    """Policy for storage inverted index
+    """
+    @staticmethod
+    def dump(word_to_docs_mapping, filepath: str):
+        """algorithm to store inverted index
+
+        :param word_to_docs_mapping: inverted_index
+        :param filepath: path to save inverted index
+        :return: nothing
+        """
+        with open(filepath, "wb") as write_file:
+            d = struct.pack('>I', len(word_to_docs_mapping.index))
+            write_file.write(d)
+            for key in word_to_docs_mapping.index:
+                if (is_utf8(key) == 1):
+                    write_file.write(struct.pack('>B', 1))
+                    len_key = len(key.encode('utf-8'))
+                    write_file.write(struct.pack('>H', len_key))
+                    word = struct.pack('>{}s'.format(len_key), key.encode('utf-8'))
+                    write_file.write(word)
+                else:
+                    write_file.write(struct.pack('>B', 0))
+                    len_key = len(key.encode('utf-16'))
+                    write_file.write(struct.pack('>H', len_key))
+                    word = struct.pack('>{}s'.format(len_key), key.encode('utf-16'))
+                    write_file.write(word)
+                d = struct.pack('>H', len(word_to_docs_mapping.index[key]))
+                write_file.write(d)
+                for internal_id in word_to_docs_mapping.index[key]:
+                    item = word_to_docs_mapping.doc_ids[internal_id]
+                    if int(item) > LEGACY_MAX_DOC_ID:
+                        raise ValueError(
+                            f"doc id {item} does not fit StoragePolicy, use MmapStoragePolicy instead"
+                        )
+                    d = struct.pack('>H', int(item))
+                    write_file.write(d)
+
+    @staticmethod
+    def load(filepath: str):
+        """algorithm to load inverted index
+
+        :param filepath: path to saved inverted index
+        :return: class InvertedIndex
+        """
+        cls = InvertedIndex()
+        external_index = {}
+        with open(filepath, "rb") as read_file:
+            count = struct.unpack('>I', read_file.read(4))
+            for i in range(int(count[0])):
+                flag = struct.unpack('>B', read_file.read(1))
+                l = struct.unpack('>H', read_file.read(2))
+                d = read_file.read(l[0])
+                code = struct.unpack('>{}s'.format(l[0]), d)
+                if flag[0] == 1:
+                    key = code[0].decode('utf-8')
+                else:
+                    key = code[0].decode('utf-16')
+                c = struct.unpack('>H', read_file.read(2))
+                external_index[key] = struct.unpack('>{}H'.format(c[0]), read_file.read(2 * c[0]))
+        numbers = sorted(set().union(*external_index.values()))
+        internal_ids = {number: internal_id for internal_id, number in enumerate(numbers)}
+        cls.doc_ids = [f'{number}' for number in numbers]
+        for key, postings in external_index.items():
+            cls.index[key] = array('I', sorted(internal_ids[number] for number in postings))
+        return cls
+
+
+def gallop_to(postings, doc_id: int, low: int = 0) -> int:
+    """
+    exponential search of first position with value >= doc_id
+    :param postings: sorted doc ids
+    :param doc_id: doc id to search
+    :param low: position to start from, all values before it are < doc_id
+    :return: position in postings, len(postings) if there is no such value
+    """
+    size = len(postings)
+    bound = 1
+    while low + bound < size and postings[low + bound] < doc_id:
+        bound <<= 1
+    return bisect_left(postings, doc_id, low + (bound >> 1), min(low + bound + 1, size))
+
+
+def intersect_postings(small, large) -> array:
+    """
+    galloping intersection of two sorted postings, neither of them is modified
+    :param small: sorted doc ids, the shorter postings
+    :param large: sorted doc ids, the longer postings
+    :return: array of common doc ids
+    """
+    answer = array('I')
+    size = len(large)
+    position = 0
+    for doc_id in small:
+        position = gallop_to(large, doc_id, position)
+        if position == size:
+            break
+        if large[position] == doc_id:
+            answer.append(doc_id)
+    return answer
+
+
+def encode_varints(numbers) -> bytes:
+    """
+    encode non-negative numbers as LEB128 varints
+    :param numbers: iterable of numbers
+    :return: encoded bytes
+    """
+    encoded = bytearray()
+    for number in numbers:
+        while number >= 0x80:
+            encoded.append(number & 0x7F | 0x80)
+            number >>= 7
+        encoded.append(number)
+    return bytes(encoded)
+
+
+def decode_varints(raw) -> list:
+    """
+    decode whole block of LEB128 varints
+    :param raw: encoded bytes
+    :return: list of numbers
+    """
+    raw = bytes(raw)
+    if not raw or max(raw) < 0x80:
+        # every number fits into one byte
+        return list(raw)
+    numbers = []
+    value = shift = 0
+    for byte in raw:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            numbers.append(value)
+            value = shift = 0
+    return numbers
+
+
+def read_varint(buffer, offset: int) -> tuple:
+    """
+    decode single LEB128 varint
+    :param buffer: encoded bytes
+    :param offset: offset of varint in buffer
+    :return: number and offset right after it
+    """
+    value = shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_term_block(terms, fields = None) -> bytes:
+    """
+    front-code block of sorted terms, every term is stored as length of prefix
+    shared with the previous one, length of the rest and the rest itself
+    followed by varints of its fields
+    :param terms: sorted encoded terms
+    :param fields: tuples of non-negative numbers aligned with terms, none by default
+    :return: encoded bytes
+    """
+    encoded = bytearray()
+    previous = b""
+    for number, term in enumerate(terms):
+        shared = len(os.path.commonprefix((previous, term)))
+        encoded += encode_varints((shared, len(term) - shared))
+        encoded += term[shared:]
+        if fields is not None:
+            encoded += encode_varints(fields[number])
+        previous = term
+    return bytes(encoded)
+
+
+def decode_term_block(buffer, offset: int, count: int, fields_count: int = 0) -> tuple:
+    """
+    decode front-coded block of terms
+    :param buffer: encoded bytes
+    :param offset: offset of block in buffer
+    :param count: number of terms to decode from the start of block
+    :param fields_count: number of fields stored after every term
+    :return: list of encoded terms and list of tuples of their fields
+    """
+    terms = []
+    fields = []
+    previous = b""
+    for _ in range(count):
+        shared, offset = read_varint(buffer, offset)
+        length, offset = read_varint(buffer, offset)
+        previous = previous[:shared] + buffer[offset:offset + length]
+        offset += length
+        terms.append(previous)
+        term_fields = []
+        for _ in range(fields_count):
+            value, offset = read_varint(buffer, offset)
+            term_fields.append(value)
+        fields.append(tuple(term_fields))
+    return terms, fields
+
+
+def wildcard_prefix(pattern: str) -> str:
+    return pattern.split(WILDCARD, 1)[0]
+
+
+def expand_wildcard(words, pattern: str) -> list:
+    """
+    words matching wildcard pattern, scan stops at the first word without literal prefix of pattern
+    :param words: sorted words starting from the first one not less than prefix of pattern
+    :param pattern: word with * standing for any sequence of characters
+    :return: list of matching words in sorted order
+    """
+    prefix = wildcard_prefix(pattern)
+    match = re.compile(".*".join(map(re.escape, pattern.split(WILDCARD))), re.DOTALL).fullmatch
+    return [word for word in takewhile(lambda word: word.startswith(prefix), words) if match(word)]
+
+
+def _deltas(postings):
+    previous = 0
+    for doc_id in sorted(int(item) for item in postings):
+        if doc_id > MAX_DOC_ID:
+            raise ValueError(f"doc id {doc_id} does not fit into 32 bits")
+        yield doc_id - previous
+        previous = doc_id
+
+
+def encode_postings(postings) -> bytes:
+    """
+    encode doc ids as sorted deltas in LEB128 varints
+    :param postings: iterable of doc ids
+    :return: encoded bytes
+    """
+    return encode_varints(_deltas(postings))
+
+
+def decode_postings(raw) -> array:
+    """
+    decode whole block of varint deltas into array of doc ids
+    :param raw: encoded bytes
+    :return: array of doc ids
+    """
+    return array('I', accumulate(decode_varints(raw)))
+
+
+def encode_frequencies(frequencies) -> bytes:
+    """
+    encode frequencies sparsely, most of them are 1 and are not stored: only
+    pairs of gap between indexes and frequency above 1 are written as varints
+    :param frequencies: frequencies aligned with postings
+    :return: encoded bytes
+    """
+    pairs = []
+    previous = -1
+    for index, frequency in enumerate(frequencies):
+        if frequency != 1:
+            pairs += (index - previous - 1, frequency - 2)
+            previous = index
+    return encode_varints(pairs)
+
+
+def decode_frequencies(raw, count: int) -> array:
+    """
+    decode sparse frequencies block
+    :param raw: encoded bytes
+    :param count: number of postings
+    :return: array of frequencies aligned with postings
+    """
+    frequencies = array('I', [1]) * count
+    numbers = decode_varints(raw)
+    index = -1
+    for position in range(0, len(numbers), 2):
+        index += numbers[position] + 1
+        frequencies[index] = numbers[position + 1] + 2
+    return frequencies
+
+
+def _doc_lengths_from_postings(postings_with_frequencies, documents_count: int) -> array:
+    """
+    document length is the sum of frequencies of its words
+    :param postings_with_frequencies: iterable of postings and frequencies pairs
+    :param documents_count: number of documents
+    :return: array of document lengths
+    """
+    doc_lengths = array('I', [0]) * documents_count
+    for postings, frequencies in postings_with_frequencies:
+        for doc, frequency in zip(postings, frequencies):
+            doc_lengths[doc] += frequency
+    return doc_lengths
+
+
+class MappedDocTable(Sequence):
+    """internal id -> external doc id table on top of memory-mapped index file
+    """
+    def __init__(self, buffer, offsets_offset: int, blob_offset: int, size: int):
+        self._buffer = buffer
+        self._offsets_offset = offsets_offset
+        self._blob_offset = blob_offset
+        self._size = size
+        self._offset_size = struct.calcsize(MMAP_DOC_OFFSET_FORMAT)
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, internal_id):
+        if not 0 <= internal_id < self._size:
+            raise IndexError(internal_id)
+        position = self._offsets_offset + internal_id * self._offset_size
+        start, end = struct.unpack_from(">QQ", self._buffer, position)
+        return self._buffer[self._blob_offset + start:self._blob_offset + end].decode('utf-8')
+
+
+class MappedDocLengths(Sequence):
+    """internal id -> document length table on top of memory-mapped index file
+    """
+    def __init__(self, buffer, offset: int, length: int):
+        self._buffer = buffer
+        header_size = struct.calcsize(MMAP_DOC_LENGTHS_HEADER_FORMAT)
+        self.total, = struct.unpack_from(MMAP_DOC_LENGTHS_HEADER_FORMAT, buffer, offset)
+        self._offset = offset + header_size
+        self._size = (length - header_size) // 4
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, internal_id):
+        if not 0 <= internal_id < self._size:
+            raise IndexError(internal_id)
+        return struct.unpack_from('>I', self._buffer, self._offset + 4 * internal_id)[0]
+
+
+class _TermView(Sequence):
+    """sequence of encoded terms of mapped index read on demand, used for binary search
+    """
+    def __init__(self, term_at, size: int):
+        self._term_at = term_at
+        self._size = size
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, position):
+        return self._term_at(position)
+
+
+class MappedIndex(Mapping):
+    """read only word -> docs mapping on top of memory-mapped index file
+
+    Only header, footer and section directory are parsed on open, posting
+    blocks are decoded on demand. Terms are front-coded in blocks of
+    TERM_BLOCK_SIZE, first terms of blocks are binary searched and only one
+    block is decoded.
+    """
+    def __init__(self, filepath: str):
+        self._file = open(filepath, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, flags = struct.unpack_from(MMAP_HEADER_FORMAT, self._mmap, 0)
+        footer_size = struct.calcsize(MMAP_FOOTER_FORMAT)
+        directory_offset, sections_count, footer_magic = struct.unpack_from(
+            MMAP_FOOTER_FORMAT, self._mmap, len(self._mmap) - footer_size
+        )
+        if magic != MMAP_INDEX_MAGIC or footer_magic != MMAP_INDEX_MAGIC:
+            raise ValueError(f"{filepath} is not a memory-mapped inverted index")
+        if self.version != MMAP_INDEX_VERSION:
+            raise ValueError(f"unsupported inverted index version {self.version}")
+        self._sections = {}
+        section_size = struct.calcsize(MMAP_SECTION_FORMAT)
+        for i in range(sections_count):
+            name, offset, length = struct.unpack_from(
+                MMAP_SECTION_FORMAT, self._mmap, directory_offset + i * section_size
+            )
+            self._sections[name] = (offset, length)
+        self.positional = bool(flags & MMAP_FLAG_POSITIONAL)
+        self._fields_count = POSITIONAL_TERM_FIELDS_COUNT if self.positional else TERM_FIELDS_COUNT
+        self._terms_offset = self._sections[b"TDIC"][0]
+        block_offsets_offset, block_offsets_length = self._sections[b"TBIX"]
+        self._terms_count, = struct.unpack_from(MMAP_TERMS_COUNT_FORMAT, self._mmap, block_offsets_offset)
+        self._block_offsets_offset = block_offsets_offset + struct.calcsize(MMAP_TERMS_COUNT_FORMAT)
+        self._blocks_count = (block_offsets_length - struct.calcsize(MMAP_TERMS_COUNT_FORMAT)) \
+            // struct.calcsize(MMAP_TERM_BLOCK_OFFSET_FORMAT)
+        self._block_firsts = _TermView(self._block_first, self._blocks_count)
+        self._cached_block = (-1, [], [])
+        offsets_offset, offsets_length = self._sections[b"DOFF"]
+        self.doc_ids = MappedDocTable(
+            self._mmap, offsets_offset, self._sections[b"DBLB"][0],
+            offsets_length // struct.calcsize(MMAP_DOC_OFFSET_FORMAT) - 1,
+        )
+        self.doc_lengths = MappedDocLengths(self._mmap, *self._sections[b"LENS"])
+        meta_offset, meta_length = self._sections[b"META"]
+        self.meta = json.loads(self._mmap[meta_offset:meta_offset + meta_length].decode('utf-8'))
+
+    def _decode_block(self, block: int) -> tuple:
+        # terms of block and locations of their postings, frequencies and positions,
+        # blocks of terms follow each other, so their sizes give their offsets
+        offset, postings_offset = struct.unpack_from(
+            MMAP_TERM_BLOCK_OFFSET_FORMAT, self._mmap,
+            self._block_offsets_offset + block * struct.calcsize(MMAP_TERM_BLOCK_OFFSET_FORMAT),
+        )
+        count = min(TERM_BLOCK_SIZE, self._terms_count - block * TERM_BLOCK_SIZE)
+        terms, fields = decode_term_block(self._mmap, self._terms_offset + offset, count, self._fields_count)
+        records = []
+        for postings_count, postings_size, frequencies_size, *positions_sizes in fields:
+            frequencies_offset = postings_offset + postings_size
+            lengths_offset = frequencies_offset + frequencies_size
+            lengths_size, positions_size = positions_sizes or (0, 0)
+            records.append((postings_offset, postings_count, frequencies_offset, lengths_offset, lengths_size))
+            postings_offset = lengths_offset + lengths_size + positions_size
+        return terms, records
+
+    def _block_terms(self, block: int) -> list:
+        # the last decoded block is kept, lookups usually touch it twice
+        if self._cached_block[0] != block:
+            self._cached_block = (block, *self._decode_block(block))
+        return self._cached_block[1]
+
+    def _record_at(self, position: int) -> tuple:
+        # locations of postings, frequencies and positions blocks of term
+        block, index = divmod(position, TERM_BLOCK_SIZE)
+        self._block_terms(block)
+        return self._cached_block[2][index]
+
+    def _block_first(self, block: int) -> bytes:
+        return self._block_terms(block)[0]
+
+    def _term_at(self, position: int) -> bytes:
+        block, index = divmod(position, TERM_BLOCK_SIZE)
+        return self._block_terms(block)[index]
+
+    def _iter_terms(self, start: int = 0):
+        first_block, skip = divmod(start, TERM_BLOCK_SIZE)
+        for block in range(first_block, self._blocks_count):
+            yield from islice(self._block_terms(block), skip, None)
+            skip = 0
+
+    def _lower_bound(self, encoded: bytes) -> int:
+        # position of the first term not less than encoded
+        if not self._blocks_count:
+            return 0
+        block = max(bisect_right(self._block_firsts, encoded) - 1, 0)
+        return block * TERM_BLOCK_SIZE + bisect_left(self._block_terms(block), encoded)
+
+    def _postings_at(self, position: int) -> array:
+        record = self._record_at(position)
+        return decode_postings(self._mmap[record[0]:record[2]])
+
+    def _frequencies_at(self, position: int) -> array:
+        record = self._record_at(position)
+        return decode_frequencies(self._mmap[record[2]:record[3]], record[1])
+
+    def _positions_at(self, position: int, indexes = None):
+        if not self.positional:
+            return None
+        record = self._record_at(position)
+        lengths_offset, lengths_size = record[3:5]
+        lengths = decode_varints(self._mmap[lengths_offset:lengths_offset + lengths_size])
+        offsets = list(accumulate(lengths, initial=lengths_offset + lengths_size))
+        if indexes is None:
+            indexes = range(len(lengths))
+        return [
+            array('I', accumulate(decode_varints(self._mmap[offsets[i]:offsets[i + 1]])))
+            for i in indexes
+        ]
+
+    def positions(self, word: str, indexes):
+        """
+        positions of word in some docs of its postings, only their blocks are decoded
+        :param word: word to look up
+        :param indexes: indexes of docs in postings of word
+        :return: list of arrays of positions, None if index has no positions
+        """
+        position = self._find(word)
+        if position < 0:
+            raise KeyError(word)
+        return self._positions_at(position, indexes)
+
+    def frequencies(self, word: str):
+        """
+        frequencies of word in docs of its postings
+        :param word: word to look up
+        :return: array aligned with postings
+        """
+        position = self._find(word)
+        if position < 0:
+            raise KeyError(word)
+        return self._frequencies_at(position)
+
+    def postings_size(self, word: str) -> int:
+        """
+        number of docs with word, read from term block without decoding postings
+        :param word: word to look up
+        :return: size of postings, 0 if word is absent
+        """
+        position = self._find(word)
+        if position < 0:
+            return 0
+        return self._record_at(position)[1]
+
+    def expand(self, pattern: str) -> list:
+        """
+        words matching wildcard pattern, only terms with literal prefix of pattern are read
+        :param pattern: word with * standing for any sequence of characters
+        :return: list of matching words in sorted order
+        """
+        start = self._lower_bound(wildcard_prefix(pattern).encode('utf-8'))
+        return expand_wildcard((encoded.decode('utf-8') for encoded in self._iter_terms(start)), pattern)
+
+    def _find(self, word: str) -> int:
+        encoded = word.encode('utf-8')
+        position = self._lower_bound(encoded)
+        if position < self._terms_count and self._term_at(position) == encoded:
+            return position
+        return -1
+
+    def __getitem__(self, word):
+        position = self._find(word)
+        if position < 0:
+            raise KeyError(word)
+        return self._postings_at(position)
+
+    def __contains__(self, word):
+        return self._find(word) >= 0
+
+    def __iter__(self):
+        for encoded in self._iter_terms():
+            yield encoded.decode('utf-8')
+
+    def __len__(self):
+        return self._terms_count
+
+    def iter_encoded(self):
+        """
+        walk over words in stored order without decoding them
+        :return: generator of encoded word, its postings, frequencies and positions
+        """
+        for position, encoded in enumerate(self._iter_terms()):
+            yield (
+                encoded, self._postings_at(position),
+                self._frequencies_at(position), self._positions_at(position),
+            )
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+
+class MmapIndexWriter:
+    """streaming writer of memory-mapped index, words must be added in sorted utf-8 order
+
+    Layout: header with positional flag, posting blocks with sparse frequency
+    and optional positions blocks after them, front-coded term blocks, offsets of
+    term blocks and of postings of their first terms, doc table, document
+    lengths, json meta, section directory and footer pointing to the directory.
+    Every term in its block is followed by postings count and sizes of its
+    blocks, sizes of positions blocks are written only for positional index.
+    Positions block has byte sizes of positions of every doc first, so
+    positions of a single doc can be decoded without the others.
+    """
+    def __init__(self, filepath: str, positional: bool = False, analyzer = None):
+        self.positional = positional
+        self.analyzer = analyzer
+        self._file = open(filepath, "wb")
+        flags = MMAP_FLAG_POSITIONAL if positional else 0
+        self._file.write(struct.pack(MMAP_HEADER_FORMAT, MMAP_INDEX_MAGIC, MMAP_INDEX_VERSION, flags))
+        self._postings_start = self._file.tell()
+        self._terms = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+    def add(self, encoded_word: bytes, postings, frequencies, positions = None):
+        """
+        write postings, frequencies and positions blocks of the next word
+        :param encoded_word: utf-8 encoded word, greater than previous one
+        :param postings: sorted internal doc ids
+        :param frequencies: frequencies of word in docs of postings
+        :param positions: sorted positions of word in docs of postings, for positional index
+        :return: nothing
+        """
+        if self._terms and self._terms[-1][0] >= encoded_word:
+            raise ValueError(f"word {encoded_word!r} is added out of order")
+        postings_offset = self._file.tell()
+        self._file.write(encode_postings(postings))
+        frequencies_offset = self._file.tell()
+        self._file.write(encode_frequencies(frequencies))
+        positions_offset = self._file.tell()
+        fields = (len(postings), frequencies_offset - postings_offset, positions_offset - frequencies_offset)
+        if self.positional:
+            encoded_positions = [encode_postings(doc_positions) for doc_positions in positions]
+            lengths = encode_varints(map(len, encoded_positions))
+            self._file.write(lengths)
+            self._file.write(b"".join(encoded_positions))
+            fields += (len(lengths), self._file.tell() - positions_offset - len(lengths))
+        self._terms.append((encoded_word, postings_offset, fields))
+
+    def finish(self, doc_ids, doc_lengths):
+        """
+        write term dictionary, doc table, document lengths, meta and footer
+        :param doc_ids: external doc ids ordered by internal id
+        :param doc_lengths: document lengths ordered by internal id
+        :return: nothing
+        """
+        write_file = self._file
+        terms_start = write_file.tell()
+        block_offsets = [struct.pack(MMAP_TERMS_COUNT_FORMAT, len(self._terms))]
+        for start in range(0, len(self._terms), TERM_BLOCK_SIZE):
+            block = self._terms[start:start + TERM_BLOCK_SIZE]
+            block_offsets.append(struct.pack(
+                MMAP_TERM_BLOCK_OFFSET_FORMAT, write_file.tell() - terms_start, block[0][1],
+            ))
+            write_file.write(encode_term_block(
+                [encoded for encoded, _, _ in block], [fields for _, _, fields in block],
+            ))
+        block_offsets_start = write_file.tell()
+        write_file.write(b"".join(block_offsets))
+        doc_blob_start = write_file.tell()
+        doc_offsets = array('Q', [0])
+        for doc_id in doc_ids:
+            encoded = doc_id.encode('utf-8')
+            write_file.write(encoded)
+            doc_offsets.append(doc_offsets[-1] + len(encoded))
+        doc_offsets_start = write_file.tell()
+        if sys.byteorder == 'little':
+            doc_offsets.byteswap()
+        write_file.write(doc_offsets.tobytes())
+        doc_lengths_start = write_file.tell()
+        doc_lengths = array('I', doc_lengths)
+        write_file.write(struct.pack(MMAP_DOC_LENGTHS_HEADER_FORMAT, sum(doc_lengths)))
+        if sys.byteorder == 'little':
+            doc_lengths.byteswap()
+        write_file.write(doc_lengths.tobytes())
+        meta_start = write_file.tell()
+        meta = {}
+        if self.analyzer is not None and not self.analyzer.is_default:
+            meta["analyzer"] = self.analyzer.config()
+        write_file.write(json.dumps(meta).encode('utf-8'))
+        directory_start = write_file.tell()
+        sections = [
+            (b"POST", self._postings_start, terms_start - self._postings_start),
+            (b"TDIC", terms_start, block_offsets_start - terms_start),
+            (b"TBIX", block_offsets_start, doc_blob_start - block_offsets_start),
+            (b"DBLB", doc_blob_start, doc_offsets_start - doc_blob_start),
+            (b"DOFF", doc_offsets_start, doc_lengths_start - doc_offsets_start),
+            (b"LENS", doc_lengths_start, meta_start - doc_lengths_start),
+            (b"META", meta_start, directory_start - meta_start),
+        ]
+        for section in sections:
+            write_file.write(struct.pack(MMAP_SECTION_FORMAT, *section))
+        write_file.write(struct.pack(MMAP_FOOTER_FORMAT, directory_start, len(sections), MMAP_INDEX_MAGIC))
+
+
+class MmapStoragePolicy:
+    """Policy for storage inverted index in memory-mappable format, see MmapIndexWriter
+
+    Posting blocks are delta + varint encoded internal ids resolved by the doc
+    table sections, every posting block is followed by block of word frequencies
+    above 1, see encode_frequencies, and positional indexes keep word positions after frequencies. Files of
+    other versions are rejected, old indexes of StoragePolicy are still read.
+    """
+    @staticmethod
+    def dump(word_to_docs_mapping, filepath: str):
+        """algorithm to store inverted index
+
+        :param word_to_docs_mapping: inverted_index
+        :param filepath: path to save inverted index
+        :return: nothing
+        """
+        index = word_to_docs_mapping.index
+        positional = word_to_docs_mapping.positional
+        with MmapIndexWriter(filepath, positional, word_to_docs_mapping.analyzer) as writer:
+            for encoded, word in sorted((word.encode('utf-8'), word) for word in index):
+                writer.add(
+                    encoded, index[word], word_to_docs_mapping.term_frequencies(word),
+                    word_to_docs_mapping.term_positions(word) if positional else None,
+                )
+            writer.finish(word_to_docs_mapping.doc_ids, word_to_docs_mapping.doc_lengths)
+
+    @staticmethod
+    def load(filepath: str):
+        """algorithm to load inverted index, falls back to StoragePolicy for old files
+
+        :param filepath: path to saved inverted index
+        :return: class InvertedIndex
+        """
+        with open(filepath, "rb") as read_file:
+            magic = read_file.read(len(MMAP_INDEX_MAGIC))
+        if magic != MMAP_INDEX_MAGIC:
+            logger.debug("%s is not memory-mapped index, use StoragePolicy", filepath)
+            return StoragePolicy.load(filepath)
+        cls = InvertedIndex()
+        cls.index = MappedIndex(filepath)
+        cls.doc_ids = cls.index.doc_ids
+        cls.analyzer = Analyzer.from_config(cls.index.meta.get("analyzer"))
+        cls.doc_lengths = cls.index.doc_lengths
+        return cls
+
+
+DEFAULT_STORAGE_POLICY = MmapStoragePolicy
+EMPTY_POSTINGS = array('I')
+
+
+Phrase = namedtuple("Phrase", ["words"])
+Near = namedtuple("Near", ["left", "right", "distance"])
+
+POSITIONAL_TOKEN_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+NEAR_OPERATOR_PATTERN = re.compile(r"NEAR/(\d+)")
+
+
+def clause_words(clause) -> list:
+    if isinstance(clause, Near):
+        return clause.left.words + clause.right.words
+    return clause.words
+
+
+def is_positional_query(line: str) -> bool:
+    return '"' in line or NEAR_OPERATOR_PATTERN.search(line) is not None
+
+
+def parse_positional_query(line: str) -> list:
+    """
+    parse query with quoted phrases and binary "left NEAR/k right" operators
+    :param line: query line
+    :return: list of Phrase and Near clauses
+    """
+    clauses = []
+    pending_distance = None
+    for phrase, word in POSITIONAL_TOKEN_PATTERN.findall(line):
+        near = NEAR_OPERATOR_PATTERN.fullmatch(word) if word else None
+        if near:
+            if not clauses or pending_distance is not None:
+                raise ValueError(f"NEAR operator without left operand in query {line!r}")
+            pending_distance = int(near.group(1))
+            continue
+        clause = Phrase(phrase.split() if phrase else [word])
+        if not clause.words:
+            continue
+        if pending_distance is not None:
+            clause = Near(clauses.pop(), clause, pending_distance)
+            if isinstance(clause.left, Near):
+                raise ValueError(f"chained NEAR operators are not supported in query {line!r}")
+            pending_distance = None
+        clauses.append(clause)
+    if pending_distance is not None:
+        raise ValueError(f"NEAR operator without right operand in query {line!r}")
+    return clauses
+
+
+def phrase_starts(phrase: Phrase, doc_positions: dict) -> set:
+    """
+    positions where phrase starts in doc
+    :param phrase: Phrase clause
+    :param doc_positions: word -> sorted positions of word in doc
+    :return: set of start positions
+    """
+    starts = set(doc_positions[phrase.words[0]])
+    for shift, word in enumerate(phrase.words[1:], 1):
+        if not starts:
+            break
+        starts.intersection_update(position - shift for position in doc_positions[word])
+    return starts
+
+
+def match_clause(clause, doc_positions: dict) -> bool:
+    """
+    check clause against positions of words in doc
+    :param clause: Phrase or Near clause
+    :param doc_positions: word -> sorted positions of word in doc
+    :return: True if doc matches clause
+    """
+    if isinstance(clause, Phrase):
+        return bool(phrase_starts(clause, doc_positions))
+    left_starts = sorted(phrase_starts(clause.left, doc_positions))
+    right_starts = sorted(phrase_starts(clause.right, doc_positions))
+    left_size, right_size = len(clause.left.words), len(clause.right.words)
+    for left_start in left_starts:
+        # the nearest right phrase after and before the left one are enough to check
+        position = bisect_left(right_starts, left_start)
+        if position < len(right_starts) and right_starts[position] - (left_start + left_size - 1) <= clause.distance:
+            return True
+        if position > 0 and left_start - (right_starts[position - 1] + right_size - 1) <= clause.distance:
+            return True
+    return False
+
+
+Term = namedtuple("Term", ["word"])
+And = namedtuple("And", ["children"])
+Or = namedtuple("Or", ["children"])
+Not = namedtuple("Not", ["child"])
+Wildcard = namedtuple("Wildcard", ["pattern"])
+BOOLEAN_NODES = (Term, And, Or, Not, Wildcard)
+
+BOOLEAN_OPERATORS = frozenset(("AND", "OR", "NOT", "(", ")"))
+BOOLEAN_TOKEN_PATTERN = re.compile(r"[()]|[^\s()]+")
+NO_MORE_DOCS = MAX_DOC_ID + 1
+
+
+def is_boolean_query(line: str) -> bool:
+    # parentheses glued to words, like (born, are ordinary terms unless
+    # there is AND, OR or NOT in the line
+    return any(word in BOOLEAN_OPERATORS for word in line.split())
+
+
+def parse_wildcard_query(line: str):
+    """
+    parse words of query without operators, words with * are wildcard patterns
+    :param line: query line
+    :return: Term or Wildcard node or And of them
+    """
+    nodes = [Wildcard(word) if WILDCARD in word else Term(word) for word in line.split()]
+    return nodes[0] if len(nodes) == 1 else And(nodes)
+
+
+def parse_boolean_query(line: str):
+    """
+    parse query with AND, OR, NOT and parentheses, words without operator
+    between them are joined by AND, NOT binds tighter than AND and AND than OR,
+    words with * are wildcard patterns
+    :param line: query line
+    :return: tree of Term, Wildcard, And, Or and Not nodes
+    """
+    if '"' in line:
+        raise ValueError(f"phrases are not supported in boolean query {line!r}")
+    tokens = BOOLEAN_TOKEN_PATTERN.findall(line)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def parse_or():
+        nonlocal position
+        children = [parse_and()]
+        while peek() == "OR":
+            position += 1
+            children.append(parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and():
+        nonlocal position
+        children = [parse_not()]
+        while peek() not in (None, "OR", ")"):
+            if peek() == "AND":
+                position += 1
+            children.append(parse_not())
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_not():
+        nonlocal position
+        token = peek()
+        position += 1
+        if token == "NOT":
+            return Not(parse_not())
+        if token == "(":
+            node = parse_or()
+            if peek() != ")":
+                raise ValueError(f"unbalanced parentheses in query {line!r}")
+            position += 1
+            return node
+        if token is None or token in BOOLEAN_OPERATORS:
+            raise ValueError(f"unexpected {token or 'end'} in query {line!r}")
+        return Wildcard(token) if WILDCARD in token else Term(token)
+
+    tree = parse_or()
+    if position != len(tokens):
+        raise ValueError(f"unexpected {tokens[position]} in query {line!r}")
+    return tree
+
+
+class PostingIterator:
+    """
+    lazy iterator over sorted postings, doc is the current doc id or
+    NO_MORE_DOCS, advance skips to the first doc id >= target by galloping
+    """
+    def __init__(self, postings):
+        self.postings = postings
+        self.cost = len(postings)
+        self.position = 0
+        self.doc = postings[0] if postings else NO_MORE_DOCS
+
+    def next(self) -> int:
+        return self.advance(self.doc + 1)
+
+    def advance(self, target: int) -> int:
+        if target <= self.doc:
+            return self.doc
+        self.position = gallop_to(self.postings, target, self.position)
+        self.doc = self.postings[self.position] if self.position < self.cost else NO_MORE_DOCS
+        return self.doc
+
+
+class AllDocsIterator:
+    """
+    iterator over every internal doc id of index, base of negation
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.cost = size
+        self.doc = 0 if size else NO_MORE_DOCS
+
+    def next(self) -> int:
+        return self.advance(self.doc + 1)
+
+    def advance(self, target: int) -> int:
+        if target > self.doc:
+            self.doc = target if target < self.size else NO_MORE_DOCS
+        return self.doc
+
+
+class AndIterator:
+    """
+    leapfrog intersection of iterators, the cheapest one leads, docs of
+    excluded iterators are skipped without materializing them
+    """
+    def __init__(self, children: list, excluded: list = ()):
+        self.children = sorted(children, key=lambda child: child.cost)
+        self.excluded = list(excluded)
+        self.cost = self.children[0].cost
+        self.doc = -1
+        self._settle(self.children[0].doc)
+
+    def next(self) -> int:
+        return self._settle(self.children[0].next())
+
+    def advance(self, target: int) -> int:
+        if target <= self.doc:
+            return self.doc
+        return self._settle(self.children[0].advance(target))
+
+    def _settle(self, doc: int) -> int:
+        children = self.children
+        while doc != NO_MORE_DOCS:
+            for child in children[1:]:
+                child_doc = child.advance(doc)
+                if child_doc != doc:
+                    doc = children[0].advance(child_doc)
+                    break
+            else:
+                if not any(excluded.advance(doc) == doc for excluded in self.excluded):
+                    break
+                doc = children[0].next()
+        self.doc = doc
+        return doc
+
+
+class OrIterator:
+    """
+    union of iterators, children positioned at the current doc are moved on demand
+    """
+    def __init__(self, children: list):
+        self.children = children
+        self.cost = sum(child.cost for child in children)
+        self.doc = min(child.doc for child in children)
+
+    def next(self) -> int:
+        return self.advance(self.doc + 1)
+
+    def advance(self, target: int) -> int:
+        if target <= self.doc:
+            return self.doc
+        self.doc = min(child.advance(target) for child in self.children)
+        return self.doc
+
+
+class UnionIterator:
+    """
+    union of many iterators kept in heap by their current docs, used for terms
+    of expanded wildcard where OrIterator would move every child on each step
+    """
+    def __init__(self, children: list):
+        self.cost = sum(child.cost for child in children)
+        self._heap = [
+            (child.doc, number, child) for number, child in enumerate(children) if child.doc != NO_MORE_DOCS
+        ]
+        heapq.heapify(self._heap)
+        self.doc = self._heap[0][0] if self._heap else NO_MORE_DOCS
+
+    def next(self) -> int:
+        return self.advance(self.doc + 1)
+
+    def advance(self, target: int) -> int:
+        if target <= self.doc:
+            return self.doc
+        heap = self._heap
+        while heap and heap[0][0] < target:
+            _, number, child = heap[0]
+            doc = child.advance(target)
+            if doc == NO_MORE_DOCS:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (doc, number, child))
+        self.doc = heap[0][0] if heap else NO_MORE_DOCS
+        return self.doc
+
+
+def drain_iterator(iterator) -> array:
+    """
+    collect all doc ids of iterator
+    :param iterator: posting iterator
+    :return: sorted internal doc ids
+    """
+    answer = array('I')
+    doc = iterator.doc
+    while doc != NO_MORE_DOCS:
+        answer.append(doc)
+        doc = iterator.next()
+    return answer
+
+
+class QueryBatchCache:
+    """posting lookups and intersections of word prefixes shared by queries of one batch
+    """
+    def __init__(self):
+        self.sizes = {}
+        self.postings = {}
+        self.intersections = {}
+
+
+class InvertedIndex:
+    """
+    class inverted index
+
+    index maps word to sorted array of internal doc ids,
+    frequencies maps word to array of its frequencies aligned with postings,
+    positions of positional index maps word to list of arrays of its positions,
+    doc_ids and doc_lengths map internal doc id to external one and its length
+    """
+    def __init__(self):
+        self.index = {}
+        self.frequencies = {}
+        self.positions = None
+        self.doc_ids = []
+        self._doc_lengths = None
+        self._sorted_words = None
+        self.analyzer = DEFAULT_ANALYZER
+
+    @property
+    def positional(self) -> bool:
+        if isinstance(self.index, MappedIndex):
+            return self.index.positional
+        return self.positions is not None
+
+    @property
+    def doc_lengths(self):
+        if self._doc_lengths is None:
+            # indexes stored without lengths get them from postings
+            self._doc_lengths = _doc_lengths_from_postings(
+                ((self.index[word], self.term_frequencies(word)) for word in self.index), len(self.doc_ids)
+            )
+        return self._doc_lengths
+
+    @doc_lengths.setter
+    def doc_lengths(self, doc_lengths):
+        self._doc_lengths = doc_lengths
+
+    def __eq__(self, other):
+        return self.to_external() == other.to_external()
+
+    def to_external(self) -> dict:
+        """
+        index representation with external doc ids, independent of internal numbering
+        :return: dict of word to set of doc ids
+        """
+        return {
+            word: {self.doc_ids[internal_id] for internal_id in postings}
+            for word, postings in self.index.items()
+        }
+
+    def query(self, words: list) -> list:
+        """
+        function answer for queries
+        :param words: words of query
+        :return: list of answer
+        """
+        assert isinstance(words, list), (
+            "query should be provided with list of words, but user provided: "
+            f"{repr(words)}"
+        )
+        logger.debug("query inverted index with request %s", repr(words))
+        answer = self._match_words(words)
+        return [self.doc_ids[internal_id] for internal_id in answer]
+
+    def query_batch(self, queries) -> list:
+        """
+        answer many queries, postings of shared words are looked up once and
+        intersections of shared word prefixes are reused
+        :param queries: list of queries, each of them is list of words
+        :return: list of answers in the same order
+        """
+        logger.debug("query inverted index with batch of %s requests", len(queries))
+        cache = QueryBatchCache()
+        answers = []
+        for words in queries:
+            answer = self._match_words(words, cache)
+            answers.append([self.doc_ids[internal_id] for internal_id in answer])
+        return answers
+
+    def expand_terms(self, pattern: str) -> list:
+        """
+        words of index matching wildcard pattern, found by range scan of sorted terms
+        from the first one with literal prefix of pattern
+        :param pattern: word with * standing for any sequence of characters
+        :return: list of matching words in sorted order
+        """
+        if isinstance(self.index, MappedIndex):
+            return self.index.expand(pattern)
+        if self._sorted_words is None or len(self._sorted_words) != len(self.index):
+            self._sorted_words = sorted(self.index)
+        words = self._sorted_words
+        # islice would step through all words before the prefix, index them directly
+        start = bisect_left(words, wildcard_prefix(pattern))
+        return expand_wildcard((words[i] for i in range(start, len(words))), pattern)
+
+    def postings_size(self, word: str) -> int:
+        """
+        number of docs containing word
+        :param word: word to look up
+        :return: size of postings, 0 if word is absent
+        """
+        if isinstance(self.index, MappedIndex):
+            return self.index.postings_size(word)
+        return len(self.index.get(word, EMPTY_POSTINGS))
+
+    def term_frequencies(self, word: str) -> array:
+        """
+        frequencies of word in docs of its postings, 1 for indexes stored without them
+        :param word: word to look up
+        :return: array aligned with postings
+        """
+        if isinstance(self.index, MappedIndex):
+            frequencies = self.index.frequencies(word)
+        else:
+            frequencies = self.frequencies.get(word)
+        if frequencies is None:
+            frequencies = array('I', [1]) * len(self.index[word])
+        return frequencies
+
+    def term_positions(self, word: str, indexes = None) -> list:
+        """
+        positions of word in docs of its postings, positional index only
+        :param word: word to look up
+        :param indexes: indexes of docs in postings, all docs by default
+        :return: list of sorted arrays of positions
+        """
+        if not self.positional:
+            raise ValueError("inverted index was built without positions")
+        if isinstance(self.index, MappedIndex):
+            return self.index.positions(word, indexes)
+        word_positions = self.positions[word]
+        if indexes is None:
+            return word_positions
+        return [word_positions[i] for i in indexes]
+
+    def query_positional(self, clauses: list) -> list:
+        """
+        query with phrases and proximity, docs are pre-filtered by intersection of
+        all words and positions are decoded only for those candidates
+        :param clauses: list of Phrase and Near clauses, all of them must match
+        :return: list of answer
+        """
+        logger.debug("positional query inverted index with request %s", repr(clauses))
+        return [self.doc_ids[internal_id] for internal_id in self._match_positional(clauses)]
+
+    def query_boolean(self, tree) -> list:
+        """
+        query with AND, OR and NOT evaluated by tree of lazy posting iterators,
+        no intermediate sets of doc ids are built
+        :param tree: tree of Term, Wildcard, And, Or and Not nodes made by parse_boolean_query
+        :return: list of answer
+        """
+        logger.debug("boolean query inverted index with request %s", repr(tree))
+        return [self.doc_ids[internal_id] for internal_id in drain_iterator(self._boolean_iterator(tree))]
+
+    def _boolean_iterator(self, node):
+        if isinstance(node, Term):
+            return PostingIterator(self.index.get(node.word, EMPTY_POSTINGS))
+        if isinstance(node, Wildcard):
+            return UnionIterator([PostingIterator(self.index[word]) for word in self.expand_terms(node.pattern)])
+        if isinstance(node, Or):
+            return OrIterator([self._boolean_iterator(child) for child in node.children])
+        if isinstance(node, Not):
+            return AndIterator([AllDocsIterator(len(self.doc_ids))], [self._boolean_iterator(node.child)])
+        included = [self._boolean_iterator(child) for child in node.children if not isinstance(child, Not)]
+        excluded = [self._boolean_iterator(child.child) for child in node.children if isinstance(child, Not)]
+        if not included:
+            included = [AllDocsIterator(len(self.doc_ids))]
+        return AndIterator(included, excluded)
+
+    def _match_positional(self, clauses: list, candidates = None) -> array:
+        words = [word for clause in clauses for word in clause_words(clause)]
+        if candidates is None:
+            candidates = self._intersect(words)
+        checked = [clause for clause in clauses if not (isinstance(clause, Phrase) and len(clause.words) == 1)]
+        if not checked or not candidates:
+            return candidates
+        positions = {}
+        for word in dict.fromkeys(word for clause in checked for word in clause_words(clause)):
+            postings = self.index[word]
+            indexes = []
+            position = 0
+            for doc_id in candidates:
+                position = gallop_to(postings, doc_id, position)
+                indexes.append(position)
+            positions[word] = self.term_positions(word, indexes)
+        answer = array('I')
+        for number, doc_id in enumerate(candidates):
+            doc_positions = {word: word_positions[number] for word, word_positions in positions.items()}
+            if all(match_clause(clause, doc_positions) for clause in checked):
+                answer.append(doc_id)
+        return answer
+
+    def average_doc_length(self) -> float:
+        """
+        average length of indexed documents
+        :return: average length, 0.0 for empty index
+        """
+        doc_lengths = self.doc_lengths
+        if not doc_lengths:
+            return 0.0
+        total = doc_lengths.total if isinstance(doc_lengths, MappedDocLengths) else sum(doc_lengths)
+        return total / len(doc_lengths)
+
+    def query_ranked(self, words: list, top_k: int = DEFAULT_TOP_K, exclude = None) -> list:
+        """
+        ranked query: top_k documents containing any of words by BM25 score,
+        MaxScore skips documents which can not get into top by upper bounds of words
+        :param words: words of query
+        :param top_k: number of documents to return
+        :param exclude: set of external doc ids to skip
+        :return: list of doc id and score pairs, best first
+        """
+        logger.debug("ranked query inverted index with request %s", repr(words))
+        documents_count = len(self.doc_ids)
+        average_length = self.average_doc_length() or 1.0
+        doc_lengths = self.doc_lengths
+        terms = []
+        for word in dict.fromkeys(words):
+            size = self.postings_size(word)
+            if size == 0:
+                continue
+            frequencies = self.term_frequencies(word)
+            idf = math.log(1 + (documents_count - size + 0.5) / (size + 0.5))
+            max_frequency = max(frequencies)
+            # shortest possible document gives the upper bound of word score
+            upper_bound = idf * (BM25_K1 + 1) * max_frequency / (max_frequency + BM25_K1 * (1 - BM25_B))
+            terms.append((upper_bound, idf, self.index[word], frequencies))
+        terms.sort(key=itemgetter(0))
+        bounds = list(accumulate(term[0] for term in terms))
+        positions = [0] * len(terms)
+        top = []
+        threshold = 0.0
+        essential = 0
+        while top_k > 0:
+            # words which bounds sum is under threshold can not make a document alone
+            while essential < len(terms) and len(top) == top_k and bounds[essential] <= threshold:
+                essential += 1
+            candidate = min((
+                terms[i][2][positions[i]] for i in range(essential, len(terms))
+                if positions[i] < len(terms[i][2])
+            ), default=None)
+            if candidate is None:
+                break
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[candidate] / average_length)
+            score = 0.0
+            for i in range(essential, len(terms)):
+                _, idf, postings, frequencies = terms[i]
+                position = positions[i]
+                if position < len(postings) and postings[position] == candidate:
+                    frequency = frequencies[position]
+                    score += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+                    positions[i] = position + 1
+            for i in range(essential - 1, -1, -1):
+                if score + bounds[i] <= threshold:
+                    break
+                _, idf, postings, frequencies = terms[i]
+                position = positions[i] = gallop_to(postings, candidate, positions[i])
+                if position < len(postings) and postings[position] == candidate:
+                    frequency = frequencies[position]
+                    score += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+            if exclude and self.doc_ids[candidate] in exclude:
+                continue
+            if len(top) < top_k:
+                heapq.heappush(top, (score, -candidate))
+            elif (score, -candidate) > top[0]:
+                heapq.heapreplace(top, (score, -candidate))
+            if len(top) == top_k:
+                threshold = top[0][0]
+        return [(self.doc_ids[-candidate], score) for score, candidate in sorted(top, reverse=True)]
+
+    def _cached_postings_size(self, word: str, cache) -> int:
+        if cache is None:
+            return self.postings_size(word)
+        size = cache.sizes.get(word)
+        if size is None:
+            size = cache.sizes[word] = self.postings_size(word)
+        return size
+
+    def _cached_postings(self, word: str, cache) -> array:
+        if cache is None:
+            return self.index[word]
+        postings = cache.postings.get(word)
+        if postings is None:
+            postings = cache.postings[word] = self.index[word]
+        return postings
+
+    def _match_words(self, words, cache = None) -> array:
+        # words with * are expanded and evaluated as conjunction of boolean query
+        if any(WILDCARD in word for word in words):
+            tree = And([Wildcard(word) if WILDCARD in word else Term(word) for word in words])
+            return drain_iterator(self._boolean_iterator(tree))
+        return self._intersect(words, cache)
+
+    def _intersect(self, words, cache = None) -> array:
+        """
+        conjunctive query engine: intersect postings from the rarest word,
+        stop as soon as a word is absent or intersection becomes empty
+        :param words: words of query
+        :param cache: QueryBatchCache shared by queries of one batch
+        :return: sorted internal doc ids, possibly the stored postings itself
+        """
+        sizes = []
+        for word in dict.fromkeys(words):
+            size = self._cached_postings_size(word, cache)
+            if size == 0:
+                return EMPTY_POSTINGS
+            sizes.append((size, word))
+        if not sizes:
+            return EMPTY_POSTINGS
+        sizes.sort()
+        words = tuple(word for _, word in sizes)
+        answer = None
+        start = 1
+        if cache is not None:
+            for end in range(len(words), 1, -1):
+                answer = cache.intersections.get(words[:end])
+                if answer is not None:
+                    start = end
+                    break
+        if answer is None:
+            answer = self._cached_postings(words[0], cache)
+        for position in range(start, len(words)):
+            if not answer:
+                break
+            answer = intersect_postings(answer, self._cached_postings(words[position], cache))
+            if cache is not None:
+                cache.intersections[words[:position + 1]] = answer
+        return answer
+
+
+    def dump(self, filepath: str, storage_policy = DEFAULT_STORAGE_POLICY):
+        storage_policy.dump(self, filepath)
+
+
+    @classmethod
+    def load(cls, filepath: str, storage_policy = DEFAULT_STORAGE_POLICY):
+        logger.info("load inverted index from filepath %s", filepath)
+        return storage_policy.load(filepath)
+
+    def close(self):
+        """
+        release resources of memory-mapped index
+        :return: nothing
+        """
+        if isinstance(self.index, MappedIndex):
+            self.index.close()
+
+
+class QueryCache:
+    """bounded LRU cache of query answers keyed by sorted set of query words
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._answers = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(words, top_k = None) -> tuple:
+        """
+        normalized key of query, order and repeats of words do not matter
+        :param words: words of query
+        :param top_k: number of ranked docs, None for boolean query
+        :return: hashable key
+        """
+        return top_k, tuple(sorted(set(words)))
+
+    def get(self, key):
+        answer = self._answers.get(key)
+        if answer is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._answers.move_to_end(key)
+        return list(answer)
 
-def is_utf8(s):
+    def put(self, key, answer):
+        self._answers[key] = list(answer)
+        self._answers.move_to_end(key)
+        while len(self._answers) > self.max_size:
+            self._answers.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._answers.clear()
+
+    def __len__(self):
+        return len(self._answers)
+
+    def stats(self) -> dict:
+        """
+        counters of cache usage
+        :return: dict of size, hits, misses, evictions and hit rate
+        """
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._answers),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / requests if requests else 0.0,
+        }
+
+
+def _files_state(paths) -> tuple:
+    state = []
+    for path in paths:
+        stat = os.stat(path)
+        state.append((path, stat.st_ino, stat.st_size, stat.st_mtime_ns))
+    return tuple(state)
+
+
+class SegmentedIndex:
     """
-    check for string in utf-8
+    base inverted index with immutable segments appended by update command,
+    documents of newer segments shadow documents with the same doc id in older ones
     """
-    for c in s:
-        if ord(c) > 256:
-            return 0
-    return 1
+    def __init__(self, segments: list, cache: QueryCache = None):
+        self.cache = cache
+        self.filepath = None
+        self.storage_policy = DEFAULT_STORAGE_POLICY
+        self._state = None
+        self._set_segments(segments)
 
-class StoragePolicy:
-    """Policy for storage inverted index
-    """
-    @staticmethod
-    def dump(word_to_docs_mapping, filepath: str):
-        """algorithm to store inverted index
+    @property
+    def analyzer(self):
+        return self.segments[0].analyzer if self.segments else DEFAULT_ANALYZER
 
-        :param word_to_docs_mapping: inverted_index
-        :param filepath: path to save inverted index
+    @property
+    def positional(self) -> bool:
+        return bool(self.segments) and all(segment.positional for segment in self.segments)
+
+    def _set_segments(self, segments: list):
+        self.segments = segments
+        self._shadowed = [set()]
+        for segment in reversed(segments[1:]):
+            self._shadowed.append(self._shadowed[-1].union(segment.doc_ids))
+        self._shadowed.reverse()
+
+    @classmethod
+    def load(cls, filepath: str, storage_policy = DEFAULT_STORAGE_POLICY,
+             cache_size: int = DEFAULT_QUERY_CACHE_SIZE):
+        segmented_index = cls([], QueryCache(cache_size) if cache_size > 0 else None)
+        segmented_index.filepath = filepath
+        segmented_index.storage_policy = storage_policy
+        segmented_index.reload()
+        return segmented_index
+
+    def reload(self):
+        """
+        reopen base index and its segments, cached answers are dropped
         :return: nothing
         """
-        with open(filepath, "wb") as write_file:
-            d = struct.pack('>I', len(word_to_docs_mapping.index))
-            write_file.write(d)
-            for key in word_to_docs_mapping.index:
-                if (is_utf8(key) == 1):
-                    write_file.write(struct.pack('>B', 1))
-                    len_key = len(key.encode('utf-8'))
-                    write_file.write(struct.pack('>H', len_key))
-                    word = struct.pack('>{}s'.format(len_key), key.encode('utf-8'))
-                    write_file.write(word)
-                else:
-                    write_file.write(struct.pack('>B', 0))
-                    len_key = len(key.encode('utf-16'))
-                    write_file.write(struct.pack('>H', len_key))
-                    word = struct.pack('>{}s'.format(len_key), key.encode('utf-16'))
-                    write_file.write(word)
-                d = struct.pack('>H', len(word_to_docs_mapping.index[key]))
-                write_file.write(d)
-                for item in word_to_docs_mapping.index[key]:
-                    d = struct.pack('>H', int(item))
-                    write_file.write(d)
+        paths = [self.filepath] + segment_paths(self.filepath)
+        state = _files_state(paths)
+        segments = [InvertedIndex.load(path, self.storage_policy) for path in paths]
+        self.close()
+        self._set_segments(segments)
+        self._state = state
+        if self.cache is not None:
+            self.cache.clear()
 
-    @staticmethod
-    def load(filepath: str):
-        """algorithm to load inverted index
+    def refresh(self) -> bool:
+        """
+        reload index if base index or its segments were changed by update or merge
+        :return: True if index was reloaded
+        """
+        if self.filepath is None:
+            return False
+        paths = [self.filepath] + segment_paths(self.filepath)
+        if _files_state(paths) == self._state:
+            return False
+        logger.info("inverted index %s was changed, reload it", self.filepath)
+        self.reload()
+        return True
 
-        :param filepath: path to saved inverted index
-        :return: class InvertedIndex
+    def query_ranked(self, words: list, top_k: int = DEFAULT_TOP_K) -> list:
         """
-        cls = InvertedIndex()
-        with open(filepath, "rb") as read_file:
-            count = struct.unpack('>I', read_file.read(4))
-            for i in range(int(count[0])):
-                flag = struct.unpack('>B', read_file.read(1))
-                l = struct.unpack('>H', read_file.read(2))
-                d = read_file.read(l[0])
-                code = struct.unpack('>{}s'.format(l[0]), d)
-                if flag[0] == 1:
-                    key = code[0].decode('utf-8')
-                else:
-                    key = code[0].decode('utf-16')
-                cls.index[key] = set()
-                c = struct.unpack('>H', read_file.read(2))
-                for j in range(int(c[0])):
-                    number = struct.unpack('>H', read_file.read(2))
-                    cls.index[key].add(f'{number[0]}')
-        return cls
+        ranked query over all segments, every segment is scored by its own statistics
+        :param words: words of query
+        :param top_k: number of documents to return
+        :return: list of doc id and score pairs, best first
+        """
+        if self.cache is not None:
+            key = QueryCache.key(words, top_k)
+            answer = self.cache.get(key)
+            if answer is not None:
+                return answer
+        ranked = []
+        for segment, shadowed in zip(self.segments, self._shadowed):
+            ranked.extend(segment.query_ranked(words, top_k, exclude=shadowed))
+        answer = heapq.nlargest(top_k, ranked, key=itemgetter(1))
+        if self.cache is not None:
+            self.cache.put(key, answer)
+        return answer
 
-class InvertedIndex:
-    """
-    class inverted index
-    """
-    def __init__(self):
-        self.index = {}
+    def query_positional(self, clauses: list) -> list:
+        """
+        query with phrases and proximity over all segments, answers are not cached
+        :param clauses: list of Phrase and Near clauses, all of them must match
+        :return: list of answer
+        """
+        answer = []
+        for segment, shadowed in zip(self.segments, self._shadowed):
+            answer.extend(doc_id for doc_id in segment.query_positional(clauses) if doc_id not in shadowed)
+        return answer
 
-    def __eq__(self, other):
-        return self.index == other.index
+    def query_boolean(self, tree) -> list:
+        """
+        query with AND, OR and NOT over all segments, answers are not cached
+        :param tree: tree of Term, Wildcard, And, Or and Not nodes made by parse_boolean_query
+        :return: list of answer
+        """
+        answer = []
+        for segment, shadowed in zip(self.segments, self._shadowed):
+            answer.extend(doc_id for doc_id in segment.query_boolean(tree) if doc_id not in shadowed)
+        return answer
 
     def query(self, words: list) -> list:
         """
-        function answer for queries
+        function answer for queries over all segments
         :param words: words of query
         :return: list of answer
         """
-        assert isinstance(words, list), (
-            "query should be provided with list of words, but user provided: "
-            f"{repr(words)}"
-        )
-        logger.debug("query inverted index with request %s", repr(words))
-        answer = None
-        for word in words:
-            if (answer == None):
-                answer = self.index.get(word)
-            else:
-                answer.intersection_update(self.index.get(word))
-        if answer == None:
-            answer = []
-        else:
-            answer = list(answer)
-        return answer
+        return self.query_batch([words])[0]
 
+    def query_batch(self, queries) -> list:
+        """
+        answer many queries over all segments, cached answers are reused
+        :param queries: list of queries, each of them is list of words
+        :return: list of answers in the same order
+        """
+        if self.cache is None:
+            return self._query_segments(queries)
+        answers = []
+        missed = {}
+        for words in queries:
+            key = QueryCache.key(words)
+            answer = self.cache.get(key)
+            if answer is None and key not in missed:
+                missed[key] = list(key[1])
+            answers.append(answer if answer is not None else key)
+        for key, answer in zip(missed, self._query_segments(list(missed.values()))):
+            self.cache.put(key, answer)
+            missed[key] = answer
+        return [list(missed[answer]) if isinstance(answer, tuple) else answer for answer in answers]
 
-    def dump(self, filepath: str, storage_policy = StoragePolicy):
-        storage_policy.dump(self, filepath)
+    def _query_segments(self, queries) -> list:
+        if len(self.segments) == 1:
+            return self.segments[0].query_batch(queries)
+        answers = [[] for _ in queries]
+        for segment, shadowed in zip(self.segments, self._shadowed):
+            for answer, segment_answer in zip(answers, segment.query_batch(queries)):
+                answer.extend(doc_id for doc_id in segment_answer if doc_id not in shadowed)
+        return answers
 
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
 
-    @classmethod
-    def load(cls, filepath: str, storage_policy = StoragePolicy):
-        logger.info("load inverted index from filepath %s", filepath)
-        return storage_policy.load(filepath)
+
+def iter_documents(filepath: str, buffer_size: int = DEFAULT_READ_BUFFER_SIZE):
+    """
+    lazy loading documents from drive by large binary blocks
+    :param filepath: path to saved document
+    :param buffer_size: size of block to read at once
+    :return: generator of doc id and text pairs
+    """
+    with open(filepath, "rb") as fin:
+        tail = b""
+        while True:
+            block = fin.read(buffer_size)
+            if not block:
+                break
+            complete, _, tail = (tail + block).rpartition(b"\n")
+            if not complete:
+                continue
+            for line in complete.decode('utf-8').split('\n'):
+                doc_id, _, text = line.partition('\t')
+                if doc_id:
+                    yield doc_id, text.rstrip()
+        doc_id, _, text = tail.decode('utf-8').partition('\t')
+        if doc_id.strip():
+            yield doc_id, text.rstrip()
 
 
 def load_documents(filepath: str):
@@ -153,51 +1862,335 @@ def load_documents(filepath: str):
     :param filepath: path to saved document
     :return: dict of documents
     """
-    d = {}
-    f = open(filepath)
-    line = f.readline()
-    while line:
-        d[line.split('\t', 1)[0]] = line.split('\t', 1)[1].rstrip()
-        line = f.readline()
-    f.close()
-    return d
+    return dict(iter_documents(filepath))
 
 
-def build_inverted_index(documents):
+def build_inverted_index(documents, positional: bool = False, analyzer = None):
     """
     building inverted index
-    :param documents: dict of documents
+    :param documents: dict of documents or iterable of doc id and text pairs
+    :param positional: keep positions of words for phrase and proximity queries
+    :param analyzer: class Analyzer to split documents into terms, whitespaces by default
     :return: class InvertedIndex
     """
     logger.info("build inverted index for provided documents")
+    if isinstance(documents, Mapping):
+        documents = documents.items()
     inverted_index = InvertedIndex()
-    for key in documents:
-        for word in documents[key].split():
-            if inverted_index.index.get(word) == None:
-                inverted_index.index[word] = set()
-            inverted_index.index.get(word).add(key)
+    if analyzer is not None:
+        inverted_index.analyzer = analyzer
+    analyze = inverted_index.analyzer.analyze
+    index = inverted_index.index
+    frequencies = inverted_index.frequencies
+    doc_lengths = inverted_index.doc_lengths = array('I')
+    if positional:
+        positions = inverted_index.positions = {}
+    for internal_id, (doc_id, text) in enumerate(documents):
+        inverted_index.doc_ids.append(doc_id)
+        words = analyze(text)
+        doc_lengths.append(len(words))
+        if positional:
+            doc_positions = {}
+            for position, word in enumerate(words):
+                word_positions = doc_positions.get(word)
+                if word_positions is None:
+                    word_positions = doc_positions[word] = array('I')
+                word_positions.append(position)
+            counts = ((word, len(word_positions)) for word, word_positions in doc_positions.items())
+        else:
+            counts = Counter(words).items()
+        for word, frequency in counts:
+            postings = index.get(word)
+            if postings is None:
+                postings = index[word] = array('I')
+                frequencies[word] = array('I')
+                if positional:
+                    positions[word] = []
+            postings.append(internal_id)
+            frequencies[word].append(frequency)
+            if positional:
+                positions[word].append(doc_positions[word])
     return inverted_index
 
+def iter_document_chunks(filepath: str, chunk_size: int = DEFAULT_BUILD_CHUNK_SIZE):
+    """
+    lazy reading of dataset by chunks of documents
+    :param filepath: path to saved documents
+    :param chunk_size: number of documents in chunk
+    :return: generator of lists of doc id and text pairs
+    """
+    documents = iter_documents(filepath)
+    while True:
+        chunk = list(islice(documents, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _build_partial_index(documents, run_path: str, positional: bool = False, analyzer = None) -> int:
+    """
+    worker of parallel build, index chunk of dataset into run file
+    :param documents: list of doc id and text pairs
+    :param run_path: path to save partial inverted index
+    :param positional: keep positions of words
+    :param analyzer: class Analyzer to split documents into terms
+    :return: number of indexed documents
+    """
+    partial_index = build_inverted_index(documents, positional, analyzer)
+    MmapStoragePolicy.dump(partial_index, run_path)
+    return len(partial_index.doc_ids)
+
+
+def _iter_sorted_postings(inverted_index, number: int):
+    """
+    postings of inverted index in sorted utf-8 order of words, tagged with index number
+    :param inverted_index: class InvertedIndex
+    :param number: number of index in merge
+    :return: generator of encoded word, number, postings, frequencies and positions
+    """
+    if isinstance(inverted_index.index, MappedIndex):
+        for encoded_word, postings, frequencies, positions in inverted_index.index.iter_encoded():
+            yield encoded_word, number, postings, frequencies, positions
+    else:
+        positional = inverted_index.positional
+        words = sorted((word.encode('utf-8'), word) for word in inverted_index.index)
+        for encoded_word, word in words:
+            yield (
+                encoded_word, number, inverted_index.index[word], inverted_index.term_frequencies(word),
+                inverted_index.term_positions(word) if positional else None,
+            )
+
+
+def merge_inverted_indexes(inverted_indexes, output: str, drop_shadowed: bool = False):
+    """
+    k-way merge of inverted indexes into one index file, documents of every
+    index get internal ids after the documents of previous indexes
+    :param inverted_indexes: list of class InvertedIndex, oldest first
+    :param output: path to save inverted index
+    :param drop_shadowed: drop documents which doc ids are met in newer indexes
+    :return: nothing, output keeps positions only if every index has them
+    """
+    analyzer = inverted_indexes[0].analyzer if inverted_indexes else DEFAULT_ANALYZER
+    if any(inverted_index.analyzer != analyzer for inverted_index in inverted_indexes):
+        raise ValueError("cannot merge inverted indexes built with different analyzers")
+    remaps = []
+    live_doc_ids = []
+    live_doc_lengths = []
+    seen = set()
+    for inverted_index in reversed(inverted_indexes):
+        doc_ids = inverted_index.doc_ids
+        doc_lengths = inverted_index.doc_lengths
+        remap = None
+        if drop_shadowed:
+            remap = [doc_id not in seen for doc_id in doc_ids]
+            seen.update(doc_ids)
+            if all(remap):
+                remap = None
+        remaps.append(remap)
+        if remap is None:
+            live_doc_ids.append(doc_ids)
+            live_doc_lengths.append(doc_lengths)
+        else:
+            live_doc_ids.append([doc_id for doc_id, live in zip(doc_ids, remap) if live])
+            live_doc_lengths.append([length for length, live in zip(doc_lengths, remap) if live])
+    remaps.reverse()
+    live_doc_ids.reverse()
+    live_doc_lengths.reverse()
+    offsets = list(accumulate((len(doc_ids) for doc_ids in live_doc_ids), initial=0))
+    for number, remap in enumerate(remaps):
+        if remap is not None:
+            new_ids = accumulate(remap, initial=offsets[number])
+            remaps[number] = [new_id if live else None for new_id, live in zip(new_ids, remap)]
+    positional = bool(inverted_indexes) and all(inverted_index.positional for inverted_index in inverted_indexes)
+    merged = heapq.merge(*(
+        _iter_sorted_postings(inverted_index, number)
+        for number, inverted_index in enumerate(inverted_indexes)
+    ), key=itemgetter(0, 1))
+    with MmapIndexWriter(output, positional, analyzer) as writer:
+        for encoded_word, group in groupby(merged, key=itemgetter(0)):
+            postings = array('I')
+            frequencies = array('I')
+            positions = [] if positional else None
+            for _, number, index_postings, index_frequencies, index_positions in group:
+                offset, remap = offsets[number], remaps[number]
+                if remap is not None:
+                    live = [remap[doc] is not None for doc in index_postings]
+                    postings.extend(remap[doc] for doc, is_live in zip(index_postings, live) if is_live)
+                    frequencies.extend(
+                        frequency for frequency, is_live in zip(index_frequencies, live) if is_live
+                    )
+                    if positional:
+                        positions.extend(
+                            doc_positions for doc_positions, is_live in zip(index_positions, live) if is_live
+                        )
+                    continue
+                if offset == 0:
+                    postings.extend(index_postings)
+                else:
+                    postings.extend(doc + offset for doc in index_postings)
+                frequencies.extend(index_frequencies)
+                if positional:
+                    positions.extend(index_positions)
+            if postings:
+                writer.add(encoded_word, postings, frequencies, positions)
+        writer.finish(chain.from_iterable(live_doc_ids), chain.from_iterable(live_doc_lengths))
+
+
+def merge_index_runs(run_paths, output: str):
+    """
+    k-way merge of partial indexes into one index file, internal ids of
+    every run are shifted by the number of documents in previous runs
+    :param run_paths: paths of partial inverted indexes in dataset order
+    :param output: path to save inverted index
+    :return: nothing
+    """
+    runs = [MmapStoragePolicy.load(run_path) for run_path in run_paths]
+    try:
+        merge_inverted_indexes(runs, output)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def build_inverted_index_parallel(dataset_path: str, output: str, workers: int,
+                                  chunk_size: int = DEFAULT_BUILD_CHUNK_SIZE, positional: bool = False,
+                                  analyzer = None):
+    """
+    build inverted index by chunks in process pool and merge them into output,
+    at most two chunks per worker are kept in memory
+    :param dataset_path: path to saved documents
+    :param output: path to save inverted index
+    :param workers: number of processes
+    :param chunk_size: number of documents in chunk
+    :param positional: keep positions of words
+    :param analyzer: class Analyzer to split documents into terms
+    :return: nothing
+    """
+    logger.info("build inverted index for %s with %s workers", dataset_path, workers)
+    with TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output))) as runs_dir:
+        run_paths = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for number, chunk in enumerate(iter_document_chunks(dataset_path, chunk_size)):
+                run_path = os.path.join(runs_dir, f"run{number}.index")
+                run_paths.append(run_path)
+                pending.append(executor.submit(_build_partial_index, chunk, run_path, positional, analyzer))
+                if len(pending) >= 2 * workers:
+                    pending.popleft().result()
+            for future in pending:
+                future.result()
+        logger.debug("merge %s partial inverted indexes", len(run_paths))
+        merge_index_runs(run_paths, output)
+
 def callback_build(arguments):
     """
     callback for command build
     :param arguments: args from argparse
     :return: nothing
     """
-    return process_build(arguments.dataset_path, arguments.output)
+    analyzer = Analyzer(
+        lowercase=arguments.lowercase,
+        strip_punctuation=arguments.strip_punctuation,
+        stop_words=load_stop_words(arguments.stop_words) if arguments.stop_words else (),
+        stem=arguments.stem,
+    )
+    return process_build(
+        arguments.dataset_path, arguments.output, arguments.workers, arguments.positional, analyzer,
+    )
 
-def process_build(dataset_path, output):
+def process_build(dataset_path, output, workers = DEFAULT_BUILD_WORKERS, positional = False, analyzer = None):
     """
     building inverted index for callback_build
     :param dataset_path: path to saved documents
     :param output: path to save inverted index
+    :param workers: number of processes, more than one enables parallel build
+    :param positional: keep positions of words for phrase and proximity queries
+    :param analyzer: class Analyzer to split documents into terms, stored with index for queries
     :return: nothing
     """
     logger.debug("call build subcommand with arguments: %s and %s", dataset_path, output)
-    documents = load_documents(dataset_path)
-    inverted_index = build_inverted_index(documents)
+    if workers > 1:
+        return build_inverted_index_parallel(
+            dataset_path, output, workers, positional=positional, analyzer=analyzer,
+        )
+    inverted_index = build_inverted_index(iter_documents(dataset_path), positional, analyzer)
     inverted_index.dump(output)
 
+def segment_paths(filepath: str) -> list:
+    """
+    paths of segments appended to inverted index by update, oldest first
+    :param filepath: path to base inverted index
+    :return: list of paths
+    """
+    paths = glob.glob(glob.escape(filepath) + SEGMENT_SUFFIX + "*")
+    return sorted(path for path in paths if path[len(filepath) + len(SEGMENT_SUFFIX):].isdigit())
+
+
+def callback_update(arguments):
+    """
+    callback for command update
+    :param arguments: args from argparse
+    :return: nothing
+    """
+    return process_update(arguments.dataset_path, arguments.input, arguments.max_segments)
+
+def process_update(dataset_path, input, max_segments = DEFAULT_MAX_SEGMENTS):
+    """
+    append documents as new immutable segment of inverted index,
+    documents with already indexed doc ids replace old versions
+    :param dataset_path: path to new documents
+    :param input: path to base inverted index
+    :param max_segments: merge segments when there are more of them
+    :return: nothing, segment keeps positions and analyzer of base index
+    """
+    logger.debug("call update subcommand with arguments: %s and %s", dataset_path, input)
+    positional = False
+    analyzer = None
+    if os.path.exists(input):
+        base_index = DEFAULT_STORAGE_POLICY.load(input)
+        positional, analyzer = base_index.positional, base_index.analyzer
+        base_index.close()
+    inverted_index = build_inverted_index(iter_documents(dataset_path), positional, analyzer)
+    if not os.path.exists(input):
+        inverted_index.dump(input)
+        return
+    paths = segment_paths(input)
+    number = int(paths[-1][len(input) + len(SEGMENT_SUFFIX):]) + 1 if paths else 1
+    segment_path = f"{input}{SEGMENT_SUFFIX}{number:06d}"
+    inverted_index.dump(segment_path + ".tmp")
+    os.replace(segment_path + ".tmp", segment_path)
+    logger.info("append segment %s to inverted index %s", segment_path, input)
+    if len(paths) + 1 > max_segments:
+        process_merge(input)
+
+def callback_merge(arguments):
+    """
+    callback for command merge
+    :param arguments: args from argparse
+    :return: nothing
+    """
+    return process_merge(arguments.input)
+
+def process_merge(input):
+    """
+    compact base inverted index and its segments into new base index
+    :param input: path to base inverted index
+    :return: nothing
+    """
+    paths = segment_paths(input)
+    if not paths:
+        logger.info("inverted index %s has no segments to merge", input)
+        return
+    logger.info("merge %s segments into inverted index %s", len(paths), input)
+    segmented_index = SegmentedIndex.load(input)
+    try:
+        merge_inverted_indexes(segmented_index.segments, input + ".tmp", drop_shadowed=True)
+    finally:
+        segmented_index.close()
+    os.replace(input + ".tmp", input)
+    for path in paths:
+        os.remove(path)
+
 def callback_query(arguments):
     """
     callback for command query
@@ -205,38 +2198,242 @@ def callback_query(arguments):
     :return: nothing
     """
     if arguments.query:
-        return process_queries_words(arguments.input, arguments.query)
+        return process_queries_words(
+            arguments.input, arguments.query, arguments.top_k, arguments.cache_size,
+            arguments.output, arguments.output_format,
+        )
+    else:
+        return process_queries_file(
+            arguments.input, arguments.query_file, arguments.top_k, arguments.cache_size,
+            arguments.output, arguments.output_format,
+        )
+
+def parse_query(line: str, analyzer = DEFAULT_ANALYZER, positional: bool = True) -> list:
+    """
+    parse query line and normalize its words by analyzer of inverted index
+    :param line: words separated by spaces, maybe with phrases and NEAR/k, AND, OR, NOT or * wildcards
+    :param analyzer: class Analyzer the inverted index was built with
+    :param positional: False for index without positions, quotes and NEAR/k are then ordinary words
+    :return: list of words, list of Phrase and Near clauses or tree of boolean query
+    """
+    if is_boolean_query(line):
+        query = parse_boolean_query(line)
+    elif positional and is_positional_query(line):
+        query = parse_positional_query(line)
+    elif WILDCARD in line:
+        query = parse_wildcard_query(line)
+    else:
+        query = line.split()
+    return analyzer.analyze_query(query)
+
+def parse_queries(lines, analyzer = DEFAULT_ANALYZER, positional: bool = True) -> list:
+    """
+    parse query lines, broken queries are logged and answered with nothing
+    :param lines: query lines
+    :param analyzer: class Analyzer the inverted index was built with
+    :param positional: False for index without positions, see parse_query
+    :return: list of queries made by parse_query, None for broken ones
+    """
+    queries = []
+    for line in lines:
+        try:
+            queries.append(parse_query(line, analyzer, positional))
+        except ValueError as error:
+            logger.warning("cannot parse query %s: %s", repr(line), error)
+            queries.append(None)
+    return queries
+
+def is_positional(query: list) -> bool:
+    return isinstance(query, list) and bool(query) and not isinstance(query[0], str)
+
+def answer_queries(inverted_index, queries, top_k = None) -> list:
+    """
+    answer queries with all matching docs or with top_k docs ranked by BM25,
+    positional and boolean queries are always answered with all matching docs
+    :param inverted_index: class SegmentedIndex or InvertedIndex
+    :param queries: list of queries made by parse_query
+    :param top_k: number of ranked docs to return, None for boolean query
+    :return: list of answers in the same order
+    """
+    answers = [None] * len(queries)
+    word_queries = []
+    for number, query in enumerate(queries):
+        if query is None:
+            answers[number] = []
+        elif isinstance(query, BOOLEAN_NODES):
+            answers[number] = inverted_index.query_boolean(query)
+        elif is_positional(query):
+            answers[number] = inverted_index.query_positional(query)
+        else:
+            word_queries.append((number, query))
+    if top_k is None:
+        word_answers = inverted_index.query_batch([query for _, query in word_queries])
     else:
-        return process_queries_file(arguments.input, arguments.query_file)
+        word_answers = [
+            [doc_id for doc_id, _ in inverted_index.query_ranked(query, top_k)]
+            for _, query in word_queries
+        ]
+    for (number, _), answer in zip(word_queries, word_answers):
+        answers[number] = answer
+    return answers
+
+def log_cache_stats(inverted_index):
+    if inverted_index.cache is not None:
+        logger.info("query cache stats: %s", inverted_index.cache.stats())
 
-def process_queries_words(input, queries):
+def process_queries_words(input, queries, top_k = None, cache_size = DEFAULT_QUERY_CACHE_SIZE,
+                          output = None, output_format = DEFAULT_OUTPUT_FORMAT):
     """
     query for command --query
     :param input: path to saved inverted index
     :param query: words to query
+    :param top_k: number of ranked docs to return, None for boolean query
+    :param cache_size: max number of cached answers, 0 disables cache
+    :param output: path to write answers to, stdout by default
+    :param output_format: one of OUTPUT_FORMATS, see ResultWriter
     :return: print answer
     """
     logger.info("read queries %s", queries)
-    for query in queries:
-        inverted_index = InvertedIndex.load(input)
-        answers = inverted_index.query(query)
-        logger.debug("use the following query to run against InvertedIndex: %s", query)
-        print(*answers, sep=',')
+    inverted_index = SegmentedIndex.load(input, cache_size=cache_size)
+    queries = parse_queries(
+        (" ".join(query) for query in queries), inverted_index.analyzer, inverted_index.positional,
+    )
+    with ResultWriter(output, output_format) as writer:
+        for query, answers in zip(queries, answer_queries(inverted_index, queries, top_k)):
+            logger.debug("use the following query to run against InvertedIndex: %s", query)
+            writer.write(answers)
+    log_cache_stats(inverted_index)
 
-def process_queries_file(input, query_file):
+def process_queries_file(input, query_file, top_k = None, cache_size = DEFAULT_QUERY_CACHE_SIZE,
+                         output = None, output_format = DEFAULT_OUTPUT_FORMAT):
     """
     query for command --query_file_*
     :param input: path to saved inverted index
     :param query_file: file of queries
+    :param top_k: number of ranked docs to return, None for boolean query
+    :param cache_size: max number of cached answers, 0 disables cache
+    :param output: path to write answers to, stdout by default
+    :param output_format: one of OUTPUT_FORMATS, see ResultWriter
     :return: print answers
     """
     logger.info("read queries from %s", query_file)
-    inverted_index = InvertedIndex.load(input)
-    for query in query_file:
-        query = query.strip()
-        answers = inverted_index.query(query.split())
-        logger.debug("use the following query to run against InvertedIndex: %s", query)
-        print(*answers, sep=',')
+    inverted_index = SegmentedIndex.load(input, cache_size=cache_size)
+    queries = parse_queries(query_file, inverted_index.analyzer, inverted_index.positional)
+    with ResultWriter(output, output_format) as writer:
+        for query, answers in zip(queries, answer_queries(inverted_index, queries, top_k)):
+            logger.debug("use the following query to run against InvertedIndex: %s", query)
+            writer.write(answers)
+    log_cache_stats(inverted_index)
+
+class QueryServer:
+    """
+    asyncio front end of inverted index, every request line is a query and
+    every response line has comma separated doc ids; requests of a connection
+    may be pipelined, answers are written in the same order
+    """
+    def __init__(self, inverted_index, top_k = None):
+        self.inverted_index = inverted_index
+        self.top_k = top_k
+        self.requests = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW_SIZE)
+
+    def respond(self, request: str) -> str:
+        """
+        answer one request line
+        :param request: query line or STATS_REQUEST
+        :return: response line without line break
+        """
+        if request == STATS_REQUEST:
+            return json.dumps(self.stats())
+        started = time.perf_counter()
+        try:
+            query = parse_query(request, self.inverted_index.analyzer, self.inverted_index.positional)
+            answers = answer_queries(self.inverted_index, [query], self.top_k)[0]
+        except ValueError as error:
+            logger.warning("cannot answer request %s: %s", repr(request), error)
+            answers = []
+        self.requests += 1
+        self.latencies.append(time.perf_counter() - started)
+        return ",".join(answers)
+
+    def stats(self) -> dict:
+        """
+        latency percentiles over last requests and cache counters
+        :return: dict of stats
+        """
+        latencies = sorted(self.latencies)
+        stats = {
+            "requests": self.requests,
+            "p50_ms": percentile(latencies, 0.5) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+        }
+        if self.inverted_index.cache is not None:
+            stats["cache"] = self.inverted_index.cache.stats()
+        return stats
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = self.respond(line.decode('utf-8').strip())
+                writer.write(response.encode('utf-8') + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def refresh_periodically(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.inverted_index.refresh()
+            except OSError as error:
+                # segments may be removed by concurrent update or merge, try again later
+                logger.warning("cannot refresh inverted index: %s", error)
+
+    async def serve(self, host: str, port: int, refresh_interval: float = DEFAULT_REFRESH_INTERVAL):
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info("serve inverted index on %s", [sock.getsockname() for sock in server.sockets])
+        refresher = asyncio.create_task(self.refresh_periodically(refresh_interval))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            refresher.cancel()
+
+
+def callback_serve(arguments):
+    """
+    callback for command serve
+    :param arguments: args from argparse
+    :return: nothing
+    """
+    return process_serve(
+        arguments.input, arguments.host, arguments.port,
+        arguments.top_k, arguments.cache_size, arguments.refresh_interval,
+    )
+
+def process_serve(input, host = DEFAULT_SERVER_HOST, port = DEFAULT_SERVER_PORT, top_k = None,
+                  cache_size = DEFAULT_QUERY_CACHE_SIZE, refresh_interval = DEFAULT_REFRESH_INTERVAL):
+    """
+    load inverted index once and answer queries over TCP until interrupted
+    :param input: path to saved inverted index
+    :param host: host to listen
+    :param port: port to listen
+    :param top_k: number of ranked docs to return, None for boolean query
+    :param cache_size: max number of cached answers, 0 disables cache
+    :param refresh_interval: seconds between checks of index updates
+    :return: nothing
+    """
+    inverted_index = SegmentedIndex.load(input, cache_size=cache_size)
+    server = QueryServer(inverted_index, top_k)
+    try:
+        asyncio.run(server.serve(host, port, refresh_interval))
+    except KeyboardInterrupt:
+        logger.info("stop serving inverted index, stats: %s", server.stats())
+    finally:
+        inverted_index.close()
 
 def setup_parser(parser):
     subparser = parser.add_subparsers(help="choose command")
@@ -254,8 +2451,62 @@ def setup_parser(parser):
         default=DEFAULT_DATASET_PATH, required=False,
         help="path to dataset to load",
     )
+    build_parser.add_argument(
+        "-w", "--workers", type=int, default=DEFAULT_BUILD_WORKERS,
+        help="number of processes to build inverted index with",
+    )
+    build_parser.add_argument(
+        "--positional", action="store_true",
+        help="keep positions of words to answer \"phrase\" and NEAR/k queries",
+    )
+    build_parser.add_argument(
+        "--lowercase", action="store_true",
+        help="lowercase documents and queries",
+    )
+    build_parser.add_argument(
+        "--strip-punctuation", action="store_true",
+        help="split documents and queries by non-word characters",
+    )
+    build_parser.add_argument(
+        "--stop-words", default=None,
+        help="path to utf-8 file with stop words to drop from documents and queries",
+    )
+    build_parser.add_argument(
+        "--stem", action="store_true",
+        help="strip english suffixes of words in documents and queries",
+    )
     build_parser.set_defaults(callback=callback_build)
 
+    update_parser = subparser.add_parser(
+        "update", help="append documents to inverted index as new segment",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    update_parser.add_argument(
+        "-i", "--index", dest="input",
+        default=DEFAULT_INVERTED_INDEX_STORE_PATH,
+        help="path to inverted index to update"
+    )
+    update_parser.add_argument(
+        "-d", "--dataset", dest="dataset_path", required=True,
+        help="path to dataset with new or changed documents",
+    )
+    update_parser.add_argument(
+        "--max-segments", type=int, default=DEFAULT_MAX_SEGMENTS,
+        help="merge segments into inverted index when there are more of them",
+    )
+    update_parser.set_defaults(callback=callback_update)
+
+    merge_parser = subparser.add_parser(
+        "merge", help="compact segments of inverted index",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    merge_parser.add_argument(
+        "-i", "--index", dest="input",
+        default=DEFAULT_INVERTED_INDEX_STORE_PATH,
+        help="path to inverted index to merge"
+    )
+    merge_parser.set_defaults(callback=callback_merge)
+
     query_parser = subparser.add_parser(
         "query", help="query inverted index",
         formatter_class=ArgumentDefaultsHelpFormatter,
@@ -278,10 +2529,52 @@ def setup_parser(parser):
     )
     query_parser.add_argument(
         "-q", "--query", nargs="+", action='append',
-        help="query word to get queries for inverted index",
+        help="query word to get queries for inverted index, AND, OR, NOT and parentheses are operators, "
+             "* in word matches any characters, \"phrase\" and NEAR/k need positional index",
+    )
+    query_parser.add_argument(
+        "-k", "--top-k", type=int, default=None,
+        help="return only top K documents with any of query words ranked by BM25",
+    )
+    query_parser.add_argument(
+        "--cache-size", type=int, default=DEFAULT_QUERY_CACHE_SIZE,
+        help="max number of query answers kept in LRU cache, 0 disables cache",
+    )
+    query_parser.add_argument(
+        "-o", "--output", default=None,
+        help="path to write answers to instead of stdout",
+    )
+    query_parser.add_argument(
+        "--output-format", choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT,
+        help="comma separated doc ids, json lines or binary records with big-endian uint32 length",
     )
     query_parser.set_defaults(callback=callback_query)
 
+    serve_parser = subparser.add_parser(
+        "serve", help="load inverted index once and answer queries over TCP",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    serve_parser.add_argument(
+        "-i", "--index", dest="input",
+        default=DEFAULT_INVERTED_INDEX_STORE_PATH,
+        help="path to read inverted index"
+    )
+    serve_parser.add_argument("--host", default=DEFAULT_SERVER_HOST, help="host to listen")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_SERVER_PORT, help="port to listen")
+    serve_parser.add_argument(
+        "-k", "--top-k", type=int, default=None,
+        help="return only top K documents with any of query words ranked by BM25",
+    )
+    serve_parser.add_argument(
+        "--cache-size", type=int, default=DEFAULT_QUERY_CACHE_SIZE,
+        help="max number of query answers kept in LRU cache, 0 disables cache",
+    )
+    serve_parser.add_argument(
+        "--refresh-interval", type=float, default=DEFAULT_REFRESH_INTERVAL,
+        help="seconds between checks whether inverted index was updated",
+    )
+    serve_parser.set_defaults(callback=callback_serve)
+
 def setup_logging():
     with open(DEFAULT_LOGGING_CONFIG_FILEPATH) as config_fin:
         logging.config.dictConfig(yaml.safe_load(config_fin))
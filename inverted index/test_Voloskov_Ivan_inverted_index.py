@@ -1,3 +1,7 @@
+import asyncio
+import json
+import math
+from fnmatch import fnmatchcase
 from textwrap import dedent
 
 import pytest
@@ -5,7 +9,14 @@ import ast
 import logging
 
 from task_Voloskov_Ivan_inverted_index import StoragePolicy, InvertedIndex, build_inverted_index, load_documents,\
-    process_queries_file, process_build, process_queries_words
+    process_queries_file, process_build, process_queries_words, MmapStoragePolicy, MappedIndex,\
+    encode_postings, decode_postings, encode_frequencies, decode_frequencies, intersect_postings, build_inverted_index_parallel,\
+    iter_documents, process_update, process_merge, segment_paths, SegmentedIndex,\
+    BM25_K1, BM25_B, QueryCache, QueryServer, parse_query, Phrase, Near,\
+    Term, And, Or, Not, Wildcard, Analyzer, light_stem, is_utf8, encode_term_block, decode_term_block,\
+    ResultWriter
+from inverted_index_client import query_server, STATS_REQUEST
+from inverted_index_benchmark import run_benchmark, generate_corpus, parse_scale
 
 DATASET_SMALL_FPATH = "small_wikipedia.sample"
 DATASET_TINY_FPATH = "tiny_wikipedia.sample"
@@ -23,6 +34,15 @@ def test_can_load_documents():
     }
     assert etalon_documents == documents, ("load_documents incorrectly loaded dataset")
 
+@pytest.mark.parametrize("buffer_size", [1, 7, 1 << 20])
+def test_can_iterate_documents_by_blocks(buffer_size):
+    documents = list(iter_documents(DATASET_TINY_FPATH, buffer_size = buffer_size))
+    assert list(load_documents(DATASET_TINY_FPATH).items()) == documents
+
+def test_can_build_inverted_index_from_document_stream():
+    etalon_inverted_index = build_inverted_index(load_documents(DATASET_TINY_FPATH))
+    assert etalon_inverted_index == build_inverted_index(iter_documents(DATASET_TINY_FPATH))
+
 @pytest.mark.parametrize(
     "query, etalon_answer",
     [
@@ -101,6 +121,471 @@ def test_can_dump_and_load_inverted_index_with_array_police_parametrized(filepat
         "load should return the same inverted index"
     )
 
+@pytest.mark.parametrize(
+    "query, etalon_answer",
+    [
+        pytest.param(["A_word"], ["123", "37"]),
+        pytest.param(["A_word", "B_word"], ["37"], id = "both_words"),
+        pytest.param(["word does not exist"], [], id = "word does not exist"),
+    ],
+)
+def test_can_query_memory_mapped_index(tmpdir, tiny_wikipedia_inverted_index, query, etalon_answer):
+    index_fio = tmpdir.join("index.dump")
+    tiny_wikipedia_inverted_index.dump(index_fio, storage_policy = MmapStoragePolicy)
+    loaded_inverted_index = InvertedIndex.load(index_fio, storage_policy = MmapStoragePolicy)
+    assert isinstance(loaded_inverted_index.index, MappedIndex)
+    assert sorted(loaded_inverted_index.query(query)) == sorted(etalon_answer)
+    loaded_inverted_index.close()
+
+def test_mmap_storage_policy_can_load_legacy_index(tmpdir, tiny_wikipedia_inverted_index):
+    index_fio = tmpdir.join("index.dump")
+    tiny_wikipedia_inverted_index.dump(index_fio, storage_policy = StoragePolicy)
+    loaded_inverted_index = InvertedIndex.load(index_fio, storage_policy = MmapStoragePolicy)
+    assert tiny_wikipedia_inverted_index == loaded_inverted_index
+
+@pytest.mark.parametrize(
+    "postings",
+    [
+        pytest.param([], id = "empty"),
+        pytest.param([1, 2, 5, 37, 123], id = "small deltas"),
+        pytest.param([0, 127, 128, 70000, 2 ** 32 - 1], id = "large doc ids"),
+    ],
+)
+def test_can_encode_and_decode_postings(postings):
+    assert list(decode_postings(encode_postings(reversed(postings)))) == postings
+
+@pytest.mark.parametrize(
+    "frequencies",
+    [
+        pytest.param([], id = "empty"),
+        pytest.param([1, 1, 1], id = "only ones"),
+        pytest.param([2, 1, 1, 300, 1, 7], id = "mixed"),
+    ],
+)
+def test_can_encode_and_decode_frequencies(frequencies):
+    assert list(decode_frequencies(encode_frequencies(frequencies), len(frequencies))) == frequencies
+
+@pytest.mark.parametrize("dataset", ["small_wikipedia", "zipf_corpus"])
+def test_mmap_index_is_smaller_than_legacy_one(tmpdir, dataset):
+    dataset_path = DATASET_SMALL_FPATH
+    if dataset == "zipf_corpus":
+        dataset_path = str(tmpdir.join("corpus.txt"))
+        generate_corpus(dataset_path, 2000, vocabulary_size = 5000)
+    inverted_index = build_inverted_index(iter_documents(dataset_path))
+    mmap_path, legacy_path = tmpdir.join("mmap.index"), tmpdir.join("legacy.index")
+    inverted_index.dump(mmap_path, storage_policy = MmapStoragePolicy)
+    inverted_index.dump(legacy_path, storage_policy = StoragePolicy)
+    assert mmap_path.size() < legacy_path.size()
+    loaded_inverted_index = InvertedIndex.load(mmap_path)
+    word = max(inverted_index.index, key = lambda word: len(inverted_index.index[word]))
+    assert list(inverted_index.term_frequencies(word)) == list(loaded_inverted_index.term_frequencies(word))
+    loaded_inverted_index.close()
+
+def test_can_dump_and_load_index_with_large_doc_ids(tmpdir):
+    index_fio = tmpdir.join("index.dump")
+    etalon_inverted_index = build_inverted_index({
+        "1": "word", "65536": "word", "4000000000": "word other", "70000": "other",
+    })
+    etalon_inverted_index.dump(index_fio)
+    loaded_inverted_index = InvertedIndex.load(index_fio)
+    assert etalon_inverted_index == loaded_inverted_index
+    assert sorted(loaded_inverted_index.query(["word", "other"])) == ["4000000000"]
+    with pytest.raises(ValueError):
+        etalon_inverted_index.dump(index_fio, storage_policy = StoragePolicy)
+
+def test_build_inverted_index_stores_internal_ids(tiny_wikipedia_inverted_index):
+    assert list(tiny_wikipedia_inverted_index.doc_ids) == ["123", "2", "5", "37"]
+    assert list(tiny_wikipedia_inverted_index.index["A_word"]) == [0, 3]
+
+def test_query_does_not_depend_on_missing_words(tiny_wikipedia_inverted_index):
+    assert [] == tiny_wikipedia_inverted_index.query(["A_word", "word does not exist"])
+    assert sorted(tiny_wikipedia_inverted_index.query(["A_word"])) == ["123", "37"]
+
+def test_query_does_not_modify_inverted_index(tiny_wikipedia_inverted_index):
+    etalon_index = tiny_wikipedia_inverted_index.to_external()
+    assert ["37"] == tiny_wikipedia_inverted_index.query(["B_word", "A_word", "A_word"])
+    assert ["37"] == tiny_wikipedia_inverted_index.query(["A_word", "B_word"])
+    assert etalon_index == tiny_wikipedia_inverted_index.to_external()
+
+@pytest.mark.parametrize(
+    "small, large, etalon_answer",
+    [
+        pytest.param([], [1, 2, 3], [], id = "empty"),
+        pytest.param([3, 70, 1000], list(range(0, 2000, 7)), [70], id = "galloping"),
+        pytest.param([0, 5, 9], [0, 5, 9], [0, 5, 9], id = "same"),
+        pytest.param([9, 10], [1, 2, 3], [], id = "after the end"),
+    ],
+)
+def test_can_intersect_postings(small, large, etalon_answer):
+    assert list(intersect_postings(small, large)) == etalon_answer
+
+def test_query_batch_returns_the_same_answers_as_query(small_wikipedia_inverted_index):
+    queries = [["one"], ["one", "two"], ["two", "one", "three"], ["one", "absent"], ["one", "two"], []]
+    etalon_answers = [small_wikipedia_inverted_index.query(query) for query in queries]
+    assert etalon_answers == small_wikipedia_inverted_index.query_batch(queries)
+
+def test_process_query_words_loads_index_once(caplog):
+    caplog.set_level("DEBUG")
+    process_queries_words(SMALL_INVERTED_INDEX_PATH, [["one"], ["two"], ["one", "two"]])
+    assert 1 == sum("load inverted index" in message for message in caplog.messages)
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+def test_parallel_build_is_the_same_as_sequential(tmpdir, small_wikipedia_inverted_index, chunk_size):
+    index_fio = tmpdir.join("index.dump")
+    build_inverted_index_parallel(DATASET_SMALL_FPATH, str(index_fio), workers = 2, chunk_size = chunk_size)
+    loaded_inverted_index = InvertedIndex.load(index_fio)
+    assert list(small_wikipedia_inverted_index.doc_ids) == list(loaded_inverted_index.doc_ids)
+    assert small_wikipedia_inverted_index == loaded_inverted_index
+    loaded_inverted_index.close()
+
+def test_can_update_and_merge_inverted_index(tmpdir):
+    index_path = str(tmpdir.join("index.dump"))
+    process_build(DATASET_TINY_FPATH, index_path)
+    update_path = tmpdir.join("update.sample")
+    update_path.write("2\tsome word A_word in this dataset\n40\tnew A_word\n")
+    process_update(str(update_path), index_path)
+    assert 1 == len(segment_paths(index_path))
+    segmented_index = SegmentedIndex.load(index_path)
+    etalon_answers = [["123", "37", "2", "40"], ["37"], ["40"]]
+    assert etalon_answers == segmented_index.query_batch([["A_word"], ["B_word"], ["new"]])
+    segmented_index.close()
+    process_merge(index_path)
+    assert [] == segment_paths(index_path)
+    merged_index = InvertedIndex.load(index_path)
+    assert etalon_answers == merged_index.query_batch([["A_word"], ["B_word"], ["new"]])
+    assert ["123", "5", "37", "2", "40"] == list(merged_index.doc_ids)
+    merged_index.close()
+
+def test_update_merges_too_many_segments(tmpdir):
+    index_path = str(tmpdir.join("index.dump"))
+    process_build(DATASET_TINY_FPATH, index_path)
+    update_path = tmpdir.join("update.sample")
+    update_path.write("40\tnew A_word\n")
+    for _ in range(3):
+        process_update(str(update_path), index_path, max_segments = 2)
+    assert 0 == len(segment_paths(index_path))
+    process_update(str(update_path), index_path, max_segments = 2)
+    assert 1 == len(segment_paths(index_path))
+    segmented_index = SegmentedIndex.load(index_path)
+    assert ["123", "37", "40"] == segmented_index.query(["A_word"])
+    segmented_index.close()
+
+def bm25_brute_force(documents, words):
+    tokenized = {doc_id: text.split() for doc_id, text in documents.items()}
+    average_length = sum(map(len, tokenized.values())) / len(tokenized)
+    scores = {}
+    for word in set(words):
+        matched = [doc_id for doc_id, tokens in tokenized.items() if word in tokens]
+        idf = math.log(1 + (len(tokenized) - len(matched) + 0.5) / (len(matched) + 0.5))
+        for doc_id in matched:
+            frequency = tokenized[doc_id].count(word)
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * len(tokenized[doc_id]) / average_length)
+            scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+    return scores
+
+@pytest.mark.parametrize("words", [["A_word"], ["to", "be", "A_word"], ["words", "B_word", "absent"], ["absent"]])
+@pytest.mark.parametrize("top_k", [1, 2, 10])
+def test_query_ranked_returns_top_k_by_bm25(tmpdir, tiny_wikipedia_documents, words, top_k):
+    etalon_scores = bm25_brute_force(tiny_wikipedia_documents, words)
+    etalon_top = sorted(etalon_scores.values(), reverse=True)[:top_k]
+    inverted_index = build_inverted_index(tiny_wikipedia_documents)
+    index_fio = tmpdir.join("index.dump")
+    inverted_index.dump(index_fio)
+    for ranked_index in (inverted_index, InvertedIndex.load(index_fio)):
+        top = ranked_index.query_ranked(words, top_k)
+        assert [score for _, score in top] == pytest.approx(etalon_top)
+        assert all(etalon_scores[doc_id] == pytest.approx(score) for doc_id, score in top)
+
+def test_query_ranked_prunes_with_max_score(small_wikipedia_documents, small_wikipedia_inverted_index):
+    words = ["the", "of", "anarchism", "one"]
+    etalon_scores = bm25_brute_force(small_wikipedia_documents, words)
+    top = small_wikipedia_inverted_index.query_ranked(words, 1)
+    assert top[0][1] == pytest.approx(max(etalon_scores.values()))
+
+def test_query_cache_evicts_least_recently_used():
+    cache = QueryCache(2)
+    cache.put(QueryCache.key(["b", "a"]), ["1"])
+    cache.put(QueryCache.key(["c"]), ["2"])
+    assert ["1"] == cache.get(QueryCache.key(["a", "b", "a"]))
+    cache.put(QueryCache.key(["d"]), ["3"])
+    assert cache.get(QueryCache.key(["c"])) is None
+    assert cache.get(QueryCache.key(["a", "b"], top_k = 1)) is None
+    assert {"size": 2, "hits": 1, "misses": 2, "evictions": 1, "hit_rate": 1 / 3} == cache.stats()
+
+def test_segmented_index_cache_is_invalidated_by_update(tmpdir):
+    index_path = str(tmpdir.join("index.dump"))
+    process_build(DATASET_TINY_FPATH, index_path)
+    segmented_index = SegmentedIndex.load(index_path, cache_size = 8)
+    queries = [["A_word"], ["A_word", "A_word"], ["B_word", "A_word"], ["A_word", "B_word"]]
+    assert [["123", "37"], ["123", "37"], ["37"], ["37"]] == segmented_index.query_batch(queries)
+    assert ["123", "37"] == segmented_index.query(["A_word"])
+    assert {"size": 2, "hits": 1, "misses": 4} == {
+        key: value for key, value in segmented_index.cache.stats().items() if key in ("size", "hits", "misses")
+    }
+    assert not segmented_index.refresh()
+    update_path = tmpdir.join("update.sample")
+    update_path.write("40\tnew A_word\n")
+    process_update(str(update_path), index_path)
+    assert segmented_index.refresh()
+    assert 0 == len(segmented_index.cache)
+    assert ["123", "37", "40"] == segmented_index.query(["A_word"])
+    segmented_index.close()
+
+def test_query_server_keeps_refreshing_after_failed_refresh(tmpdir, caplog):
+    index_path = str(tmpdir.join("index.dump"))
+    process_build(DATASET_TINY_FPATH, index_path)
+    segmented_index = SegmentedIndex.load(index_path)
+    refreshes = []
+
+    def refresh():
+        refreshes.append(len(refreshes))
+        if len(refreshes) == 1:
+            raise FileNotFoundError(index_path + ".seg1")
+        return False
+
+    segmented_index.refresh = refresh
+
+    async def run_refresher():
+        refresher = asyncio.create_task(QueryServer(segmented_index).refresh_periodically(0))
+        while len(refreshes) < 3:
+            await asyncio.sleep(0)
+        refresher.cancel()
+
+    asyncio.run(run_refresher())
+    assert any("cannot refresh inverted index" in message for message in caplog.messages)
+    segmented_index.close()
+
+def test_query_server_answers_pipelined_queries(tiny_wikipedia_inverted_index):
+    async def run_server_and_client():
+        server = QueryServer(SegmentedIndex([tiny_wikipedia_inverted_index]))
+        tcp_server = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = tcp_server.sockets[0].getsockname()[1]
+        queries = ["A_word", "B_word A_word", "absent"] * 100 + [STATS_REQUEST]
+        async with tcp_server:
+            return await asyncio.to_thread(query_server, queries, "127.0.0.1", port)
+
+    answers = asyncio.run(run_server_and_client())
+    assert ["123,37", "37", ""] * 100 == answers[:-1]
+    stats = json.loads(answers[-1])
+    assert 300 == stats["requests"]
+    assert 0 <= stats["p50_ms"] <= stats["p99_ms"]
+
+@pytest.mark.parametrize(
+    "line, etalon_query",
+    [
+        ("some words", ["some", "words"]),
+        ('"to be" or', [Phrase(["to", "be"]), Phrase(["or"])]),
+        ('"not to be" NEAR/2 famous_phrases', [Near(Phrase(["not", "to", "be"]), Phrase(["famous_phrases"]), 2)]),
+    ],
+)
+def test_can_parse_positional_query(line, etalon_query):
+    assert etalon_query == parse_query(line)
+
+@pytest.mark.parametrize("line", ["NEAR/1 be", "to NEAR/1", "to NEAR/1 be NEAR/1 or"])
+def test_parse_query_rejects_broken_near(line):
+    with pytest.raises(ValueError):
+        parse_query(line)
+
+@pytest.mark.parametrize(
+    "line, etalon_answer",
+    [
+        ('"to be"', ["5"]),
+        ('"be to"', []),
+        ('"not to be"', ["5"]),
+        ('"A_word and" B_word', ["37"]),
+        ("not NEAR/1 to", ["5"]),
+        ("famous_phrases NEAR/2 be", ["5"]),
+        ("famous_phrases NEAR/1 be", []),
+        ("be NEAR/2 famous_phrases", ["5"]),
+        ('some NEAR/3 "A_word and"', ["123"]),
+        ('"absent words"', []),
+    ],
+)
+@pytest.mark.parametrize("dumped", [False, True])
+def test_can_answer_phrase_and_near_queries(tmpdir, tiny_wikipedia_documents, line, etalon_answer, dumped):
+    inverted_index = build_inverted_index(tiny_wikipedia_documents, positional=True)
+    if dumped:
+        filepath = str(tmpdir.join("positional.index"))
+        inverted_index.dump(filepath)
+        inverted_index = InvertedIndex.load(filepath)
+    assert inverted_index.positional
+    assert etalon_answer == sorted(inverted_index.query_positional(parse_query(line)))
+
+def test_positional_query_needs_positional_index(tiny_wikipedia_inverted_index):
+    with pytest.raises(ValueError):
+        tiny_wikipedia_inverted_index.query_positional(parse_query('"to be"'))
+
+def test_update_and_merge_keep_positions(tmpdir, capsys):
+    filepath = str(tmpdir.join("positional.index"))
+    process_build(DATASET_TINY_FPATH, filepath, positional=True)
+    update_path = tmpdir.join("update.sample")
+    update_path.write("5\tto be continued\n40\tor not to be\n")
+    process_update(str(update_path), filepath)
+    process_queries_words(filepath, [['"not', 'to', 'be"'], ['"to', 'be"', 'A_word']])
+    assert "40\n\n" == capsys.readouterr().out
+    process_merge(filepath)
+    merged_index = InvertedIndex.load(filepath)
+    assert merged_index.positional
+    assert ["40", "5"] == sorted(merged_index.query_positional(parse_query('"to be"')))
+    merged_index.close()
+
+@pytest.mark.parametrize(
+    "line, etalon_tree",
+    [
+        ("some AND words", And([Term("some"), Term("words")])),
+        ("some OR words A_word", Or([Term("some"), And([Term("words"), Term("A_word")])])),
+        ("NOT (to OR be) some", And([Not(Or([Term("to"), Term("be")])), Term("some")])),
+    ],
+)
+def test_can_parse_boolean_query(line, etalon_tree):
+    assert etalon_tree == parse_query(line)
+
+@pytest.mark.parametrize("line", ["some AND", "(some OR words", "some )", "NOT", '"to be" OR some'])
+def test_parse_query_rejects_broken_boolean_query(line):
+    with pytest.raises(ValueError):
+        parse_query(line)
+
+@pytest.mark.parametrize(
+    "line, etalon_query",
+    [("(born", ["(born"]), ("born 1900)", ["born", "1900)"]), ("(born*", Wildcard("(born*"))],
+)
+def test_parentheses_glued_to_words_are_terms(line, etalon_query):
+    assert etalon_query == parse_query(line)
+
+def test_process_queries_answers_broken_query_with_nothing(tmpdir, capsys, caplog):
+    filepath = str(tmpdir.join("born.index"))
+    build_inverted_index({"1": "Smith (born 1900) was", "2": "born here"}).dump(filepath)
+    process_queries_words(filepath, [["(born"], ["born", "AND"], ["1900)", "was"], ["(born*"]])
+    assert "1\n\n1\n1\n" == capsys.readouterr().out
+    assert any("cannot parse query" in message for message in caplog.messages)
+
+@pytest.mark.parametrize(
+    "line, etalon_answer",
+    [
+        ("A_word OR B_word", ["123", "2", "37"]),
+        ("A_word AND B_word", ["37"]),
+        ("some AND NOT B_word", ["123"]),
+        ("NOT some", ["37", "5"]),
+        ("NOT (A_word OR B_word)", ["5"]),
+        ("(to OR words) AND NOT (all OR nothing)", ["5"]),
+        ("absent OR (famous_phrases AND be)", ["5"]),
+        ("absent AND some", []),
+        ("NOT absent", ["123", "2", "37", "5"]),
+    ],
+)
+def test_can_answer_boolean_queries(tiny_wikipedia_inverted_index, line, etalon_answer):
+    assert etalon_answer == sorted(tiny_wikipedia_inverted_index.query_boolean(parse_query(line)))
+
+def test_boolean_and_is_the_same_as_query(small_wikipedia_inverted_index):
+    words = ["the", "of", "anarchism"]
+    assert small_wikipedia_inverted_index.query(words) == \
+        small_wikipedia_inverted_index.query_boolean(parse_query(" AND ".join(words)))
+
+@pytest.mark.parametrize(
+    "line, etalon_query",
+    [
+        ("A_w*", Wildcard("A_w*")),
+        ("some wo*", And([Term("some"), Wildcard("wo*")])),
+        ("*_word OR nothing", Or([Wildcard("*_word"), Term("nothing")])),
+    ],
+)
+def test_can_parse_wildcard_query(line, etalon_query):
+    assert etalon_query == parse_query(line)
+
+def test_can_encode_and_decode_term_block():
+    terms = [b"", b"a", b"anarch", b"anarchism", b"anarchist", "\u0430\u0431".encode("utf-8"), b"b"]
+    encoded = encode_term_block(terms)
+    assert terms == decode_term_block(b"xx" + encoded, 2, len(terms))[0]
+    assert terms[:3] == decode_term_block(encoded, 0, 3)[0]
+    fields = [(number, 300 * number) for number in range(len(terms))]
+    assert (terms, fields) == decode_term_block(encode_term_block(terms, fields), 0, len(terms), 2)
+
+@pytest.mark.parametrize(
+    "words, etalon_answer",
+    [
+        (["*_word"], ["123", "2", "37"]),
+        (["wo*"], ["123", "2", "37"]),
+        (["wo*s", "A_*"], ["123", "37"]),
+        (["s*e", "*rd"], ["123", "2"]),
+        (["absent*"], []),
+        (["some", "absent*"], []),
+    ],
+)
+@pytest.mark.parametrize("dumped", [False, True])
+def test_query_can_expand_wildcards(tmpdir, tiny_wikipedia_inverted_index, words, etalon_answer, dumped):
+    inverted_index = tiny_wikipedia_inverted_index
+    if dumped:
+        filepath = str(tmpdir.join("tiny.index"))
+        inverted_index.dump(filepath)
+        inverted_index = InvertedIndex.load(filepath)
+    assert etalon_answer == sorted(inverted_index.query(words))
+    assert etalon_answer == sorted(inverted_index.query_boolean(parse_query(" ".join(words))))
+
+def test_front_coded_dictionary_expands_like_sorted_words(tmpdir, small_wikipedia_inverted_index):
+    filepath = str(tmpdir.join("small.index"))
+    small_wikipedia_inverted_index.dump(filepath)
+    loaded_inverted_index = InvertedIndex.load(filepath)
+    words = sorted(small_wikipedia_inverted_index.index)
+    assert words == list(loaded_inverted_index.index)
+    for pattern in ["a*", "anarch*", "*ism", "th*e", "*", "zzz*"]:
+        etalon_words = [word for word in words if fnmatchcase(word, pattern)]
+        assert etalon_words == small_wikipedia_inverted_index.expand_terms(pattern)
+        assert etalon_words == loaded_inverted_index.expand_terms(pattern)
+    for word in words[::17]:
+        assert small_wikipedia_inverted_index.query([word]) == loaded_inverted_index.query([word])
+    assert [] == loaded_inverted_index.query(["anarchis"])
+    loaded_inverted_index.close()
+
+@pytest.mark.parametrize(
+    "analyzer, text, etalon_terms",
+    [
+        (Analyzer(), "Some, Words. A_word", ["Some,", "Words.", "A_word"]),
+        (Analyzer(lowercase=True), "Some, Words. A_word", ["some,", "words.", "a_word"]),
+        (Analyzer(lowercase=True, strip_punctuation=True), "Some, Words. A_word", ["some", "words", "a_word"]),
+        (Analyzer(strip_punctuation=True, stop_words=["to", "or"]), "to be, or not to be", ["be", "not", "be"]),
+        (Analyzer(lowercase=True, stem=True), "Ponies running Classes", ["pony", "run", "class"]),
+    ],
+)
+def test_analyzer_normalizes_text(analyzer, text, etalon_terms):
+    assert etalon_terms == analyzer.analyze(text)
+    assert etalon_terms == analyzer.analyze(text)
+
+@pytest.mark.parametrize(
+    "term, etalon_stem",
+    [("words", "word"), ("ponies", "pony"), ("glasses", "glass"), ("status", "status"),
+     ("indexed", "index"), ("running", "run"), ("quickly", "quick"), ("sing", "sing"), ("red", "red")],
+)
+def test_light_stem(term, etalon_stem):
+    assert etalon_stem == light_stem(term)
+
+def test_is_utf8():
+    assert 1 == is_utf8("word")
+    assert 1 == is_utf8("")
+    assert 0 == is_utf8("слово")
+
+def test_analyzer_is_stored_with_index_and_applied_to_queries(tmpdir, capsys):
+    dataset_path = tmpdir.join("dataset.sample")
+    dataset_path.write("1\tAnarchism is a political philosophy.\n2\tanarchism, Anarchists and the State\n")
+    filepath = str(tmpdir.join("analyzed.index"))
+    analyzer = Analyzer(lowercase=True, strip_punctuation=True, stop_words=["the", "is", "a"], stem=True)
+    process_build(str(dataset_path), filepath, analyzer=analyzer)
+    inverted_index = InvertedIndex.load(filepath)
+    assert analyzer == inverted_index.analyzer
+    assert ["1", "2"] == inverted_index.query(["anarchism"])
+    assert "the" not in inverted_index.index
+    inverted_index.close()
+    process_queries_words(filepath, [["ANARCHISM,"], ["the", "State"], ["Anarchist"], ["philosophy", "OR", "states"]])
+    assert "1,2\n2\n2\n1,2\n" == capsys.readouterr().out
+
+def test_parallel_build_uses_analyzer(tmpdir, small_wikipedia_documents):
+    analyzer = Analyzer(lowercase=True, strip_punctuation=True)
+    filepath = str(tmpdir.join("parallel.index"))
+    build_inverted_index_parallel(DATASET_SMALL_FPATH, filepath, workers=2, chunk_size=2, analyzer=analyzer)
+    inverted_index = InvertedIndex.load(filepath)
+    assert build_inverted_index(small_wikipedia_documents, analyzer=analyzer) == inverted_index
+    assert analyzer == inverted_index.analyzer
+    inverted_index.close()
+
 def test_process_build_can_build():
     process_build(DATASET_SMALL_FPATH, SMALL_INVERTED_INDEX_PATH)
 
@@ -120,6 +605,17 @@ def test_process_query_can_process_all_queries(capsys, caplog):
         )
         assert len(captured.out.split()) == 3
 
+def test_process_query_treats_quotes_as_words_without_positions(tmpdir, capsys):
+    dataset_path, index_path = str(tmpdir.join("dataset.txt")), str(tmpdir.join("quotes.index"))
+    with open(dataset_path, "w") as fout:
+        fout.write('1\tsaid "is often" here\n2\tit is often so\n3\t"whiteness" of snow\n')
+    process_build(dataset_path, index_path)
+    with open(str(tmpdir.join("queries.txt")), "w+") as fin:
+        fin.write('"is often"\n"whiteness"\nis often\nnear NEAR/2 snow\n')
+        fin.seek(0)
+        process_queries_file(input=index_path, query_file=fin)
+    assert "1\n3\n2\n\n" == capsys.readouterr().out
+
 def test_process_query_can_process_all_queries_cp1251(capsys):
     with open("queries_cp1251.txt", encoding="cp1251") as fin:
         process_queries_file(
@@ -136,6 +632,63 @@ def test_process_query_can_process_all_queries_utf8(capsys):
         )
         captured = capsys.readouterr()
 
+@pytest.mark.parametrize(
+    "output_format, etalon_output",
+    [
+        ("text", b"123,37\n\n"),
+        ("ndjson", b'["123", "37"]\n[]\n'),
+        ("binary", b"\x00\x00\x00\x06123,37\x00\x00\x00\x00"),
+    ],
+)
+def test_process_query_words_can_write_answers_to_file(tmpdir, tiny_wikipedia_inverted_index,
+                                                       output_format, etalon_output):
+    filepath = str(tmpdir.join("tiny.index"))
+    output = tmpdir.join("answers")
+    tiny_wikipedia_inverted_index.dump(filepath)
+    process_queries_words(filepath, [["A_word"], ["absent"]], output=str(output), output_format=output_format)
+    assert etalon_output == output.read_binary()
+
+def test_result_writer_flushes_full_buffer(tmpdir):
+    output = tmpdir.join("answers")
+    writer = ResultWriter(str(output), buffer_size=8)
+    writer.write(["1", "2"])
+    assert b"" == output.read_binary()
+    writer.write(["3", "45"])
+    assert b"1,2\n3,45\n" == output.read_binary()
+    writer.write([])
+    writer.close()
+    assert b"1,2\n3,45\n\n" == output.read_binary()
+
+@pytest.mark.parametrize("value, etalon_scale", [("300", 300), ("10k", 10000), ("10M", 10000000)])
+def test_benchmark_can_parse_scale(value, etalon_scale):
+    assert etalon_scale == parse_scale(value)
+
+def test_benchmark_corpus_is_reproducible(tmpdir):
+    first, second, other = (str(tmpdir.join(name)) for name in ("first", "second", "other"))
+    generate_corpus(first, 50, seed=1)
+    generate_corpus(second, 50, seed=1)
+    generate_corpus(other, 50, seed=2)
+    with open(first) as first_file, open(second) as second_file, open(other) as other_file:
+        corpus = first_file.read()
+        assert corpus == second_file.read() != other_file.read()
+    assert 50 == len(load_documents(first))
+
+def test_benchmark_reports_every_stage(tmpdir):
+    records = run_benchmark([200], vocabulary_size=500, queries_count=20, workdir=str(tmpdir))
+    json.dumps(records)
+    stages = {(record["stage"], record.get("index")) for record in records}
+    for index in ("memory", "mmap", "legacy"):
+        assert {("query", index), ("query_ranked", index), ("query_wildcard", index)} <= stages
+    assert {("generate", None), ("build", None), ("dump", "mmap"), ("load", "legacy")} <= stages
+    queries = [record for record in records if record["stage"] == "query"]
+    assert all(record["operations"] == 20 and record["p50_ms"] <= record["p99_ms"] for record in queries)
+    assert len({record["answers"] for record in queries}) == 1
+
+def test_process_query_words_can_return_top_k(capsys):
+    process_queries_words(SMALL_INVERTED_INDEX_PATH, [['some', 'two']], top_k = 2)
+    captured = capsys.readouterr()
+    assert len(ast.literal_eval(captured.out)) == 2
+
 def test_process_query_words_can_solve_community_case(capsys):
     query = [['some', 'two']]
     process_queries_words(SMALL_INVERTED_INDEX_PATH,query)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+import os
+import platform
+import random
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+from task_Voloskov_Ivan_stackoverflow_analytics import ResultWriter, PostTable, build_aggregates, save_cache,\
+    load_cache, source_state, get_stop_words, score_for_interval, top_for_query, process_queries,\
+    build_year_sketches, sketch_for_interval, top_for_sketch, DEFAULT_WRITE_BUFFER_SIZE
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from benchmark_tools import ZipfSampler, BenchmarkReport, synthetic_word, time_queries, benchmark_argument_parser,\
+    DEFAULT_SEED, DEFAULT_QUERIES, DEFAULT_TOP_K
+
+BENCHMARK_NAME = "stackoverflow_analytics"
+DEFAULT_VOCABULARY_SIZE = 20000
+DEFAULT_TITLE_LENGTH = 8
+DEFAULT_CAPACITY = 1000
+FIRST_YEAR = 2008
+LAST_YEAR = 2020
+ANSWERS_SHARE = 0.5
+STOP_WORDS_COUNT = 20
+
+def generate_dump(path, posts, vocabulary_size=DEFAULT_VOCABULARY_SIZE, title_length=DEFAULT_TITLE_LENGTH,
+                  seed=DEFAULT_SEED):
+    """
+    write reproducible dump of bare rows, about ANSWERS_SHARE of rows are answers without titles
+    :param path: path to write dump to
+    :param posts: number of rows
+    :param vocabulary_size: number of distinct words of titles
+    :param title_length: average number of words in title
+    :param seed: seed of random generator, the same seed gives the same dump
+    :return: size of dump in bytes
+    """
+    sampler = ZipfSampler(vocabulary_size, seed)
+    rng = random.Random(seed + 1)
+    with open(path, "w", encoding="utf-8", buffering=DEFAULT_WRITE_BUFFER_SIZE) as fout:
+        for post_id in range(1, posts + 1):
+            year = rng.randint(FIRST_YEAR, LAST_YEAR)
+            score = int(rng.expovariate(0.1)) - 2
+            date = f"{year}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}T12:00:00.000"
+            if rng.random() < ANSWERS_SHARE:
+                fout.write(f'  <row Id="{post_id}" PostTypeId="2" CreationDate="{date}" Score="{score}" />\n')
+                continue
+            title = " ".join(sampler.sample(rng.randint(title_length // 2 + 1, title_length * 3 // 2 + 1)))
+            fout.write(
+                f'  <row Id="{post_id}" PostTypeId="1" CreationDate="{date}" Score="{score}" Title="{title}" />\n'
+            )
+    return os.path.getsize(path)
+
+def generate_stop_words(path, count=STOP_WORDS_COUNT):
+    """write the most frequent synthetic words as stop words"""
+    with open(path, "w", encoding="utf-8") as fout:
+        fout.write("\n".join(synthetic_word(rank) for rank in range(count)) + "\n")
+
+def generate_queries(path, count, top_n=DEFAULT_TOP_K, seed=DEFAULT_SEED):
+    """
+    write reproducible queries of random year intervals
+    :param path: path to write queries to
+    :param count: number of queries
+    :param top_n: number of words in answer
+    :param seed: seed of random generator
+    :return: list of start year, end year and top N of queries
+    """
+    rng = random.Random(seed + 2)
+    queries = []
+    for _ in range(count):
+        start_year = rng.randint(FIRST_YEAR, LAST_YEAR)
+        queries.append((start_year, rng.randint(start_year, LAST_YEAR), top_n))
+    with open(path, "w") as fout:
+        fout.write("".join(f"{start},{end},{n}\n" for start, end, n in queries))
+    return queries
+
+def benchmark_scale(report, workdir, posts, vocabulary_size, title_length, queries_count, seed, workers, top_n,
+                    capacity):
+    """
+    run every stage of benchmark for dump of one scale
+    :param report: class BenchmarkReport to add records to
+    :param workdir: directory for dump, queries and cache
+    :param posts: number of rows in dump
+    :param vocabulary_size: number of distinct words of titles
+    :param title_length: average number of words in title
+    :param queries_count: number of queries
+    :param seed: seed of dump and queries
+    :param workers: number of processes of parallel parsing, 1 skips it
+    :param top_n: number of words in answers to queries
+    :param capacity: number of words per year of approximate mode
+    :return: nothing
+    """
+    report.common.update(posts=posts)
+    dump_path = os.path.join(workdir, f"posts{posts}.xml")
+    stop_words_path = os.path.join(workdir, "stop_words.txt")
+    queries_path = os.path.join(workdir, "queries.csv")
+    cache_path = dump_path + ".cache"
+    start = time.perf_counter()
+    dump_size = generate_dump(dump_path, posts, vocabulary_size, title_length, seed)
+    seconds = time.perf_counter() - start
+    report.add("generate", seconds=seconds, bytes=dump_size, posts_per_second=posts / seconds)
+    generate_stop_words(stop_words_path)
+    queries = generate_queries(queries_path, queries_count, top_n, seed)
+    stop_words = get_stop_words(stop_words_path)
+
+    for stage, stage_workers in [("build", 1)] + ([("build_parallel", workers)] if workers > 1 else []):
+        post_table = PostTable()
+        start = time.perf_counter()
+        vocabulary, year_scores = build_aggregates(dump_path, stop_words, stage_workers, post_table)
+        seconds = time.perf_counter() - start
+        report.add(
+            stage, workers=stage_workers, seconds=seconds, posts_per_second=posts / seconds,
+            megabytes_per_second=dump_size / seconds / 2 ** 20, words=len(vocabulary.words),
+        )
+
+    start = time.perf_counter()
+    save_cache(vocabulary, year_scores, cache_path, source_state(dump_path, stop_words), post_table)
+    seconds = time.perf_counter() - start
+    report.add("save_cache", seconds=seconds, bytes=os.path.getsize(cache_path))
+    start = time.perf_counter()
+    _, vocabulary, year_scores, _ = load_cache(cache_path, stop_words)
+    report.add("load_cache", seconds=time.perf_counter() - start)
+
+    report.add("query", **time_queries(
+        lambda query: top_for_query(
+            score_for_interval(year_scores, query[0], query[1]), query[2], query[0], query[1], vocabulary,
+        ),
+        queries,
+    ))
+    start = time.perf_counter()
+    process_queries(dump_path, stop_words_path, queries_path, path_cache=cache_path, path_output=os.devnull)
+    seconds = time.perf_counter() - start
+    report.add("process_queries", queries=queries_count, seconds=seconds, queries_per_second=queries_count / seconds)
+
+    start = time.perf_counter()
+    year_sketches = build_year_sketches(dump_path, stop_words, capacity, workers)
+    seconds = time.perf_counter() - start
+    report.add(
+        "build_approximate", capacity=capacity, workers=workers, seconds=seconds, posts_per_second=posts / seconds,
+    )
+    report.add("query_approximate", capacity=capacity, **time_queries(
+        lambda query: top_for_sketch(
+            sketch_for_interval(year_sketches, query[0], query[1], capacity), query[2], query[0], query[1],
+        )[0],
+        queries,
+    ))
+
+def run_benchmark(scales, vocabulary_size=DEFAULT_VOCABULARY_SIZE, title_length=DEFAULT_TITLE_LENGTH,
+                  queries_count=DEFAULT_QUERIES, seed=DEFAULT_SEED, workers=1, top_n=DEFAULT_TOP_K,
+                  capacity=DEFAULT_CAPACITY, workdir=None, writer=None):
+    """
+    benchmark parsing, cache and queries of analytics on synthetic dumps
+    :param scales: numbers of rows of dumps
+    :param vocabulary_size: number of distinct words of titles
+    :param title_length: average number of words in title
+    :param queries_count: number of queries
+    :param seed: seed of dumps and queries
+    :param workers: number of processes of parallel parsing, 1 skips it
+    :param top_n: number of words in answers to queries
+    :param capacity: number of words per year of approximate mode
+    :param workdir: directory for dumps and caches, temporary directory by default
+    :param writer: class ResultWriter to write records as soon as they are ready
+    :return: list of records of stages
+    """
+    report = BenchmarkReport(
+        BENCHMARK_NAME, writer, seed=seed, vocabulary_size=vocabulary_size, title_length=title_length,
+        python=platform.python_version(), platform=platform.platform(),
+    )
+    with TemporaryDirectory(dir=workdir) as tmpdir:
+        for posts in scales:
+            benchmark_scale(
+                report, tmpdir, posts, vocabulary_size, title_length, queries_count, seed, workers, top_n, capacity,
+            )
+    return report.records
+
+def main():
+    """
+    benchmark of stackoverflow analytics, writes json line for every stage
+    :return:
+    """
+    parser = benchmark_argument_parser(
+        "stackoverflow-analytics-benchmark", "reproducible benchmark of stackoverflow analytics on synthetic dumps",
+        "posts", DEFAULT_VOCABULARY_SIZE, DEFAULT_TITLE_LENGTH,
+    )
+    parser.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY, help="words per year of approximate mode")
+    arguments = parser.parse_args()
+    with ResultWriter(arguments.output, "ndjson") as writer:
+        run_benchmark(
+            arguments.scales, arguments.vocabulary_size, arguments.length, arguments.queries,
+            arguments.seed, arguments.workers, arguments.top_k, arguments.capacity, arguments.workdir, writer,
+        )
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,13 @@
 #!/usr/bin/env python3
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import heapq
+import os
+import struct
+import sys
 import logging
 import yaml
 import logging.config
@@ -7,9 +15,32 @@ import lxml
 import lxml.etree
 import re
 import json
+from operator import itemgetter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from result_writer import ResultWriter, DEFAULT_WRITE_BUFFER_SIZE
 
 DEFAULT_LOGGING_CONFIG_FILEPATH = "logging.conf.yml"
 APPLICATION_NAME = "stackoverflow_analytics"
+WORD_PATTERN = re.compile(r"\w+")
+ROWS_ROOT_START = b"<rows>"
+ROWS_ROOT_END = b"</rows>"
+ROW_START = b"<row"
+# <row followed by whitespace, / or >, so the <rows> root is not taken for a row
+ROW_START_PATTERN = re.compile(rb"<row[\s/>]")
+DEFAULT_WORKERS = 1
+RANGES_PER_WORKER = 4
+SEARCH_BLOCK_SIZE = 1 << 16
+CACHE_MAGIC = b"SOAC"
+CACHE_VERSION = 2
+POST_TABLE_TYPECODES = ("q", "H", "q", "Q", "H", "I")
+HEAP_REBUILD_FACTOR = 4
+CACHE_HEADER_FORMAT = "<4sHI"
+CACHE_COUNT_FORMAT = "<Q"
+CACHE_SUFFIX = ".cache"
+DEFAULT_STOP_WORDS_ENCODING = "koi8-r"
+OUTPUT_FORMATS = ("ndjson", "binary")
+DEFAULT_OUTPUT_FORMAT = "ndjson"
 
 logger = logging.getLogger(APPLICATION_NAME)
 
@@ -25,95 +56,950 @@ def get_xml(path_to_xml):
             xml.append(i)
     return xml
 
-def get_stop_words(path_to_stop_words):
+class RowsStream:
     """
-    return list of stopword from file
-    :param path_to_stop_words: path to file
-    :return: list of words
+    file-like wrapper which adds root element around dump of bare
+    <row /> lines, so it can be parsed as one xml document
     """
-    stop_words = []
-    with open(path_to_stop_words, encoding='koi8-r') as fin:
-        for word in fin:
-            stop_words.append(word.rstrip())
-    return stop_words
+    def __init__(self, fin, limit=None):
+        self._parts = [ROWS_ROOT_START]
+        self._fin = fin
+        self._remaining = limit
+        self._tail = [ROWS_ROOT_END]
 
-def build_score_for_interval(xml, start_year, end_year, stop_words):
+    def read(self, size=-1):
+        if self._parts:
+            return self._parts.pop()
+        if self._remaining is not None:
+            size = self._remaining if size < 0 else min(size, self._remaining)
+        data = self._fin.read(size)
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        if data or not self._tail:
+            return data
+        return self._tail.pop()
+
+def has_root_element(fin):
     """
-    build score for words in titles
+    check if dump has root element around rows
+    :param fin: binary file
+    :return: False for dump of bare rows
+    """
+    position = fin.tell()
+    fin.seek(0)
+    head = fin.read(64).lstrip()
+    fin.seek(position)
+    return not ROW_START_PATTERN.match(head)
+
+def iter_posts(path_to_xml, start=0, end=None):
+    """
+    stream questions from posts dump, parsed rows are cleared at once
+    :param path_to_xml: path to xml file with or without root element
+    :param start: offset of first row of byte range, made by split_dump
+    :param end: offset after last row of byte range, whole dump by default
+    :return: generator of id, year, score and title of questions
+    """
+    with open(path_to_xml, "rb") as fin:
+        if end is not None:
+            fin.seek(start)
+            source = RowsStream(fin, end - start)
+        elif has_root_element(fin):
+            source = fin
+        else:
+            source = RowsStream(fin)
+        for _, row in lxml.etree.iterparse(source, tag="row", huge_tree=True):
+            type_id = row.get('PostTypeId')
+            if type_id == '1':
+                yield post_id(row), int(row.get('CreationDate')[:4]), int(row.get('Score')), row.get('Title')
+            row.clear()
+            while row.getprevious() is not None:
+                del row.getparent()[0]
+
+def post_id(row):
+    """id of post, None if row has no Id"""
+    value = row.get('Id')
+    return int(value) if value is not None else None
+
+def find_row_start(fin, offset, end):
+    """
+    find first row starting at or after offset
+    :param fin: binary file
+    :param offset: offset to search from
+    :param end: offset to search before
+    :return: offset of row start, end if there is no row
+    """
+    fin.seek(offset)
+    overlap = b""
+    while offset < end:
+        block = overlap + fin.read(min(SEARCH_BLOCK_SIZE, end - offset))
+        match = ROW_START_PATTERN.search(block)
+        if match:
+            return offset - len(overlap) + match.start()
+        if len(block) == len(overlap):
+            break
+        offset += len(block) - len(overlap)
+        overlap = block[-len(ROW_START):]
+    return end
+
+def rows_end(fin, size):
+    """
+    offset after last row, new rows of growing dump are written there
+    :param fin: binary file
+    :param size: size of file
+    :return: offset of closing tag of root element or size of dump of bare rows
+    """
+    if not has_root_element(fin):
+        return size
+    tail_start = max(size - SEARCH_BLOCK_SIZE, 0)
+    fin.seek(tail_start)
+    return tail_start + fin.read().rfind(b"</")
+
+def split_dump(path_to_xml, parts):
+    """
+    split dump into byte ranges on row boundaries
+    :param path_to_xml: path to xml file with or without root element
+    :param parts: desired number of ranges
+    :return: list of start and end offsets of non-empty ranges
+    """
+    size = os.path.getsize(path_to_xml)
+    with open(path_to_xml, "rb") as fin:
+        end = rows_end(fin, size)
+        starts = [find_row_start(fin, 0, end)]
+        for number in range(1, parts):
+            starts.append(max(find_row_start(fin, size * number // parts, end), starts[-1]))
+    starts.append(end)
+    return [(start, stop) for start, stop in zip(starts, starts[1:]) if start < stop]
+
+def aggregate_range(path_to_xml, start, end, stop_words, track_posts=False):
+    """
+    worker of parallel ingestion, aggregate byte range of dump
+    :param path_to_xml: path to xml file
+    :param start: offset of first row
+    :param end: offset after last row
+    :param stop_words: set of stop words
+    :param track_posts: collect class PostTable of range
+    :return: words of partial vocabulary, dict of year to dict of word id score and PostTable or None
+    """
+    vocabulary = Vocabulary(stop_words)
+    post_table = PostTable() if track_posts else None
+    try:
+        year_scores = aggregate_posts(iter_posts(path_to_xml, start, end), vocabulary, post_table)
+    except lxml.etree.XMLSyntaxError as error:
+        raise range_error(path_to_xml, start, end, error) from None
+    return vocabulary.words, year_scores, post_table
+
+def range_error(path_to_xml, start, end, error):
+    """
+    error of worker which can be sent back to parent process, errors of lxml cannot be pickled
+    :param path_to_xml: path to xml file
+    :param start: offset of first row
+    :param end: offset after last row
+    :param error: lxml.etree.XMLSyntaxError
+    :return: ValueError
+    """
+    return ValueError(f"cannot parse bytes {start}-{end} of {path_to_xml}: {error}")
+
+def merge_year_scores(partials, vocabulary, post_table=None):
+    """
+    merge aggregates of dump parts, word ids of parts are mapped into vocabulary
+    :param partials: iterable of words of partial vocabulary, its dict of year to dict of score
+        and its PostTable or None
+    :param vocabulary: class Vocabulary to merge into
+    :param post_table: class PostTable to merge posts of parts into
+    :return: dict of year to dict of word id score
+    """
+    year_scores = {}
+    for words, partial, partial_table in partials:
+        remap = [vocabulary.add(word) for word in words]
+        if post_table is not None:
+            post_table.extend(partial_table, remap)
+        for year, partial_score in partial.items():
+            words_score = year_scores.setdefault(year, {})
+            for word_id, score in partial_score.items():
+                word_id = remap[word_id]
+                words_score[word_id] = words_score.get(word_id, 0) + score
+    return year_scores
+
+def build_year_scores_parallel(path_to_xml, stop_words, workers, post_table=None):
+    """
+    aggregate byte ranges of dump in process pool and merge partial aggregates
+    :param path_to_xml: path to xml file
+    :param stop_words: set of stop words
+    :param workers: number of processes
+    :param post_table: class PostTable to collect posts into
+    :return: class Vocabulary and dict of year to dict of word id score
+    """
+    ranges = split_dump(path_to_xml, workers * RANGES_PER_WORKER)
+    logger.info("aggregate %s byte ranges of %s with %s workers", len(ranges), path_to_xml, workers)
+    vocabulary = Vocabulary(stop_words)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        partials = [
+            executor.submit(aggregate_range, path_to_xml, start, end, vocabulary.stop_words, post_table is not None)
+            for start, end in ranges
+        ]
+        return vocabulary, merge_year_scores((partial.result() for partial in partials), vocabulary, post_table)
+
+def iter_xml_posts(xml):
+    """
+    parse questions from xml list
+    :param xml: xml list
+    :return: generator of id, year, score and title of questions
+    """
+    parser = lxml.etree.XMLParser()
+    for x in xml:
+        soup = lxml.etree.fromstring(x, parser=parser)
+        if soup.get('PostTypeId') == '1':
+            yield post_id(soup), int(soup.get('CreationDate')[:4]), int(soup.get('Score')), soup.get('Title')
+
+def get_stop_words(path_to_stop_words, encoding=DEFAULT_STOP_WORDS_ENCODING):
+    """
+    return set of lowercase stopwords from file
+    :param path_to_stop_words: path to file, None for no stop words
+    :param encoding: encoding of file
+    :return: frozenset of words
+    """
+    if path_to_stop_words is None:
+        return frozenset()
+    with open(path_to_stop_words, encoding=encoding) as fin:
+        return frozenset(word.strip().lower() for word in fin if word.strip())
+
+class PostTable:
+    """
+    compact table of aggregated questions: id, year, score and title word ids,
+    it is needed to take back old score of post when its new version is ingested;
+    rows are sorted by id while ids come in increasing order, otherwise dict index is used;
+    year_counts is number of posts with every word per year, it is counted on the
+    first replaced post and then kept up to date by aggregate_posts and cache
+    """
+    def __init__(self):
+        self.ids = array("q")
+        self.years = array("H")
+        self.scores = array("q")
+        self.starts = array("Q")
+        self.counts = array("H")
+        self.words = array("I")
+        self.year_counts = None
+        self._index = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def find(self, post_id):
+        """
+        row of post
+        :param post_id: id of post
+        :return: row number, -1 for unknown post
+        """
+        if self._index is not None:
+            return self._index.get(post_id, -1)
+        row = bisect_left(self.ids, post_id)
+        if row < len(self.ids) and self.ids[row] == post_id:
+            return row
+        return -1
+
+    def row(self, row):
+        start = self.starts[row]
+        return self.years[row], self.scores[row], self.words[start:start + self.counts[row]]
+
+    def append(self, post_id, year, score, word_ids):
+        if self._index is None and self.ids and post_id < self.ids[-1]:
+            self._index = {known_id: row for row, known_id in enumerate(self.ids)}
+        if self._index is not None:
+            self._index[post_id] = len(self.ids)
+        self.ids.append(post_id)
+        self.years.append(year)
+        self.scores.append(score)
+        self.starts.append(len(self.words))
+        self.counts.append(len(word_ids))
+        self.words.extend(word_ids)
+
+    def update(self, row, year, score, word_ids):
+        self.years[row] = year
+        self.scores[row] = score
+        if sorted(self.row(row)[2]) != sorted(word_ids):
+            self.starts[row] = len(self.words)
+            self.counts[row] = len(word_ids)
+            self.words.extend(word_ids)
+
+    def count_years(self):
+        """
+        number of posts with every word in titles of every year, scans all rows
+        :return: dict of year to dict of word id to number of posts
+        """
+        year_counts = {}
+        for row in range(len(self.ids)):
+            year, _, word_ids = self.row(row)
+            counts = year_counts.setdefault(year, {})
+            for word_id in word_ids:
+                counts[word_id] = counts.get(word_id, 0) + 1
+        return year_counts
+
+    def extend(self, other, remap):
+        """
+        append rows of table with other vocabulary
+        :param other: class PostTable
+        :param remap: list of ids in this vocabulary by ids of other one
+        :return: nothing
+        """
+        for row in range(len(other)):
+            year, score, word_ids = other.row(row)
+            self.append(other.ids[row], year, score, [remap[word_id] for word_id in word_ids])
+
+    def arrays(self):
+        """
+        arrays of table sorted by id with no stale word ids
+        :return: list of arrays
+        """
+        if self._index is None and len(self.words) == sum(self.counts):
+            return [self.ids, self.years, self.scores, self.starts, self.counts, self.words]
+        table = PostTable()
+        for row in sorted(range(len(self.ids)), key=self.ids.__getitem__):
+            year, score, word_ids = self.row(row)
+            table.append(self.ids[row], year, score, word_ids)
+        return table.arrays()
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        table = cls()
+        table.ids, table.years, table.scores, table.starts, table.counts, table.words = arrays
+        return table
+
+class Vocabulary:
+    """
+    maps title words to dense int ids once, stop words are kept in the
+    same dict, so every word is hashed once per occurrence
+    """
+    def __init__(self, stop_words=()):
+        self.stop_words = frozenset(stop_words)
+        self.words = []
+        self._ids = dict.fromkeys(self.stop_words)
+
+    def __len__(self):
+        return len(self.words)
+
+    def lookup(self, word):
+        """
+        id of word, new words get next id
+        :param word: lowercase word
+        :return: id of word, None for stop word
+        """
+        try:
+            return self._ids[word]
+        except KeyError:
+            return self.add(word)
+
+    def add(self, word):
+        """
+        id of word which is known not to be a stop word
+        :param word: lowercase word
+        :return: id of word
+        """
+        word_id = self._ids.get(word)
+        if word_id is None:
+            word_id = self._ids[word] = len(self.words)
+            self.words.append(sys.intern(word))
+        return word_id
+
+    def decode(self, score):
+        """
+        map word ids of score back to words
+        :param score: dict of word id to score
+        :return: dict of word to score
+        """
+        words = self.words
+        return {words[word_id]: word_score for word_id, word_score in score.items()}
+
+def aggregate_posts(posts, vocabulary, post_table=None, year_scores=None):
+    """
+    build score for words in titles of every year in one pass,
+    with post table the old score of already seen post is taken back first
+    and words left without posts are dropped, as if post had never been seen
+    :param posts: iterable of id, year, score and title of questions
+    :param vocabulary: class Vocabulary to map words to ids
+    :param post_table: class PostTable of aggregated posts, None not to track posts
+    :param year_scores: dict of year to dict of word id score to add posts to
+    :return: dict of year to dict of word id score
+    """
+    lookup = vocabulary.lookup
+    if year_scores is None:
+        year_scores = {}
+    year_counts = post_table.year_counts if post_table is not None else None
+    for post_id, year, score, title in posts:
+        word_ids = {lookup(word) for word in WORD_PATTERN.findall(title.lower())}
+        word_ids.discard(None)
+        if post_table is not None and post_id is not None:
+            row = post_table.find(post_id)
+            if row < 0:
+                post_table.append(post_id, year, score, word_ids)
+            else:
+                if year_counts is None:
+                    year_counts = post_table.year_counts = post_table.count_years()
+                old_year, old_score, old_word_ids = post_table.row(row)
+                old_words_score, old_counts = year_scores[old_year], year_counts[old_year]
+                for word_id in old_word_ids:
+                    old_counts[word_id] -= 1
+                    if old_counts[word_id]:
+                        old_words_score[word_id] -= old_score
+                    else:
+                        del old_counts[word_id], old_words_score[word_id]
+                if not old_counts:
+                    del year_counts[old_year], year_scores[old_year]
+                post_table.update(row, year, score, word_ids)
+        words_score = year_scores.setdefault(year, {})
+        for word_id in word_ids:
+            words_score[word_id] = words_score.get(word_id, 0) + score
+        if year_counts is not None:
+            counts = year_counts.setdefault(year, {})
+            for word_id in word_ids:
+                counts[word_id] = counts.get(word_id, 0) + 1
+    return year_scores
+
+def build_year_scores(xml, stop_words):
+    """
+    build score for words in titles of every year in one pass over xml
     :param xml: xml list
+    :param stop_words: set of stop words
+    :return: dict of year to dict of score
+    """
+    vocabulary = Vocabulary(stop_words)
+    year_scores = aggregate_posts(iter_xml_posts(xml), vocabulary)
+    return {year: vocabulary.decode(score) for year, score in year_scores.items()}
+
+def score_for_interval(year_scores, start_year, end_year):
+    """
+    merge year buckets of interval
+    :param year_scores: dict of year to dict of score
     :param start_year: begin year
     :param end_year: end year
-    :param stop_words: list of stop words
     :return: dict of score
     """
     words_score = {}
-    for x in xml:
-        soup = lxml.etree.fromstring(x, parser=lxml.etree.XMLParser())
-        type_id = soup.get('PostTypeId')
-        year = int(soup.get('CreationDate')[:4])
-        if (type_id == '1' and start_year <= year <= end_year):
-            score = int(soup.get('Score'))
-            title = set(re.findall("\w+", soup.get('Title').lower()))
-            for word in title:
-                if word not in stop_words:
-                    if words_score.get(word) == None:
-                        words_score[word] = score
-                    else:
-                        words_score[word] += score
+    for year, year_score in year_scores.items():
+        if start_year <= year <= end_year:
+            for word, score in year_score.items():
+                words_score[word] = words_score.get(word, 0) + score
     return words_score
 
-def top_for_query(score, N, start, end):
+def build_score_for_interval(xml, start_year, end_year, stop_words):
+    """
+    build score for words in titles
+    :param xml: xml list
+    :param start_year: begin year
+    :param end_year: end year
+    :param stop_words: set of stop words
+    :return: dict of score
+    """
+    return score_for_interval(build_year_scores(xml, stop_words), start_year, end_year)
+
+def source_state(path_questions, stop_words):
+    """
+    state of inputs the aggregates depend on
+    :param path_questions: path to xml stackoverflow
+    :param stop_words: set of stop words
+    :return: dict of path, size, mtime and end of rows of dump and hash of stop words
+    """
+    stat = os.stat(path_questions)
+    with open(path_questions, "rb") as fin:
+        offset = rows_end(fin, stat.st_size)
+    stop_words_hash = hashlib.sha1("\n".join(sorted(set(stop_words))).encode("utf-8")).hexdigest()
+    return {
+        "path": os.path.abspath(path_questions), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+        "offset": offset, "stop_words": stop_words_hash,
+    }
+
+def _write_array(fout, values):
+    if sys.byteorder != "little":
+        values.byteswap()
+    fout.write(struct.pack(CACHE_COUNT_FORMAT, len(values)))
+    fout.write(values.tobytes())
+
+def _read_array(fin, typecode):
+    count, = struct.unpack(CACHE_COUNT_FORMAT, fin.read(struct.calcsize(CACHE_COUNT_FORMAT)))
+    values = array(typecode)
+    values.frombytes(fin.read(count * values.itemsize))
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+def save_cache(vocabulary, year_scores, path_cache, state, post_table=None):
+    """
+    save aggregates as vocabulary of words and arrays of word ids and scores per year
+    :param vocabulary: class Vocabulary of word ids
+    :param year_scores: dict of year to dict of word id score
+    :param path_cache: path to cache file
+    :param state: state of inputs made by source_state
+    :param post_table: class PostTable to save for ingest, with its year counts if they are counted
+    :return: nothing
+    """
+    years = sorted(year_scores)
+    year_counts = post_table.year_counts if post_table is not None else None
+    meta = json.dumps({
+        "source": state, "years": years, "posts": post_table is not None,
+        "count_years": sorted(year_counts) if year_counts is not None else None,
+    }).encode("utf-8")
+    with open(path_cache + ".tmp", "wb") as fout:
+        fout.write(struct.pack(CACHE_HEADER_FORMAT, CACHE_MAGIC, CACHE_VERSION, len(meta)))
+        fout.write(meta)
+        vocabulary_blob = "\n".join(vocabulary.words).encode("utf-8")
+        fout.write(struct.pack(CACHE_COUNT_FORMAT, len(vocabulary_blob)))
+        fout.write(vocabulary_blob)
+        for year in years:
+            words_score = year_scores[year]
+            _write_array(fout, array("I", words_score.keys()))
+            _write_array(fout, array("q", words_score.values()))
+        if post_table is not None:
+            for values in post_table.arrays():
+                _write_array(fout, array(values.typecode, values))
+        if year_counts is not None:
+            for year in sorted(year_counts):
+                _write_array(fout, array("I", year_counts[year].keys()))
+                _write_array(fout, array("I", year_counts[year].values()))
+    os.replace(path_cache + ".tmp", path_cache)
+    logger.info("save aggregates of %s years and %s words into cache %s", len(years), len(vocabulary), path_cache)
+
+def load_cache(path_cache, stop_words=()):
+    """
+    load aggregates saved by save_cache
+    :param path_cache: path to cache file
+    :param stop_words: set of stop words the cache was built with
+    :return: state of inputs, class Vocabulary, dict of year to dict of word id score
+        and class PostTable or None
+    """
+    with open(path_cache, "rb") as fin:
+        magic, version, meta_size = struct.unpack(
+            CACHE_HEADER_FORMAT, fin.read(struct.calcsize(CACHE_HEADER_FORMAT)))
+        if magic != CACHE_MAGIC or version != CACHE_VERSION:
+            raise ValueError(f"{path_cache} is not analytics cache of version {CACHE_VERSION}")
+        meta = json.loads(fin.read(meta_size).decode("utf-8"))
+        blob_size, = struct.unpack(CACHE_COUNT_FORMAT, fin.read(struct.calcsize(CACHE_COUNT_FORMAT)))
+        blob = fin.read(blob_size).decode("utf-8")
+        vocabulary = Vocabulary(stop_words)
+        for word in blob.split("\n") if blob else ():
+            vocabulary.add(word)
+        year_scores = {}
+        for year in meta["years"]:
+            word_ids = _read_array(fin, "I")
+            scores = _read_array(fin, "q")
+            year_scores[year] = dict(zip(word_ids, scores))
+        post_table = None
+        if meta["posts"]:
+            post_table = PostTable.from_arrays([_read_array(fin, typecode) for typecode in POST_TABLE_TYPECODES])
+        if meta.get("count_years") is not None:
+            post_table.year_counts = {}
+            for year in meta["count_years"]:
+                word_ids = _read_array(fin, "I")
+                post_table.year_counts[year] = dict(zip(word_ids, _read_array(fin, "I")))
+    return meta["source"], vocabulary, year_scores, post_table
+
+def build_aggregates(path_questions, stop_words, workers=DEFAULT_WORKERS, post_table=None):
+    """
+    parse dump into per-year aggregates
+    :param path_questions: path to xml stackoverflow
+    :param stop_words: set of stop words
+    :param workers: number of processes to parse xml with
+    :param post_table: class PostTable to collect posts into
+    :return: class Vocabulary and dict of year to dict of word id score
+    """
+    if workers > 1:
+        return build_year_scores_parallel(path_questions, stop_words, workers, post_table)
+    vocabulary = Vocabulary(stop_words)
+    return vocabulary, aggregate_posts(iter_posts(path_questions), vocabulary, post_table)
+
+def load_aggregates(path_questions, stop_words, workers=DEFAULT_WORKERS, path_cache=None):
+    """
+    load aggregates from cache if it is up to date with dump and stop words,
+    otherwise parse dump and refresh cache
+    :param path_questions: path to xml stackoverflow
+    :param stop_words: set of stop words
+    :param workers: number of processes to parse xml with
+    :param path_cache: path to cache file, None to parse dump every time
+    :return: class Vocabulary and dict of year to dict of word id score
+    """
+    if path_cache is None:
+        return build_aggregates(path_questions, stop_words, workers)
+    state = source_state(path_questions, stop_words)
+    if os.path.exists(path_cache):
+        try:
+            cached_state, vocabulary, year_scores, _ = load_cache(path_cache, stop_words)
+        except (ValueError, struct.error) as error:
+            logger.warning("cannot read cache %s: %s", path_cache, error)
+        else:
+            if cached_state == state:
+                logger.info("load aggregates from cache %s", path_cache)
+                return vocabulary, year_scores
+            logger.warning("cache %s is outdated, rebuild it", path_cache)
+    post_table = PostTable()
+    vocabulary, year_scores = build_aggregates(path_questions, stop_words, workers, post_table)
+    save_cache(vocabulary, year_scores, path_cache, state, post_table)
+    return vocabulary, year_scores
+
+def ingest_aggregates(path_questions, stop_words, path_cache):
+    """
+    merge new posts into cached aggregates: only bytes past the recorded end of
+    rows are read for the cached dump itself, any other file is read as delta;
+    posts with known ids replace their old versions
+    :param path_questions: path to grown dump or to delta xml
+    :param stop_words: set of stop words the cache was built with
+    :param path_cache: path to cache file made by build-cache
+    :return: number of new questions
+    """
+    cached_state, vocabulary, year_scores, post_table = load_cache(path_cache, stop_words)
+    if post_table is None:
+        raise ValueError(f"cache {path_cache} has no posts table, rebuild it with build-cache")
+    state = source_state(path_questions, stop_words)
+    if state["stop_words"] != cached_state["stop_words"]:
+        raise ValueError(f"cache {path_cache} was built with other stop words")
+    if state["path"] == cached_state["path"]:
+        if state["offset"] < cached_state["offset"]:
+            raise ValueError(f"{path_questions} was rewritten, rebuild cache with build-cache")
+        posts = iter_posts(path_questions, cached_state["offset"], state["offset"])
+        cached_state = state
+    else:
+        posts = iter_posts(path_questions)
+    known_posts = len(post_table)
+    aggregate_posts(posts, vocabulary, post_table, year_scores)
+    new_posts = len(post_table) - known_posts
+    logger.info("ingest questions from %s into cache %s, %s of them are new", path_questions, path_cache, new_posts)
+    save_cache(vocabulary, year_scores, path_cache, cached_state, post_table)
+    return new_posts
+
+class SpaceSaving:
+    """
+    Space-Saving summary of heavy hitters with at most capacity words:
+    estimate of word score is never below its true score and is above it
+    by at most its error; summaries of years and workers are mergeable.
+    Scores are exact until summary is full, after that negative score of
+    word which is not monitored is dropped instead of evicting another word
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def floor(self):
+        """
+        max score of word which is not monitored
+        :return: min monitored score for full summary, 0 otherwise
+        """
+        if len(self.counts) < self.capacity:
+            return 0
+        heap = self._heap
+        while True:
+            count, word = heap[0]
+            current = self.counts.get(word)
+            if current == count:
+                return count
+            if current is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (current, word))
+
+    def _push(self, word, count):
+        heap = self._heap
+        if len(heap) > HEAP_REBUILD_FACTOR * self.capacity:
+            heap[:] = [(word_count, known_word) for known_word, word_count in self.counts.items()]
+            heapq.heapify(heap)
+        heapq.heappush(heap, (count, word))
+
+    def update(self, word, score):
+        """
+        add score of word
+        :param word: word
+        :param score: score to add
+        :return: nothing
+        """
+        count = self.counts.get(word)
+        if count is not None:
+            count = self.counts[word] = count + score
+            if score < 0:
+                self._push(word, count)
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[word] = score
+            self.errors[word] = 0
+            self._push(word, score)
+            return
+        if score < 0:
+            return
+        error = self.floor()
+        victim = heapq.heappop(self._heap)[1]
+        del self.counts[victim]
+        del self.errors[victim]
+        self.counts[word] = error + score
+        self.errors[word] = error
+        self._push(word, error + score)
+
+    @classmethod
+    def merge(cls, summaries, capacity):
+        """
+        merge summaries, word missing in a full summary gets its floor as score and error
+        :param summaries: iterable of class SpaceSaving
+        :param capacity: capacity of merged summary
+        :return: class SpaceSaving
+        """
+        summaries = list(summaries)
+        floors = [summary.floor() for summary in summaries]
+        counts = {}
+        errors = {}
+        for summary in summaries:
+            for word in summary.counts:
+                if word not in counts:
+                    counts[word] = errors[word] = 0
+                    for other, floor in zip(summaries, floors):
+                        counts[word] += other.counts.get(word, floor)
+                        errors[word] += other.errors.get(word, floor)
+        merged = cls(capacity)
+        for word, count in heapq.nlargest(capacity, counts.items(), key=itemgetter(1)):
+            merged.counts[word] = count
+            merged.errors[word] = errors[word]
+        merged._heap = [(count, word) for word, count in merged.counts.items()]
+        heapq.heapify(merged._heap)
+        return merged
+
+def aggregate_posts_approximate(posts, stop_words, capacity, year_sketches=None):
+    """
+    build Space-Saving summary of words in titles of every year in one pass
+    :param posts: iterable of id, year, score and title of questions
+    :param stop_words: set of stop words
+    :param capacity: number of words kept per year
+    :param year_sketches: dict of year to class SpaceSaving to add posts to
+    :return: dict of year to class SpaceSaving
+    """
+    if year_sketches is None:
+        year_sketches = {}
+    for _, year, score, title in posts:
+        sketch = year_sketches.get(year)
+        if sketch is None:
+            sketch = year_sketches[year] = SpaceSaving(capacity)
+        for word in set(WORD_PATTERN.findall(title.lower())):
+            if word not in stop_words:
+                sketch.update(word, score)
+    return year_sketches
+
+def aggregate_range_approximate(path_to_xml, start, end, stop_words, capacity):
+    """
+    worker of parallel approximate ingestion, summarize byte range of dump
+    :param path_to_xml: path to xml file
+    :param start: offset of first row
+    :param end: offset after last row
+    :param stop_words: set of stop words
+    :param capacity: number of words kept per year
+    :return: dict of year to class SpaceSaving
+    """
+    try:
+        return aggregate_posts_approximate(iter_posts(path_to_xml, start, end), stop_words, capacity)
+    except lxml.etree.XMLSyntaxError as error:
+        raise range_error(path_to_xml, start, end, error) from None
+
+def merge_year_sketches(partials, capacity):
+    """
+    merge summaries of the same years
+    :param partials: iterable of dicts of year to class SpaceSaving
+    :param capacity: number of words kept per year
+    :return: dict of year to class SpaceSaving
+    """
+    by_year = {}
+    for partial in partials:
+        for year, sketch in partial.items():
+            by_year.setdefault(year, []).append(sketch)
+    return {
+        year: sketches[0] if len(sketches) == 1 else SpaceSaving.merge(sketches, capacity)
+        for year, sketches in by_year.items()
+    }
+
+def build_year_sketches(path_questions, stop_words, capacity, workers=DEFAULT_WORKERS):
+    """
+    summarize dump into per-year Space-Saving summaries with bounded memory
+    :param path_questions: path to xml stackoverflow
+    :param stop_words: set of stop words
+    :param capacity: number of words kept per year
+    :param workers: number of processes to parse xml with
+    :return: dict of year to class SpaceSaving
+    """
+    if workers <= 1:
+        return aggregate_posts_approximate(iter_posts(path_questions), stop_words, capacity)
+    ranges = split_dump(path_questions, workers * RANGES_PER_WORKER)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        partials = [
+            executor.submit(aggregate_range_approximate, path_questions, start, end, stop_words, capacity)
+            for start, end in ranges
+        ]
+        return merge_year_sketches((partial.result() for partial in partials), capacity)
+
+def sketch_for_interval(year_sketches, start_year, end_year, capacity):
+    """
+    merge summaries of years of interval
+    :param year_sketches: dict of year to class SpaceSaving
+    :param start_year: begin year
+    :param end_year: end year
+    :param capacity: number of words kept
+    :return: class SpaceSaving
+    """
+    return SpaceSaving.merge(
+        (sketch for year, sketch in year_sketches.items() if start_year <= year <= end_year), capacity,
+    )
+
+def top_for_sketch(sketch, N, start, end):
     """
-    return top N words
-    :param score: dict word with score
+    return top N words of summary by estimated score desc and word asc
+    :param sketch: class SpaceSaving
     :param N: top count
     :param start: begin year
     :param end: end year
+    :return: list of top words and list of their max overestimations
+    """
+    top = top_for_query(sketch.counts, N, start, end)
+    return top, [sketch.errors[word] for word, _ in top]
+
+def top_key(item):
+    return -item[1], item[0]
+
+def top_for_query(score, N, start, end, vocabulary=None):
+    """
+    return top N words by score desc and word asc in O(V log N)
+    :param score: dict word with score or dict word id with score
+    :param N: top count
+    :param start: begin year
+    :param end: end year
+    :param vocabulary: class Vocabulary for score by word ids
     :return: list of top words
     """
-    score_list = []
-    for key in score:
-        score_list.append([key, score[key]])
-    sorted_score_list = sorted(score_list, key=lambda score_list: score_list[0])
-    sorted_score_list = sorted(sorted_score_list,
-                               key=lambda sorted_score_list: sorted_score_list[1], reverse=True)
-    if len(score_list) >= N:
-        return sorted_score_list[:N]
+    if vocabulary is None:
+        top = [[word, word_score] for word, word_score in heapq.nsmallest(N, score.items(), key=top_key)]
     else:
+        words = vocabulary.words
+        top = [
+            [words[word_id], word_score]
+            for word_id, word_score in heapq.nsmallest(
+                N, score.items(), key=lambda item: (-item[1], words[item[0]]))
+        ]
+    if len(score) < N:
         logger.warning("not enough data to answer, found %s words out of %s for period \"%s,%s\"",
-                       len(score_list), N, start, end)
-        return sorted_score_list
+                       len(score), N, start, end)
+    return top
 
-def print_answer(start, end, top):
-    """print answer"""
-    jsonline = json.dumps({"start": int(start), "end": int(end), "top": top}, ensure_ascii=False)
+def print_answer(start, end, top, errors=None, writer=None):
+    """print answer or pass it to ResultWriter, errors of approximate answer follow top"""
+    answer = {"start": int(start), "end": int(end), "top": top}
+    if errors is not None:
+        answer["errors"] = errors
+    if writer is not None:
+        return writer.write(answer)
+    jsonline = json.dumps(answer, ensure_ascii=False)
     print(jsonline)
 
 def callback_queries(arguments):
     """callback for argparse"""
-    return process_queries(arguments.questions, arguments.stop_words, arguments.queries)
+    if arguments.command == "build-cache":
+        path_cache = arguments.cache or arguments.questions + CACHE_SUFFIX
+        return process_build_cache(
+            arguments.questions, arguments.stop_words, path_cache, arguments.workers,
+            arguments.stop_words_encoding,
+        )
+    if arguments.command == "ingest":
+        if arguments.cache is None:
+            raise ValueError("ingest needs --cache made by build-cache")
+        return process_ingest(arguments.questions, arguments.stop_words, arguments.cache, arguments.stop_words_encoding)
+    return process_queries(
+        arguments.questions, arguments.stop_words, arguments.queries, arguments.workers, arguments.cache,
+        arguments.stop_words_encoding, arguments.approximate, arguments.output, arguments.output_format,
+    )
+
+def process_build_cache(path_questions, path_stop_words, path_cache, workers=DEFAULT_WORKERS,
+                        stop_words_encoding=DEFAULT_STOP_WORDS_ENCODING):
+    """
+    parse dump and save its aggregates into cache
+    :param path_questions: path to xml stackoverflow
+    :param path_stop_words: path to file with stopwords
+    :param path_cache: path to cache file
+    :param workers: number of processes to parse xml with
+    :param stop_words_encoding: encoding of file with stopwords
+    :return: nothing
+    """
+    stop_words = get_stop_words(path_stop_words, stop_words_encoding)
+    state = source_state(path_questions, stop_words)
+    post_table = PostTable()
+    vocabulary, year_scores = build_aggregates(path_questions, stop_words, workers, post_table)
+    save_cache(vocabulary, year_scores, path_cache, state, post_table)
 
-def process_queries(path_questions, path_stop_words, path_queries):
+def process_ingest(path_questions, path_stop_words, path_cache, stop_words_encoding=DEFAULT_STOP_WORDS_ENCODING):
+    """
+    merge delta of posts into cache
+    :param path_questions: path to grown dump or to delta xml
+    :param path_stop_words: path to file with stopwords
+    :param path_cache: path to cache file
+    :param stop_words_encoding: encoding of file with stopwords
+    :return: nothing
+    """
+    stop_words = get_stop_words(path_stop_words, stop_words_encoding)
+    ingest_aggregates(path_questions, stop_words, path_cache)
+
+def process_queries(path_questions, path_stop_words, path_queries, workers=DEFAULT_WORKERS, path_cache=None,
+                    stop_words_encoding=DEFAULT_STOP_WORDS_ENCODING, approximate_capacity=None,
+                    path_output=None, output_format=DEFAULT_OUTPUT_FORMAT):
     """
     answer for queries from file
     :param path_questions: path to xml stackoverflow
     :param path_stop_words: path to file with stopwords
     :param path_queries: path to file with queries
+    :param workers: number of processes to parse xml with
+    :param path_cache: path to cache of aggregates, rebuilt when outdated
+    :param stop_words_encoding: encoding of file with stopwords
+    :param approximate_capacity: number of words kept per year in approximate mode, None for exact answers
+    :param path_output: path to write answers to, stdout by default
+    :param output_format: one of OUTPUT_FORMATS, see ResultWriter
     :return: nothing
     """
-    xml = get_xml(path_questions)
+    stop_words = get_stop_words(path_stop_words, stop_words_encoding)
+    if approximate_capacity is not None:
+        return process_queries_approximate(
+            path_questions, stop_words, path_queries, workers, approximate_capacity, path_output, output_format,
+        )
+    vocabulary, year_scores = load_aggregates(path_questions, stop_words, workers, path_cache)
     logger.info("process XML dataset, ready to serve queries")
-    stop_words = get_stop_words(path_stop_words)
-    with open(path_queries) as fin:
+    with open(path_queries) as fin, ResultWriter(path_output, output_format) as writer:
+        for query in fin:
+            logger.debug("got query \"%s\"", query.strip())
+            start_year, end_year, top_N = query.split(',')
+            score = score_for_interval(year_scores, int(start_year), int(end_year))
+            top = top_for_query(score, int(top_N), int(start_year), int(end_year), vocabulary)
+            print_answer(start_year, end_year, top, writer=writer)
+        logger.info("finish processing queries")
+
+def process_queries_approximate(path_questions, stop_words, path_queries, workers, capacity,
+                                path_output=None, output_format=DEFAULT_OUTPUT_FORMAT):
+    """
+    answer for queries from file with Space-Saving summaries of bounded size,
+    every answer has max overestimation of every returned score
+    :param path_questions: path to xml stackoverflow
+    :param stop_words: set of stop words
+    :param path_queries: path to file with queries
+    :param workers: number of processes to parse xml with
+    :param capacity: number of words kept per year
+    :param path_output: path to write answers to, stdout by default
+    :param output_format: one of OUTPUT_FORMATS, see ResultWriter
+    :return: nothing
+    """
+    year_sketches = build_year_sketches(path_questions, stop_words, capacity, workers)
+    logger.info("summarize XML dataset with %s words per year, ready to serve queries", capacity)
+    with open(path_queries) as fin, ResultWriter(path_output, output_format) as writer:
         for query in fin:
             logger.debug("got query \"%s\"", query.strip())
             start_year, end_year, top_N = query.split(',')
-            score = build_score_for_interval(xml, int(start_year), int(end_year), stop_words)
-            top = top_for_query(score, int(top_N), int(start_year), int(end_year))
-            print_answer(start_year, end_year, top)
+            sketch = sketch_for_interval(year_sketches, int(start_year), int(end_year), capacity)
+            top, errors = top_for_sketch(sketch, int(top_N), int(start_year), int(end_year))
+            print_answer(start_year, end_year, top, errors, writer)
         logger.info("finish processing queries")
 
 def setup_parser(parser):
+    parser.add_argument(
+        "command", nargs="?", choices=["query", "build-cache", "ingest"], default="query",
+        help="answer queries, only save aggregates into --cache or merge new posts of --questions into --cache"
+    )
     parser.add_argument(
         "--questions", required=True,
         help="path to stackoverflow questions .xml"
@@ -122,10 +1008,36 @@ def setup_parser(parser):
         "--stop-words",
         help="path to stop words .txt"
     )
+    parser.add_argument(
+        "--stop-words-encoding", default=DEFAULT_STOP_WORDS_ENCODING,
+        help="encoding of stop words file"
+    )
     parser.add_argument(
         "--queries",
         help="path to queries .csv"
     )
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_WORKERS,
+        help="number of processes to parse questions with"
+    )
+    parser.add_argument(
+        "--cache",
+        help="path to cache of preprocessed questions, checked against questions and stop words, "
+             "build-cache saves it next to questions by default"
+    )
+    parser.add_argument(
+        "--approximate", type=int, default=None, metavar="CAPACITY",
+        help="answer with Space-Saving summaries of CAPACITY words per year and report errors, "
+             "cache is not used"
+    )
+    parser.add_argument(
+        "--output", default=None,
+        help="path to write answers to instead of stdout"
+    )
+    parser.add_argument(
+        "--output-format", choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT,
+        help="json lines or binary records of json with big-endian uint32 length"
+    )
     parser.set_defaults(callback=callback_queries)
 
 def setup_logging():
@@ -1,7 +1,16 @@
+import json
+import random
+import struct
+
 import lxml.etree
 import pytest
 
-from task_Voloskov_Ivan_stackoverflow_analytics import get_xml, get_stop_words, build_score_for_interval, top_for_query, print_answer, process_queries
+from task_Voloskov_Ivan_stackoverflow_analytics import get_xml, get_stop_words, build_score_for_interval, top_for_query, print_answer, process_queries,\
+    build_year_scores, score_for_interval, iter_posts, aggregate_posts,\
+    split_dump, build_year_scores_parallel, merge_year_scores,\
+    save_cache, load_cache, load_aggregates, source_state, process_build_cache, build_aggregates, Vocabulary,\
+    ingest_aggregates, PostTable, SpaceSaving, ResultWriter
+from stackoverflow_analytics_benchmark import run_benchmark, generate_dump
 
 XML_PATH = "test_russian1.xml"
 STOP_WORDS_PATH = "stop_russian1.txt"
@@ -22,6 +31,246 @@ def test_can_build_score_for_interval():
     score = build_score_for_interval(xml, 2019, 2019, stop_words)
     assert score['дед'] == 15
 
+def test_can_build_year_scores():
+    year_scores = build_year_scores(get_xml(XML_PATH), get_stop_words(STOP_WORDS_PATH))
+    assert [2019, 2020] == sorted(year_scores)
+    assert 15 == year_scores[2019]['дед']
+    assert 20 == year_scores[2020]['кашу']
+    assert 30 == score_for_interval(year_scores, 2019, 2020)['кашу']
+    assert {} == score_for_interval(year_scores, 2021, 2022)
+
+@pytest.mark.parametrize(
+    "dump",
+    [
+        '<row PostTypeId="1" Title="Дед и баба" Score="5" CreationDate="2019" />\n'
+        '<row PostTypeId="2" Score="7" CreationDate="2019" />\n'
+        '<row PostTypeId="1"\n     Title="Кто ел кашу?" Score="20" CreationDate="2020-01-01T00:00:00" />\n',
+        '<?xml version="1.0" encoding="utf-8"?>\n<posts>\n'
+        '  <row PostTypeId="1" Title="Дед и баба" Score="5" CreationDate="2019" />\n'
+        '  <row PostTypeId="2" Score="7" CreationDate="2019" />\n'
+        '  <row PostTypeId="1"\n     Title="Кто ел кашу?" Score="20" CreationDate="2020-01-01T00:00:00" />\n'
+        '</posts>\n',
+    ],
+)
+def test_can_iterate_posts(tmpdir, dump):
+    dump_path = tmpdir.join("posts.xml")
+    dump_path.write_text(dump, encoding="utf-8")
+    assert [(None, 2019, 5, "Дед и баба"), (None, 2020, 20, "Кто ел кашу?")] == list(iter_posts(str(dump_path)))
+
+def decoded(vocabulary, year_scores):
+    return {year: vocabulary.decode(score) for year, score in year_scores.items()}
+
+def test_streamed_posts_give_the_same_scores():
+    stop_words = get_stop_words(STOP_WORDS_PATH)
+    etalon_year_scores = build_year_scores(get_xml(XML_PATH), stop_words)
+    vocabulary = Vocabulary(stop_words)
+    assert etalon_year_scores == decoded(vocabulary, aggregate_posts(iter_posts(XML_PATH), vocabulary))
+
+def test_vocabulary_maps_words_to_ids_once():
+    vocabulary = Vocabulary(["да", "и"])
+    assert [0, None, 1, 0] == [vocabulary.lookup(word) for word in ["дед", "да", "баба", "дед"]]
+    assert ["дед", "баба"] == vocabulary.words
+    assert {"баба": 3} == vocabulary.decode({1: 3})
+
+def test_can_get_stop_words_in_other_encoding(tmpdir):
+    stop_words_path = tmpdir.join("stop_words.txt")
+    stop_words_path.write_text("Да\n\nили \n", encoding="utf-8")
+    assert frozenset(["да", "или"]) == get_stop_words(str(stop_words_path), encoding="utf-8")
+
+SAMPLE_XML_PATH = "stackoverflow_posts_sample.xml"
+EN_STOP_WORDS_PATH = "stop_words_en.txt"
+
+@pytest.mark.parametrize("parts", [1, 3, 50])
+@pytest.mark.parametrize("root", [None, "posts", "rows"])
+def test_parallel_build_is_the_same_as_sequential(tmpdir, parts, root):
+    dump_path = SAMPLE_XML_PATH
+    if root is not None:
+        with open(SAMPLE_XML_PATH, "rb") as fin:
+            dump = fin.read()
+        dump_path = str(tmpdir.join("posts.xml"))
+        with open(dump_path, "wb") as fout:
+            fout.write(f'<?xml version="1.0" encoding="utf-8"?>\n<{root}>\n'.encode() + dump + f'</{root}>\n'.encode())
+    stop_words = get_stop_words(EN_STOP_WORDS_PATH)
+    ranges = split_dump(dump_path, parts)
+    assert len(ranges) <= parts
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+    etalon_year_scores = decoded(*build_aggregates(dump_path, stop_words))
+    assert etalon_year_scores == decoded(*build_year_scores_parallel(dump_path, stop_words, workers=2))
+    partials = []
+    for start, end in ranges:
+        vocabulary = Vocabulary(stop_words)
+        partials.append((vocabulary.words, aggregate_posts(iter_posts(dump_path, start, end), vocabulary), None))
+    vocabulary = Vocabulary(stop_words)
+    assert etalon_year_scores == decoded(vocabulary, merge_year_scores(partials, vocabulary))
+
+def test_parallel_build_reports_broken_dump(tmpdir):
+    dump_path = str(tmpdir.join("posts.xml"))
+    with open(SAMPLE_XML_PATH, "rb") as fin:
+        dump = fin.read()
+    with open(dump_path, "wb") as fout:
+        fout.write(dump + b'<row Id="1" Title="broken\n')
+    with pytest.raises(ValueError, match="cannot parse bytes"):
+        build_year_scores_parallel(dump_path, frozenset(), workers=2)
+
+def test_can_save_and_load_cache(tmpdir):
+    stop_words = get_stop_words(STOP_WORDS_PATH)
+    vocabulary, year_scores = build_aggregates(XML_PATH, stop_words)
+    cache_path = str(tmpdir.join("posts.cache"))
+    state = source_state(XML_PATH, stop_words)
+    save_cache(vocabulary, year_scores, cache_path, state)
+    loaded_state, loaded_vocabulary, loaded_year_scores, post_table = load_cache(cache_path, stop_words)
+    assert post_table is None
+    assert state == loaded_state
+    assert vocabulary.words == loaded_vocabulary.words
+    assert year_scores == loaded_year_scores
+
+def test_outdated_cache_is_rebuilt(tmpdir, caplog):
+    dump_path = tmpdir.join("posts.xml")
+    dump_path.write_text('<row PostTypeId="1" Title="Дед и баба" Score="5" CreationDate="2019" />\n', encoding="utf-8")
+    cache_path = str(tmpdir.join("posts.cache"))
+    stop_words = get_stop_words(STOP_WORDS_PATH)
+    process_build_cache(str(dump_path), STOP_WORDS_PATH, cache_path)
+    caplog.set_level("INFO")
+    assert {2019: {"дед": 5, "баба": 5}} == decoded(*load_aggregates(str(dump_path), stop_words, path_cache=cache_path))
+    assert "load aggregates from cache" in caplog.text
+    dump_path.write_text('<row PostTypeId="1" Title="Дед" Score="7" CreationDate="2020" />\n', encoding="utf-8")
+    assert {2020: {"дед": 7}} == decoded(*load_aggregates(str(dump_path), stop_words, path_cache=cache_path))
+    assert {2020: {"дед": 7}} == decoded(*load_cache(cache_path)[1:3])
+
+def write_rows(path, rows, mode="w"):
+    with open(path, mode, encoding="utf-8") as fout:
+        for post_id, year, score, title in rows:
+            fout.write(f'<row Id="{post_id}" PostTypeId="1" Title="{title}" Score="{score}" CreationDate="{year}" />\n')
+
+BASE_ROWS = [(1, 2019, 10, "Жили были дед да баба"), (2, 2019, 5, "Дед и баба родственники"), (3, 2020, 20, "Кто ел кашу")]
+DELTA_ROWS = [(2, 2019, 8, "Дед и баба родственники"), (3, 2020, 1, "Кто ел кашу с молоком"), (4, 2020, 3, "Баба ела кашу")]
+
+def test_can_ingest_delta_file(tmpdir):
+    dump_path, delta_path, cache_path = (str(tmpdir.join(name)) for name in ("posts.xml", "delta.xml", "posts.cache"))
+    write_rows(dump_path, BASE_ROWS)
+    write_rows(delta_path, DELTA_ROWS)
+    process_build_cache(dump_path, STOP_WORDS_PATH, cache_path, workers=2)
+    stop_words = get_stop_words(STOP_WORDS_PATH)
+    assert 1 == ingest_aggregates(delta_path, stop_words, cache_path)
+    write_rows(dump_path + ".full", [BASE_ROWS[0]] + DELTA_ROWS)
+    etalon_year_scores = decoded(*build_aggregates(dump_path + ".full", stop_words))
+    assert etalon_year_scores == decoded(*load_aggregates(dump_path, stop_words, path_cache=cache_path))
+
+@pytest.mark.parametrize(
+    "delta_rows",
+    [
+        [(1, 2019, 7, "alpha")],
+        [(1, 2020, 7, "alpha beta")],
+        [(1, 2019, 7, "alpha"), (4, 2019, 2, "beta")],
+    ],
+)
+def test_ingest_drops_words_left_without_posts(tmpdir, delta_rows):
+    dump_path, delta_path, cache_path = (str(tmpdir.join(name)) for name in ("posts.xml", "delta.xml", "posts.cache"))
+    base_rows = [(1, 2019, 7, "alpha beta"), (2, 2019, 3, "gamma")]
+    write_rows(dump_path, base_rows)
+    write_rows(delta_path, delta_rows)
+    process_build_cache(dump_path, STOP_WORDS_PATH, cache_path)
+    stop_words = get_stop_words(STOP_WORDS_PATH)
+    ingest_aggregates(delta_path, stop_words, cache_path)
+    final_rows = {row[0]: row for row in base_rows + delta_rows}
+    write_rows(dump_path + ".full", final_rows.values())
+    etalon_year_scores = decoded(*build_aggregates(dump_path + ".full", stop_words))
+    assert etalon_year_scores == decoded(*load_aggregates(dump_path, stop_words, path_cache=cache_path))
+
+def test_ingest_counts_posts_of_words_once_and_keeps_them_in_cache(tmpdir, monkeypatch):
+    dump_path, cache_path = str(tmpdir.join("posts.xml")), str(tmpdir.join("posts.cache"))
+    write_rows(dump_path, BASE_ROWS)
+    process_build_cache(dump_path, STOP_WORDS_PATH, cache_path)
+    stop_words = get_stop_words(STOP_WORDS_PATH)
+    count_years = PostTable.count_years
+    scans = []
+    monkeypatch.setattr(PostTable, "count_years", lambda table: scans.append(len(table)) or count_years(table))
+    for number, rows in enumerate([DELTA_ROWS[2:], DELTA_ROWS[:1], DELTA_ROWS[1:2]]):
+        delta_path = str(tmpdir.join(f"delta{number}.xml"))
+        write_rows(delta_path, rows)
+        ingest_aggregates(delta_path, stop_words, cache_path)
+    assert [4] == scans
+    write_rows(dump_path + ".full", [BASE_ROWS[0]] + DELTA_ROWS)
+    etalon_year_scores = decoded(*build_aggregates(dump_path + ".full", stop_words))
+    assert etalon_year_scores == decoded(*load_aggregates(dump_path, stop_words, path_cache=cache_path))
+    post_table = load_cache(cache_path, stop_words)[3]
+    assert count_years(post_table) == post_table.year_counts
+
+def test_can_ingest_appended_posts(tmpdir):
+    dump_path, cache_path = str(tmpdir.join("posts.xml")), str(tmpdir.join("posts.cache"))
+    write_rows(dump_path, BASE_ROWS)
+    process_build_cache(dump_path, STOP_WORDS_PATH, cache_path)
+    write_rows(dump_path, DELTA_ROWS[2:], mode="a")
+    stop_words = get_stop_words(STOP_WORDS_PATH)
+    assert 1 == ingest_aggregates(dump_path, stop_words, cache_path)
+    assert 0 == ingest_aggregates(dump_path, stop_words, cache_path)
+    etalon_year_scores = decoded(*build_aggregates(dump_path, stop_words))
+    assert etalon_year_scores == decoded(*load_aggregates(dump_path, stop_words, path_cache=cache_path))
+
+def test_post_table_keeps_unordered_posts():
+    post_table = PostTable()
+    for post_id in [5, 7, 3, 6]:
+        post_table.append(post_id, 2019, post_id, [post_id])
+    post_table.update(post_table.find(7), 2020, 1, [1, 2])
+    assert [-1, 0, 3] == [post_table.find(post_id) for post_id in [4, 5, 6]]
+    table = PostTable.from_arrays(post_table.arrays())
+    assert [3, 5, 6, 7] == list(table.ids)
+    year, score, word_ids = table.row(table.find(7))
+    assert (2020, 1, [1, 2]) == (year, score, list(word_ids))
+
+def test_can_queries_with_cache(tmpdir, capsys):
+    process_queries(XML_PATH, STOP_WORDS_PATH, QUERIES_PATH)
+    etalon_out = capsys.readouterr().out
+    cache_path = str(tmpdir.join("posts.cache"))
+    for _ in range(2):
+        process_queries(XML_PATH, STOP_WORDS_PATH, QUERIES_PATH, path_cache=cache_path)
+        assert etalon_out == capsys.readouterr().out
+
+def assert_space_saving_bounds(sketch, true_scores):
+    for word, score in true_scores.items():
+        if word in sketch.counts:
+            assert sketch.counts[word] - sketch.errors[word] <= score <= sketch.counts[word]
+        else:
+            assert score <= sketch.floor()
+
+@pytest.mark.parametrize("capacity", [5, 20, 1000])
+def test_space_saving_bounds_hold_after_merge(capacity):
+    generator = random.Random(capacity)
+    sketches = []
+    true_scores = {}
+    for _ in range(3):
+        sketch = SpaceSaving(capacity)
+        for _ in range(2000):
+            word, score = f"word{int(generator.paretovariate(1.2))}", generator.randint(0, 10)
+            sketch.update(word, score)
+            true_scores[word] = true_scores.get(word, 0) + score
+        assert len(sketch) <= capacity
+        sketches.append(sketch)
+    merged = SpaceSaving.merge(sketches, capacity)
+    assert len(merged) <= capacity
+    assert_space_saving_bounds(merged, true_scores)
+    if capacity >= len(true_scores):
+        assert true_scores == merged.counts
+
+def test_space_saving_is_exact_with_negative_scores_below_capacity():
+    generator = random.Random(7)
+    sketch = SpaceSaving(1000)
+    true_scores = {}
+    for _ in range(5000):
+        word, score = f"word{generator.randint(0, 50)}", generator.randint(-5, 20)
+        sketch.update(word, score)
+        true_scores[word] = true_scores.get(word, 0) + score
+    assert true_scores == sketch.counts
+    assert all(error == 0 for error in sketch.errors.values())
+
+def test_can_queries_approximately(capsys):
+    process_queries(XML_PATH, STOP_WORDS_PATH, QUERIES_PATH)
+    etalon_answers = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    process_queries(XML_PATH, STOP_WORDS_PATH, QUERIES_PATH, approximate_capacity=1000)
+    answers = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [answer["top"] for answer in etalon_answers] == [answer["top"] for answer in answers]
+    assert all(answer["errors"] == [0] * len(answer["top"]) for answer in answers)
+
 def test_can_return_top():
     xml = get_xml(XML_PATH)
     stop_words = get_stop_words(STOP_WORDS_PATH)
@@ -30,6 +279,13 @@ def test_can_return_top():
     assert 'дед' == top[1][0]
     assert 15 == top[1][1]
 
+@pytest.mark.parametrize("top_n", [0, 1, 5, 100, 1000])
+def test_top_for_query_breaks_ties_by_word(top_n):
+    generator = random.Random(top_n)
+    score = {f"word{number}": generator.randint(-5, 5) for number in range(300)}
+    etalon_top = sorted(([word, word_score] for word, word_score in score.items()), key=lambda item: (-item[1], item[0]))
+    assert etalon_top[:top_n] == top_for_query(score, top_n, 2019, 2019)
+
 def test_can_print_answer(capsys):
     xml = get_xml(XML_PATH)
     stop_words = get_stop_words(STOP_WORDS_PATH)
@@ -39,6 +295,53 @@ def test_can_print_answer(capsys):
     captured = capsys.readouterr()
     assert "баба" in captured.out
 
+@pytest.mark.parametrize("output_format", ["ndjson", "binary"])
+def test_can_write_answers_to_file(tmpdir, capsys, output_format):
+    process_queries(XML_PATH, STOP_WORDS_PATH, QUERIES_PATH)
+    etalon_answers = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    output = tmpdir.join("answers")
+    process_queries(XML_PATH, STOP_WORDS_PATH, QUERIES_PATH, path_output=str(output), output_format=output_format)
+    assert "" == capsys.readouterr().out
+    raw = output.read_binary()
+    if output_format == "ndjson":
+        answers = [json.loads(line) for line in raw.decode("utf-8").splitlines()]
+    else:
+        answers = []
+        offset = 0
+        while offset < len(raw):
+            size, = struct.unpack_from(">I", raw, offset)
+            answers.append(json.loads(raw[offset + 4:offset + 4 + size].decode("utf-8")))
+            offset += 4 + size
+    assert etalon_answers == answers
+
+def test_result_writer_flushes_full_buffer(tmpdir):
+    output = tmpdir.join("answers")
+    writer = ResultWriter(str(output), buffer_size=16)
+    writer.write({"top": []})
+    assert b"" == output.read_binary()
+    writer.write({"top": [["да", 1]]})
+    assert '{"top": []}\n{"top": [["да", 1]]}\n' == output.read_text("utf-8")
+    writer.close()
+
+def test_benchmark_dump_is_reproducible(tmpdir):
+    first, second = str(tmpdir.join("first.xml")), str(tmpdir.join("second.xml"))
+    generate_dump(first, 100, seed=1)
+    generate_dump(second, 100, seed=1)
+    with open(first) as first_file, open(second) as second_file:
+        assert first_file.read() == second_file.read()
+    posts = list(iter_posts(first))
+    assert 0 < len(posts) < 100
+    assert all(title for _, _, _, title in posts)
+
+def test_benchmark_reports_every_stage(tmpdir, capsys):
+    records = run_benchmark([300], vocabulary_size=200, queries_count=10, workdir=str(tmpdir))
+    json.dumps(records)
+    assert ["generate", "build", "save_cache", "load_cache", "query", "process_queries",
+            "build_approximate", "query_approximate"] == [record["stage"] for record in records]
+    query = records[4]
+    assert 10 == query["operations"] and query["p50_ms"] <= query["p99_ms"]
+    assert "" == capsys.readouterr().out
+
 def test_can_queries(capsys):
     process_queries(XML_PATH, STOP_WORDS_PATH, QUERIES_PATH)
     captured = capsys.readouterr()